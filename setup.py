@@ -45,6 +45,7 @@ setup(
     packages=find_packages("src"),
     package_dir={"": "src"},
     install_requires=reqs,
+    extras_require={"zstd": ["zstandard"]},
     include_package_data=True,
     scripts=["scripts/te"],
     data_files=[
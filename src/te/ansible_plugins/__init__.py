@@ -0,0 +1 @@
+"""Ansible plugins used by te, loaded by Ansible from this directory."""
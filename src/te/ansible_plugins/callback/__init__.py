@@ -0,0 +1 @@
+"""Ansible callback plugins used by te."""
@@ -0,0 +1,128 @@
+"""Ansible callback plugin sending events to te as JSON lines.
+
+Every line is a JSON object with `event` key:
+
+- `task_start` with `name` of the task and `time` of the start
+- `result` with `host`, `status` (ok, changed, failed, ignored, skipped or
+  unreachable), `rc` of the module if any, `duration` of the task on the
+  host in seconds and human readable `output`
+- `stats` with `time` of the end of the playbook
+
+When `TE_EVENTS_FD` environment variable is set, the events are written to
+that file descriptor and the callback is enabled next to the stdout
+callback, `output` is then sent only for failures. Otherwise the callback
+is the stdout callback and prints the events. The variable is removed from
+the environment, so that processes run by the playbook don't inherit it,
+the callback is disabled in them unless it's their stdout callback.
+"""
+
+import json
+import os
+import time
+
+from ansible import constants as C
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: te_events
+    type: aggregate
+    short_description: JSON lines with events of tasks for te
+    description:
+        - Writes one JSON object per line for start of each task, result of
+          task on each host and end of playbook.
+        - Can be used also as stdout callback.
+    requirements:
+        - enable in configuration
+"""
+
+
+class CallbackModule(CallbackBase):
+    """Callback sending events of tasks as JSON lines."""
+
+    CALLBACK_VERSION = 2.0
+    # can also be selected as the stdout callback by its name
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "te_events"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        """Initialize callback."""
+        super().__init__()
+        self._task_started = time.monotonic()
+        self._stream = None
+        # processes started by the playbook (local tasks, nested playbooks)
+        # must not write to the descriptor
+        events_fd = os.environ.pop("TE_EVENTS_FD", None)
+        if events_fd:
+            try:
+                # pylint: disable=consider-using-with
+                self._stream = os.fdopen(int(events_fd), "w", buffering=1)
+                os.set_inheritable(self._stream.fileno(), False)
+            except (OSError, ValueError):
+                self.disabled = True
+        elif C.DEFAULT_STDOUT_CALLBACK != self.CALLBACK_NAME:
+            # enabled next to stdout callback of a playbook run by a playbook
+            # of te, events would be mixed into its output
+            self.disabled = True
+
+    def _emit(self, event, **fields):
+        fields["event"] = event
+        line = json.dumps(fields, separators=(",", ":"))
+        if self._stream is None:
+            self._display.display(line)
+        else:
+            self._stream.write(line + "\n")
+
+    def _output(self, host, status, result, action):
+        """Format result like minimal callback of ansible command."""
+        if self._stream is None:
+            self._handle_warnings(result)
+        if action in C.MODULE_NO_JSON and "ansible_job_id" not in result:
+            output = f"{host} | {status.upper()} | rc={result.get('rc', -1)} >>"
+            for stream in ("stdout", "stderr", "msg"):
+                if result.get(stream):
+                    output += f"\n{result[stream]}"
+            return output
+        self._clean_results(result, action)
+        return f"{host} | {status.upper()} => {self._dump_results(result, indent=4)}"
+
+    def _result(self, status, result):
+        host = result._host.get_name()
+        # the result is shared with the stdout callback
+        res = dict(result._result)
+        fields = {
+            "host": host,
+            "status": status,
+            "rc": res.get("rc"),
+            "duration": round(time.monotonic() - self._task_started, 6),
+        }
+        if self._stream is None or status in ("failed", "unreachable"):
+            fields["output"] = self._output(host, status, res, result._task.action)
+        self._emit("result", **fields)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        """Announce start of task."""
+        self._task_started = time.monotonic()
+        self._emit("task_start", name=task.get_name(), time=time.time())
+
+    def v2_runner_on_ok(self, result):
+        """Report successful result."""
+        self._result("changed" if result._result.get("changed") else "ok", result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        """Report failed result."""
+        self._result("ignored" if ignore_errors else "failed", result)
+
+    def v2_runner_on_skipped(self, result):
+        """Report skipped task."""
+        self._result("skipped", result)
+
+    def v2_runner_on_unreachable(self, result):
+        """Report unreachable host."""
+        self._result("unreachable", result)
+
+    def v2_playbook_on_stats(self, stats):
+        """Announce end of playbook."""
+        self._emit("stats", time=time.time())
+        if self._stream is not None:
+            self._stream.flush()
@@ -0,0 +1,143 @@
+"""Resident worker running ansible and ansible-playbook commands for te.
+
+The worker is run by the Python interpreter of Ansible, so it must not
+import te. It imports Ansible once and then forks a child for every
+request, the child runs the command from the already loaded interpreter.
+Children don't share any state as the worker itself never runs a command.
+
+Requests and replies are JSON messages on a SOCK_SEQPACKET socket given as
+the only argument:
+
+- request `{"id", "program", "argv", "cwd"}` with the write end of the pipe
+  for the command output attached as a file descriptor, optionally followed
+  by the write end of the pipe for te_events callback
+- reply `{"id", "pid"}` once the child is started, its pid is also id of
+  its process group
+- reply `{"id", "rc", "utime", "stime", "maxrss", "inherited"}` once the
+  child exits, `inherited` is peak RSS of the worker once it forked the
+  child, `maxrss` of the child starts at it
+- `{"ready": true}` or `{"error": message}` once after start
+"""
+
+import json
+import os
+import resource
+import select
+import socket
+import sys
+import traceback
+
+# command line interfaces by program name
+CLIS = {
+    "ansible": ("ansible.cli.adhoc", "AdHocCLI"),
+    "ansible-playbook": ("ansible.cli.playbook", "PlaybookCLI"),
+}
+
+
+def load_clis():
+    """Import command line interfaces and the most of Ansible with them."""
+    clis = {}
+    for program, (module_name, class_name) in CLIS.items():
+        module = __import__(module_name, fromlist=[class_name])
+        clis[program] = getattr(module, class_name)
+    # pylint: disable=import-outside-toplevel,unused-import
+    import ansible.executor.playbook_executor  # noqa: F401
+    import ansible.plugins.connection.ssh  # noqa: F401
+
+    return clis
+
+
+def run_child(cli, request, output_fd, events_fd=None):
+    """Run command of request in forked child, never returns."""
+    rc = 250
+    try:
+        os.setpgid(0, 0)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(output_fd, 1)
+        os.dup2(output_fd, 2)
+        os.chdir(request["cwd"])
+        if events_fd is not None:
+            os.environ["TE_EVENTS_FD"] = str(events_fd)
+        sys.argv = request["argv"]
+        if hasattr(cli, "cli_executor"):
+            rc = cli.cli_executor(request["argv"])
+        else:
+            rc = cli(request["argv"]).run()
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(rc or 0)  # pylint: disable=protected-access
+
+
+def reap(sock, children):
+    """Report exits of finished children."""
+    while children:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        request_id, inherited = children.pop(pid)
+        reply = {
+            "id": request_id,
+            "rc": os.waitstatus_to_exitcode(status),
+            "utime": rusage.ru_utime,
+            "stime": rusage.ru_stime,
+            "maxrss": rusage.ru_maxrss,
+            "inherited": inherited,
+        }
+        sock.send(json.dumps(reply).encode("utf-8"))
+
+
+def main():
+    """Serve requests until the socket is closed."""
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    try:
+        clis = load_clis()
+    except Exception:  # pylint: disable=broad-except
+        sock.send(json.dumps({"error": traceback.format_exc()}).encode("utf-8"))
+        return
+    sock.send(b'{"ready": true}')
+
+    children = {}
+    while True:
+        # children are reaped by polling, so the worker has only one thread
+        # and forking it is safe
+        readable, _, _ = select.select([sock], [], [], 0.05 if children else None)
+        reap(sock, children)
+        if not readable:
+            continue
+        data, fds, _, _ = socket.recv_fds(sock, 65536, 2)
+        if not data:
+            break
+        request = json.loads(data)
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            run_child(clis[request["program"]], request, *fds)
+        # also set in the parent, so the group exists once pid is replied
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+        for fd in fds:
+            os.close(fd)
+        children[pid] = (
+            request["id"],
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+        sock.send(json.dumps({"id": request["id"], "pid": pid}).encode("utf-8"))
+
+    while children:
+        pid, _ = os.wait()
+        children.pop(pid, None)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,28 +15,165 @@
 """te default CLI tool."""
 
 import argparse
+import atexit
 import logging
+import os
 import sys
 
-from te.common.config import DEFAULT_PHASE_TIMEOUT, config
+from te.common.config import DEFAULT_MAX_PARALLEL, DEFAULT_PHASE_TIMEOUT, config
 from te.common.exceptions import BrokenInstallation, PlaybookNotFound, TimeoutException
-from te.common.log import ColorHandler
-from te.common.metadata import get_metadata_path, get_phase, get_phases_upto
-from te.common.runner import run_phases
-from te.common.yml import read_yaml
-from te.steps import register_steps
+from te.common.log import (
+    BufferedFileHandler,
+    ColorHandler,
+    LogWriter,
+    PrefixFilter,
+    QueueHandler,
+)
+from te.common.profiling import Profiler, enable_counters, log_counters
 
 logger = logging.getLogger("")
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s %(message)s", "%Y-%m-%dT%H:%M:%S%z")
-file_handler = logging.FileHandler("runner.log")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(ColorHandler())
+
+
+def setup_logging(compression=None, hold=False):
+    """Log into runner.log in working directory and to colorized output.
+
+    Records are written by a background writer in batches, so that logging
+    of chatty commands doesn't slow down te.
+
+    :param compression: compression of runner.log, see `te.common.logfiles`
+    :param hold: don't write runner.log until `rotate_logs` is called
+    """
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(
+        "%(asctime)s %(prefix)s%(message)s", "%Y-%m-%dT%H:%M:%S%z"
+    )
+    file_handler = BufferedFileHandler("runner.log", compression, hold)
+    file_handler.setFormatter(formatter)
+    writer = LogWriter([file_handler, ColorHandler(buffered=True)])
+    writer.start()
+    # runs before logging.shutdown as atexit handlers run in reverse order
+    atexit.register(writer.stop)
+    queue_handler = QueueHandler(writer)
+    queue_handler.addFilter(PrefixFilter())
+    logger.addHandler(queue_handler)
+    # event loop of process engine logs internals on debug level
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    return writer
+
+
+def rotate_logs(writer, keep=None):
+    """Rotate runner.log and outputs of steps of previous runs.
+
+    Without `keep` runner.log is appended and outputs of steps are
+    overwritten by steps run again. Runner.log held by `setup_logging` is
+    written since then.
+
+    :param keep: number of logs of previous runs kept
+    """
+    # pylint: disable=import-outside-toplevel
+    from te.common.logfiles import rotate
+    from te.common.output import logs_dir
+
+    if keep:
+        for path in ("runner.log", logs_dir()):
+            rotate(path, keep, config["log_max_bytes"])
+    for handler in writer.handlers:
+        if isinstance(handler, BufferedFileHandler):
+            handler.write_held()
+
+
+def cache_command(argv):
+    """Manage caches in test working directory."""
+    # pylint: disable=import-outside-toplevel
+    from te.common.cache import CACHES, clear_caches
+
+    parser = argparse.ArgumentParser(
+        prog="te cache", description="Manage caches in test working directory."
+    )
+    actions = parser.add_subparsers(dest="action", required=True)
+    clear = actions.add_parser("clear", help="Remove cached data")
+    clear.add_argument(
+        "caches",
+        nargs="*",
+        choices=CACHES + ("all",),
+        default="all",
+        help="Caches to remove, all by default",
+    )
+
+    args = parser.parse_args(argv)
+    writer = setup_logging()
+    if "all" in args.caches:
+        clear_caches()
+    else:
+        clear_caches(args.caches)
+    writer.stop()
+
+
+def logs_command(argv):
+    """Print logs of a run, decompressed."""
+    parser = argparse.ArgumentParser(
+        prog="te logs",
+        description="Print runner.log or outputs of steps of a run. "
+        "Outputs of steps are printed when --phase or --step is used.",
+    )
+    parser.add_argument(
+        "--run",
+        type=int,
+        default=0,
+        help="Number of previous run, 0 (default) is the last run",
+    )
+    parser.add_argument("--phase", help="Phase name, shell-style pattern")
+    parser.add_argument("--step", help="Step name, shell-style pattern")
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Only list output files of steps",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        _print_logs(parser, args, sys.stdout.buffer)
+    except BrokenPipeError:
+        # output closed early, e.g. piped to head, discard the rest
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def _print_logs(parser, args, output):
+    """Print logs selected by arguments of `te logs`."""
+    # pylint: disable=import-outside-toplevel
+    from te.common.logfiles import copy_log, find_step_logs, run_logs
+    from te.common.output import logs_dir
+
+    if not (args.phase or args.step or args.list):
+        paths = [path for number, path in run_logs("runner.log") if number == args.run]
+        if not paths:
+            parser.exit(1, f"No runner.log of run {args.run}\n")
+        for path in paths:
+            copy_log(path, output)
+        return
+
+    directories = [path for number, path in run_logs(logs_dir()) if number == args.run]
+    if not directories:
+        parser.exit(1, f"No step outputs of run {args.run}\n")
+    step_logs = find_step_logs(directories[0], args.phase or "*", args.step or "*")
+    for phase, step, path in step_logs:
+        if args.list:
+            output.write(f"{path}\n".encode("utf-8"))
+            continue
+        output.write(f"==> {phase}/{step} <==\n".encode("utf-8"))
+        copy_log(path, output)
+    output.flush()
 
 
 def run():
     """Run the te's CLI."""
+    if sys.argv[1:2] == ["cache"]:
+        cache_command(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["logs"]:
+        logs_command(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="""
     Run steps as defined in metadata.
@@ -63,8 +200,10 @@ def run():
     )
 
     group = parser.add_mutually_exclusive_group()
-    group.add_argument("--upto", help="Run all phases up to defined phase")
-    group.add_argument("--phase", help="Run only this phase")
+    group.add_argument("--upto", help="Run defined phase and all phases it depends on")
+    group.add_argument(
+        "--phase", help="Run only this phase and phases listed in its needs"
+    )
 
     parser.add_argument(
         "--phase-timeout",
@@ -73,25 +212,125 @@ def run():
         help=f"Default phase timeout is " f"{DEFAULT_PHASE_TIMEOUT} seconds",
         default=DEFAULT_PHASE_TIMEOUT,
     )
+    parser.add_argument(
+        "--max-parallel",
+        dest="max_parallel",
+        type=int,
+        help=f"Default limit of concurrently running phases and steps "
+        f"({DEFAULT_MAX_PARALLEL})",
+        default=DEFAULT_MAX_PARALLEL,
+    )
+
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="Skip steps which succeeded in previous run with the same definition",
+    )
+
+    parser.add_argument(
+        "--report",
+        help="Path of JSON report with results and resource usage of phases "
+        "and steps, .te/report.json by default",
+    )
+    parser.add_argument(
+        "--junit-xml",
+        dest="junit_xml",
+        help="Path of the report in JUnit XML format",
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="Path of trace of the run in Chrome trace event format, "
+        "can be viewed in https://ui.perfetto.dev",
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Path of profile of te itself, pstats file of cProfile or sampled "
+        "stacks in collapsed format if the path ends with .collapsed or .folded",
+    )
+
+    parser.add_argument(
+        "--ansible-executor",
+        dest="ansible_executor",
+        choices=["process", "worker"],
+        default=config["ansible_executor"],
+        help="Run Ansible commands as processes or in resident workers with "
+        "Ansible already loaded",
+    )
+    parser.add_argument(
+        "--ansible-output",
+        dest="ansible_output",
+        choices=["full", "condensed"],
+        default=config["ansible_output"],
+        help="Print full output of playbooks or a line per task with failures, "
+        "full output is always in output files of steps",
+    )
+
+    parser.add_argument(
+        "--log-compression",
+        dest="log_compression",
+        choices=["gzip", "zstd"],
+        help="Compress runner.log and outputs of steps, zstd needs zstandard "
+        "package",
+    )
+    parser.add_argument(
+        "--log-keep",
+        dest="log_keep",
+        type=int,
+        default=config["log_keep"],
+        help="Rotate logs of each run keeping this number of logs of previous "
+        "runs, by default runner.log is appended",
+    )
 
     args = parser.parse_args()
 
+    # pylint: disable=import-outside-toplevel
+    from te.common.logfiles import check_compression
+
+    try:
+        check_compression(args.log_compression)
+    except RuntimeError as e:
+        parser.error(str(e))
+    config["log_compression"] = args.log_compression
+    writer = setup_logging(args.log_compression, hold=True)
+
+    profiler = None
+    if args.profile:
+        enable_counters()
+        profiler = Profiler(args.profile)
+        profiler.start()
+
+    # Imported only when really needed to keep start of CLI fast
+    from te.common.journal import Journal
+    from te.common.metadata import (
+        get_metadata_path,
+        get_phases_needed,
+        get_phases_upto,
+        read_metadata,
+    )
+    from te.common.report import RunReport, default_report_path
+    from te.common.runner import run_phases
+    from te.common.trace import tracer
+    from te.steps import register_steps
+
     config["dry_run"] = args.dry_run
     config["print_timestamp"] = args.timestamp
     config["phase_timeout"] = args.phase_timeout
+    config["max_parallel"] = args.max_parallel
+    config["ansible_executor"] = args.ansible_executor
+    config["ansible_output"] = args.ansible_output
 
     metadata_path = get_metadata_path(args.metadata)
 
-    metadata = read_yaml(metadata_path)
+    metadata = read_metadata(metadata_path)
+    config["ansible"] = metadata.get("ansible", {})
 
     if args.upto:
         phases = get_phases_upto(metadata, args.upto)
     elif args.phase:
-        phase = get_phase(metadata, args.phase)
-        if phase:
-            phases = [phase]
-        else:
-            phases = []
+        phases = get_phases_needed(metadata, args.phase, implicit=False)
     else:
         phases = metadata.get("phases", [])
 
@@ -99,11 +338,21 @@ def run():
         logger.error("No phase to run found")
         sys.exit(1)
 
+    # logs of previous runs are kept by runs which don't run anything
+    rotate_logs(writer, None if args.dry_run else args.log_keep)
+
     register_steps()
 
+    if args.trace:
+        tracer.enable()
+
     rc = 1  # Default for most errors
+    report = RunReport()
     try:
-        rc = run_phases(phases, metadata, metadata_path, args.phase_timeout)
+        journal = Journal(resume=args.resume)
+        rc = run_phases(
+            phases, metadata, metadata_path, args.phase_timeout, journal, report
+        )
     except PlaybookNotFound as e:
         logger.error(f"Ansible playbook not found: {e.playbook}")
     except RuntimeError as e:
@@ -115,6 +364,17 @@ def run():
     except Exception as e:  # pylint: disable=W0703
         logger.error(e, exc_info=True)
 
+    if profiler is not None:
+        profiler.stop()
+        log_counters()
+    if args.trace:
+        tracer.write(args.trace)
+    if not config["dry_run"]:
+        report.write_json(args.report or default_report_path(), rc)
+        if args.junit_xml:
+            report.write_junit(args.junit_xml, rc)
+
+    writer.stop()
     sys.exit(rc)
 
 
@@ -1,17 +1,262 @@
 """Module for Ansible related helper functions."""
 
+import ast
+import functools
+import hashlib
 import json
+import logging
 import os
+import shutil
+import subprocess
+import threading
+
+from te.common.cache import evict_lru, write_atomic
+from te.common.config import config
+from te.common.inventory import get_inventory
+from te.common.paths import state_dir, test_dir
+from te.common.ssh import pool
+
+logger = logging.getLogger(__name__)
+# forks of Ansible when not set in metadata, based on number of hosts
+MIN_FORKS = 5
+MAX_FORKS = 50
+# files with extra vars kept in state directory
+VARS_FILES = 1000
+# exit codes of Ansible for failed and unreachable hosts
+RC_FAILED = 2
+RC_UNREACHABLE = 4
+ANSIBLE_CONFIG_PROGRAM = "ansible-config"
+# seconds for ansible-config to dump the configuration
+CONFIG_TIMEOUT = 60
+# fact caches already cleared in this run
+_facts_cleared = set()
+_facts_lock = threading.Lock()
+
+
+def extra_vars_file(extra_vars):
+    """Get path of file with extra vars named by digest of its content.
+
+    Commands with the same extra vars share the file, it's written only
+    once. Least recently used files are removed over `VARS_FILES`.
+    """
+    data = json.dumps(extra_vars, separators=(",", ":"), sort_keys=True)
+    data = data.encode("utf-8")
+    directory = state_dir("vars")
+    path = os.path.join(directory, f"{hashlib.sha256(data).hexdigest()}.json")
+    try:
+        # mark the file as recently used for eviction
+        os.utime(path)
+    except FileNotFoundError:
+        write_atomic(path, data)
+        evict_lru(directory, ".json", max_entries=VARS_FILES)
+    return path
 
 
 def add_extra_vars_option(cmd, extra_vars, position):
-    """Add extra vars option in command list on given position."""
-    cmd[position:position] = ["-e", json.dumps(extra_vars, separators=(",", ":"))]
+    """Add extra vars option in command list on given position.
+
+    Extra vars are passed in a file (see `extra_vars_file`), so that the
+    command line stays short whatever their size.
+    """
+    cmd[position:position] = ["-e", f"@{extra_vars_file(extra_vars)}"]
+
+
+@functools.lru_cache(maxsize=None)
+def _dump_config(key):
+    """Get callback settings of Ansible, see `callback_config`."""
+    env, cwd = json.loads(key)
+    env["ANSIBLE_NOCOLOR"] = "1"
+    try:
+        result = subprocess.run(
+            [ANSIBLE_CONFIG_PROGRAM, "dump"],
+            env=env,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            timeout=CONFIG_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug(f"Unable to get Ansible configuration: {e}")
+        return None
+    settings = {}
+    for line in result.stdout.decode("utf-8", "replace").splitlines():
+        # NAME(origin) = value
+        name, _, rest = line.partition("(")
+        if name in ("CALLBACKS_ENABLED", "DEFAULT_CALLBACK_PLUGIN_PATH"):
+            try:
+                settings[name] = ast.literal_eval(rest.partition(" = ")[2])
+            except (SyntaxError, ValueError):
+                pass
+    return settings
+
+
+def callback_config(env, cwd=None):
+    """Get enabled callbacks and callback plugin paths in effect for Ansible.
+
+    Settings are read by `ansible-config dump` with `env` in `cwd`, so they
+    include those of ansible.cfg, and cached. Only `env` is used in dry run
+    or when Ansible configuration can't be read.
+
+    :return: tuple (list of enabled callbacks, list of plugin paths)
+    """
+    settings = None
+    if not config["dry_run"]:
+        settings = _dump_config(json.dumps([env, cwd or test_dir()], sort_keys=True))
+    if settings is None:
+        settings = {
+            "CALLBACKS_ENABLED": env.get("ANSIBLE_CALLBACKS_ENABLED", ""),
+            "DEFAULT_CALLBACK_PLUGIN_PATH": env.get("ANSIBLE_CALLBACK_PLUGINS", ""),
+        }
+    enabled = settings.get("CALLBACKS_ENABLED") or []
+    paths = settings.get("DEFAULT_CALLBACK_PLUGIN_PATH") or []
+    if isinstance(enabled, str):
+        enabled = [name for name in enabled.split(",") if name]
+    if isinstance(paths, str):
+        paths = [path for path in paths.split(os.pathsep) if path]
+    return list(enabled), list(paths)
+
+
+def _callback_plugins(paths):
+    """Get callback plugin paths for Ansible env including te plugins."""
+    plugins = os.path.join(
+        os.path.dirname(os.path.dirname(__file__)), "ansible_plugins"
+    )
+    return os.pathsep.join([os.path.join(plugins, "callback"), *paths])
+
+
+def events_callback_env(env, cwd=None):
+    """Get environment variables making te_events the stdout callback.
+
+    :param env: environment of Ansible, see `ansible_env`
+    :param cwd: working directory of Ansible, test directory by default
+
+    The callback prints one JSON object per line for each event, see
+    `te/ansible_plugins/callback/te_events.py`. Callback plugin paths of
+    Ansible configuration are kept, see `callback_config`.
+    """
+    _, paths = callback_config(env, cwd)
+    return {
+        "ANSIBLE_STDOUT_CALLBACK": "te_events",
+        "ANSIBLE_CALLBACK_PLUGINS": _callback_plugins(paths),
+    }
+
+
+def events_stream_env(env, cwd=None):
+    """Get environment variables enabling te_events next to stdout callback.
+
+    :param env: environment of Ansible, see `ansible_env`
+    :param cwd: working directory of Ansible, test directory by default
+
+    The callback writes events to file descriptor in `TE_EVENTS_FD`, which
+    is set for each command, see `te.common.ansible_worker.run_ansible`.
+    Enabled callbacks and callback plugin paths of Ansible configuration
+    are kept, see `callback_config`.
+    """
+    enabled, paths = callback_config(env, cwd)
+    if "te_events" not in enabled:
+        enabled.append("te_events")
+    return {
+        "ANSIBLE_CALLBACKS_ENABLED": ",".join(enabled),
+        "ANSIBLE_CALLBACK_PLUGINS": _callback_plugins(paths),
+    }
+
+
+def parse_event(line):
+    """Get event printed by te_events callback or None for other output."""
+    if not line.startswith("{"):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or "event" not in event:
+        return None
+    return event
+
+
+def task_rc(statuses):
+    """Get return code of task as of ansible command from statuses of hosts."""
+    if "unreachable" in statuses:
+        return RC_UNREACHABLE
+    if "failed" in statuses:
+        return RC_FAILED
+    return 0
+
+
+def default_forks():
+    """Get number of Ansible forks so that all hosts are handled at once."""
+    try:
+        hosts = len(get_inventory().hostnames())
+    except Exception:  # pylint: disable=broad-except
+        # missing or unexpected inventory, e.g. step has its own one
+        hosts = 0
+    return min(max(MIN_FORKS, hosts), MAX_FORKS)
+
+
+def facts_dir():
+    """Get directory of Ansible fact cache of the run.
+
+    Facts cached by a previous run are removed on the first use, hosts may
+    have changed since then.
+    """
+    path = state_dir("facts")
+    with _facts_lock:
+        if path not in _facts_cleared and not config["dry_run"]:
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path, exist_ok=True)
+            _facts_cleared.add(path)
+    return path
+
+
+def ansible_profile():
+    """Get environment of Ansible making consecutive Ansible calls cheap.
+
+    Facts are cached in test working directory for the run and gathered only
+    if not cached yet, SSH uses pipelining and persistent connections in
+    control directory shared with te's own SSH connections. Settings can be
+    changed in `ansible` mapping of metadata, see README.
+    """
+    settings = config["ansible"]
+    if not settings.get("profile", True):
+        return {}
+    env = {}
+    if settings.get("fact_cache", True):
+        env["ANSIBLE_GATHERING"] = "smart"
+        env["ANSIBLE_CACHE_PLUGIN"] = "jsonfile"
+        env["ANSIBLE_CACHE_PLUGIN_CONNECTION"] = facts_dir()
+        if "fact_cache_timeout" in settings:
+            env["ANSIBLE_CACHE_PLUGIN_TIMEOUT"] = str(settings["fact_cache_timeout"])
+    if settings.get("pipelining", True):
+        env["ANSIBLE_PIPELINING"] = "True"
+    persist = settings.get("control_persist", config["ssh_control_persist"])
+    if config["ssh_multiplexing"] and persist:
+        env["ANSIBLE_SSH_ARGS"] = f"-o ControlMaster=auto -o ControlPersist={persist}s"
+        env["ANSIBLE_SSH_CONTROL_PATH_DIR"] = pool.control_dir
+        # the same socket names (hash of host, port and user) as te uses,
+        # %% is unescaped by Ansible
+        env["ANSIBLE_SSH_CONTROL_PATH"] = "%(directory)s/%%C"
+    if settings.get("forks"):
+        env["ANSIBLE_FORKS"] = str(settings["forks"])
+    # hosts are counted only if forks aren't set otherwise
+    elif "ANSIBLE_FORKS" not in {**os.environ, **settings.get("env", {})}:
+        env["ANSIBLE_FORKS"] = str(default_forks())
+    return env
 
 
 def ansible_env():
-    """Get default environment for Ansible playbook based on current os env."""
+    """Get default environment for Ansible playbook based on current os env.
+
+    Variables of Ansible profile (see `ansible_profile`) already set in os
+    env are kept, variables in `env` of `ansible` mapping of metadata
+    override everything.
+    """
     my_env = os.environ.copy()
     my_env["ANSIBLE_STDOUT_CALLBACK"] = "yaml"
     my_env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+    for name, value in ansible_profile().items():
+        my_env.setdefault(name, value)
+    for name, value in config["ansible"].get("env", {}).items():
+        my_env[name] = str(value)
     return my_env
@@ -0,0 +1,121 @@
+"""Module for timings of Ansible tasks built from te_events events."""
+
+import logging
+
+from te.common.process import command_output
+
+logger = logging.getLogger(__name__)
+# statuses of hosts shown in condensed output of a task, in this order
+STATUSES = ("ok", "changed", "failed", "ignored", "skipped", "unreachable")
+# slowest tasks and hosts logged after a playbook
+SLOWEST = 5
+
+
+class PlaybookTimings:
+    """Timings of tasks and hosts of a playbook.
+
+    Events are handled in the process engine as they come (see
+    `te.common.ansible_worker.run_ansible`), the timings are read once the
+    playbook finishes.
+    """
+
+    def __init__(self, condensed=False):
+        """Initialize timings.
+
+        :param condensed: log a line per task and outputs of failures
+            instead of output of the stdout callback
+        """
+        self.condensed = condensed
+        self.tasks = []
+        self._task = None
+
+    def handle(self, event):
+        """Handle event of te_events callback."""
+        kind = event["event"]
+        if kind in ("task_start", "stats"):
+            self._end_task(event.get("time"))
+        if kind == "task_start":
+            self._task = {
+                "name": event.get("name", ""),
+                "start": event.get("time"),
+                "duration": 0.0,
+                "hosts": {},
+            }
+            self.tasks.append(self._task)
+        elif kind == "result" and self._task is not None:
+            self._task["hosts"][event.get("host")] = {
+                "status": event.get("status"),
+                "duration": event.get("duration") or 0.0,
+            }
+            if self.condensed and event.get("output"):
+                for line in event["output"].splitlines():
+                    command_output(line)
+
+    def _end_task(self, end):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        if end is not None and task["start"] is not None:
+            task["duration"] = end - task["start"]
+        else:
+            task["duration"] = max(
+                (host["duration"] for host in task["hosts"].values()), default=0.0
+            )
+        if self.condensed:
+            command_output(self.task_line(task))
+
+    @staticmethod
+    def task_line(task):
+        """Get condensed line of finished task with counts of statuses."""
+        counts = {}
+        for host in task["hosts"].values():
+            counts[host["status"]] = counts.get(host["status"], 0) + 1
+        statuses = " ".join(
+            f"{status}={counts[status]}" for status in STATUSES if status in counts
+        )
+        return f"TASK [{task['name']}] {task['duration']:.2f}s {statuses}".rstrip()
+
+    def slowest_tasks(self, count=SLOWEST):
+        """Get the slowest tasks as list of (duration, name)."""
+        durations = [(task["duration"], task["name"]) for task in self.tasks]
+        return sorted(durations, key=lambda item: item[0], reverse=True)[:count]
+
+    def slowest_hosts(self, count=SLOWEST):
+        """Get hosts with the longest total time of tasks.
+
+        :return: list of (seconds, host)
+        """
+        totals = {}
+        for task in self.tasks:
+            for host, result in task["hosts"].items():
+                totals[host] = totals.get(host, 0.0) + result["duration"]
+        durations = [(total, host) for host, total in totals.items()]
+        return sorted(durations, key=lambda item: item[0], reverse=True)[:count]
+
+    def log_summary(self):
+        """Log the slowest tasks and hosts."""
+        if not self.tasks:
+            return
+        logger.info("SLOWEST TASKS:")
+        for duration, name in self.slowest_tasks():
+            logger.info(f"  {duration:8.2f}s  {name}")
+        logger.info("SLOWEST HOSTS:")
+        for duration, host in self.slowest_hosts():
+            logger.info(f"  {duration:8.2f}s  {host}")
+
+    def as_list(self):
+        """Get timings of tasks for the run report."""
+        return [
+            {
+                "name": task["name"],
+                "duration": round(task["duration"], 3),
+                "hosts": {
+                    host: {
+                        "status": result["status"],
+                        "duration": round(result["duration"], 3),
+                    }
+                    for host, result in task["hosts"].items()
+                },
+            }
+            for task in self.tasks
+        ]
@@ -0,0 +1,330 @@
+"""Module for resident workers running Ansible commands.
+
+Starting ansible-playbook means starting Python interpreter and importing
+Ansible with its plugins, which takes seconds. A worker imports Ansible
+once and forks a child for each command, see `te/ansible_plugins/worker.py`.
+Workers are used when `ansible_executor` is "worker".
+"""
+
+import asyncio
+import atexit
+import functools
+import itertools
+import json
+import logging
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import types
+
+from te.common.ansible import parse_event
+from te.common.config import config
+from te.common.process import engine, own_rusage, read_output, run_async, wait_process
+from te.common.profiling import counted
+from te.common.trace import span
+
+logger = logging.getLogger(__name__)
+WORKER = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "ansible_plugins", "worker.py"
+)
+# seconds to wait for workers to finish on exit
+CLOSE_TIMEOUT = 10
+# seconds to wait for the rest of events once Ansible command exits
+EVENTS_TIMEOUT = 5
+
+
+def ansible_python(program):
+    """Get Python interpreter command of Ansible program from its shebang.
+
+    :return: list of arguments or None if program is not a Python script
+    """
+    path = shutil.which(program)
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as program_f:
+            line = program_f.readline(512).decode("utf-8", "replace")
+    except OSError:
+        return None
+    if not line.startswith("#!") or "python" not in line:
+        return None
+    return shlex.split(line[2:].strip())
+
+
+class AnsibleWorker:
+    """Resident process running Ansible commands in forked children.
+
+    Worker has fixed environment and working directory of its commands.
+    All methods run in the loop of the process engine.
+    """
+
+    def __init__(self, python, env, cwd):
+        """Worker initialization, the process is started by `start`.
+
+        :param python: command of Python interpreter with Ansible
+        :param env: environment of the worker and of its commands
+        :param cwd: working directory of the commands
+        """
+        self.python = python
+        self.env = env
+        self.cwd = cwd
+        self.dead = False
+        # worker loaded Ansible and served commands
+        self.served = False
+        self.process = None
+        self._sock = None
+        self._ready = None
+        self._ids = itertools.count()
+        # futures of started and exited children by request id
+        self._pending = {}
+
+    async def start(self):
+        """Start worker unless started and wait until it loads Ansible.
+
+        :return: True if the worker is ready to run commands
+        """
+        if self._ready is None:
+            self._ready = asyncio.get_running_loop().create_future()
+            self._spawn()
+        return await asyncio.shield(self._ready)
+
+    def _spawn(self):
+        parent_sock, child_sock = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET
+        )
+        try:
+            # pylint: disable=consider-using-with
+            self.process = subprocess.Popen(
+                [*self.python, WORKER, str(child_sock.fileno())],
+                pass_fds=[child_sock.fileno()],
+                env=self.env,
+                cwd=self.cwd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            parent_sock.close()
+            logger.warning(f"Ansible worker failed to start: {e}")
+            self.dead = True
+            self._ready.set_result(False)
+            return
+        finally:
+            child_sock.close()
+        parent_sock.setblocking(False)
+        self._sock = parent_sock
+        asyncio.get_running_loop().add_reader(parent_sock.fileno(), self._on_message)
+
+    def _on_message(self):
+        """Handle message from the worker."""
+        try:
+            data = self._sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return
+        message = json.loads(data)
+        if "ready" in message:
+            self.served = True
+            self._ready.set_result(True)
+        elif "error" in message:
+            logger.warning(
+                f"Ansible worker failed to load Ansible:\n{message['error']}"
+            )
+            self.close()
+        elif "pid" in message:
+            self._pending[message["id"]][0].set_result(message["pid"])
+        else:
+            rusage = own_rusage(
+                types.SimpleNamespace(
+                    ru_utime=message["utime"],
+                    ru_stime=message["stime"],
+                    ru_maxrss=message["maxrss"],
+                ),
+                message["inherited"],
+            )
+            self._pending[message["id"]][1].set_result((message["rc"], rusage))
+
+    def close(self):
+        """Stop serving commands, the worker exits once its children end.
+
+        Commands which haven't finished yet are reported as failed.
+        """
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        if self.served and not self.dead:
+            logger.debug("Ansible worker closed")
+        self.dead = True
+        if not self._ready.done():
+            self._ready.set_result(False)
+        empty = types.SimpleNamespace(ru_utime=0.0, ru_stime=0.0, ru_maxrss=None)
+        for started, exited in self._pending.values():
+            if not started.done():
+                started.set_exception(RuntimeError("Ansible worker exited"))
+            if not exited.done():
+                logger.error("Ansible worker exited before its command")
+                exited.set_result((1, empty))
+
+    async def run_async(self, cmd, timeout=None, on_line=None, events_fd=None):
+        """Run ansible or ansible-playbook command in the worker.
+
+        :param cmd: command as list, program name is the first item
+        :param timeout: seconds for the command to timeout
+        :param on_line: callable getting lines of the output, see
+            `te.common.process.run_async`
+        :param events_fd: write end of pipe for te_events callback
+        :return: exit code of the command
+        """
+        loop = asyncio.get_running_loop()
+        request_id = next(self._ids)
+        started = loop.create_future()
+        exited = loop.create_future()
+        request = {
+            "id": request_id,
+            "program": os.path.basename(cmd[0]),
+            "argv": cmd,
+            "cwd": self.cwd,
+        }
+        read_fd, write_fd = os.pipe()
+        fds = [write_fd] if events_fd is None else [write_fd, events_fd]
+        try:
+            socket.send_fds(self._sock, [json.dumps(request).encode("utf-8")], fds)
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._pending[request_id] = (started, exited)
+        try:
+            output, closed = await read_output(
+                loop, os.fdopen(read_fd, "rb", buffering=0), on_line
+            )
+            pid = await started
+            return await wait_process(pid, [exited, closed], output, timeout)
+        finally:
+            del self._pending[request_id]
+
+
+_workers = {}
+# programs which can't run in a worker
+_direct = set()
+
+
+async def _get_worker(program, run_args):
+    """Get ready worker for command, None if it can't be started."""
+    if program in _direct:
+        return None
+    python = ansible_python(program)
+    if python is None:
+        logger.warning(f"{program} is not a Python script, running it directly")
+        _direct.add(program)
+        return None
+    env = run_args.get("env") or dict(os.environ)
+    key = json.dumps([python, sorted(env.items()), run_args["cwd"]])
+    worker = _workers.get(key)
+    # worker which failed to start is not started again
+    if worker is None or worker.dead and worker.served:
+        if not _workers:
+            atexit.register(close_workers)
+        worker = _workers[key] = AnsibleWorker(python, env, run_args["cwd"])
+    if not await worker.start():
+        return None
+    return worker
+
+
+async def _run(cmd, run_args, timeout, on_line, events_fd):
+    """Run command in a worker or as a subprocess, see `run_ansible_async`."""
+    if config["ansible_executor"] == "worker" and not config["dry_run"]:
+        worker = await _get_worker(cmd[0], run_args)
+        if worker is not None:
+            with span(os.path.basename(cmd[0]), "ansible") as args:
+                args["cmd"] = " ".join(cmd)
+                args["rc"] = await worker.run_async(cmd, timeout, on_line, events_fd)
+            return args["rc"]
+    if events_fd is not None:
+        run_args = dict(run_args)
+        run_args["env"] = dict(run_args.get("env") or os.environ)
+        run_args["env"]["TE_EVENTS_FD"] = str(events_fd)
+        run_args["pass_fds"] = (events_fd,)
+    return await run_async(cmd, run_args, timeout, on_line=on_line)
+
+
+def _event_line(on_event, line):
+    event = parse_event(line)
+    if event is not None:
+        on_event(event)
+
+
+async def run_ansible_async(cmd, run_args, timeout=None, on_line=None, on_event=None):
+    """Run ansible or ansible-playbook command by the configured executor.
+
+    Command runs in a resident worker when `ansible_executor` is "worker",
+    as a subprocess otherwise or when the worker can't be used.
+
+    :param cmd: command as list
+    :param run_args: dict of Popen kwargs, worker uses only `env` and `cwd`
+    :param timeout: seconds for the command to timeout
+    :param on_line: callable getting lines of the output, see
+        `te.common.process.run_async`
+    :param on_event: callable getting events of te_events callback enabled
+        by `te.common.ansible.events_stream_env`, they are sent over a pipe
+        given in `TE_EVENTS_FD`
+    :return: exit code of the command
+    """
+    if on_event is None:
+        return await _run(cmd, run_args, timeout, on_line, None)
+
+    loop = asyncio.get_running_loop()
+    read_fd, events_fd = os.pipe()
+    _, events_closed = await read_output(
+        loop,
+        os.fdopen(read_fd, "rb", buffering=0),
+        functools.partial(_event_line, on_event),
+    )
+    try:
+        rc = await _run(cmd, run_args, timeout, on_line, events_fd)
+    finally:
+        os.close(events_fd)
+    try:
+        await asyncio.wait_for(asyncio.shield(events_closed), EVENTS_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.debug("Events of Ansible are still open after its exit")
+    return rc
+
+
+@counted("ansible.run")
+def run_ansible(cmd, run_args, timeout=None, on_line=None, on_event=None):
+    """Run ansible or ansible-playbook command, see `run_ansible_async`."""
+    return engine.submit(
+        run_ansible_async(cmd, run_args, timeout, on_line, on_event)
+    ).result()
+
+
+async def _close_all():
+    for worker in _workers.values():
+        if not worker.dead:
+            worker.close()
+
+
+def close_workers():
+    """Close all workers and wait for them to exit."""
+    if not _workers:
+        return
+    engine.submit(_close_all()).result()
+    for worker in _workers.values():
+        if worker.process is None:
+            continue
+        try:
+            worker.process.wait(CLOSE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+            worker.process.wait()
+    _workers.clear()
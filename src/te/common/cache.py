@@ -0,0 +1,128 @@
+"""Module for on-disk caches in test working directory."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from te.common.paths import STATE_DIR, state_dir, test_dir
+
+logger = logging.getLogger(__name__)
+# bytes of step outputs kept in result cache
+RESULT_CACHE_SIZE = 64 * 1024 * 1024
+# names of cache directories in state directory
+CACHES = ("results", "metadata", "downloads", "facts", "vars")
+
+
+def write_atomic(path, data):
+    """Write bytes to file so that readers never see it incomplete."""
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=os.path.dirname(path), suffix=".tmp", delete=False
+    ) as temp_f:
+        try:
+            temp_f.write(data)
+        except BaseException:
+            os.remove(temp_f.name)
+            raise
+    os.replace(temp_f.name, path)
+
+
+def evict_lru(cache_dir, suffix, max_entries=None, max_bytes=None, keep=None):
+    """Remove least recently used cache files over the limits.
+
+    Files with the same name and `.json` suffix are removed together with
+    the evicted ones. File at path `keep` (e.g. just written) is never
+    removed, it still counts to the limits.
+    """
+    entries = sorted(
+        (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+        for entry in os.scandir(cache_dir)
+        if entry.name.endswith(suffix)
+    )
+    total = sum(size for _, size, _ in entries)
+    count = len(entries)
+    entries = [entry for entry in entries if entry[2] != keep]
+    while entries and (
+        (max_entries is not None and count > max_entries)
+        or (max_bytes is not None and total > max_bytes)
+    ):
+        _, size, path = entries.pop(0)
+        total -= size
+        count -= 1
+        for related in (path, os.path.splitext(path)[0] + ".json"):
+            if os.path.exists(related):
+                os.remove(related)
+
+
+def inputs_digest(*inputs):
+    """Get sha256 hex digest identifying all inputs.
+
+    :param inputs: str or bytes values, None for a missing input
+    """
+    digest = hashlib.sha256()
+    for value in inputs:
+        if value is None:
+            value = b"\0"
+        elif isinstance(value, str):
+            value = value.encode("utf-8")
+        # length prefix keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(len(value).to_bytes(8, "little"))
+        digest.update(value)
+    return digest.hexdigest()
+
+
+def read_input(path):
+    """Get content of input file or None if it doesn't exist."""
+    try:
+        with open(path, "rb") as input_f:
+            return input_f.read()
+    except FileNotFoundError:
+        return None
+
+
+class ResultCache:
+    """Cache of outputs of successful steps addressed by digest of inputs."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_SIZE):
+        """Cache initialization.
+
+        :param max_bytes: size of entries kept, least recently used are
+            evicted over it
+        """
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _path(key):
+        return os.path.join(state_dir("results"), f"{key}.result")
+
+    def get(self, key):
+        """Get output lines stored for `key` or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as result_f:
+                entry = json.loads(result_f.read())
+        except (OSError, ValueError):
+            return None
+        # mark the entry as recently used for eviction
+        os.utime(path)
+        return entry["output"]
+
+    def put(self, key, output):
+        """Store output lines of a successful step for `key`."""
+        path = self._path(key)
+        write_atomic(path, json.dumps({"output": output}).encode("utf-8"))
+        evict_lru(os.path.dirname(path), ".result", max_bytes=self.max_bytes)
+
+
+def clear_caches(names=CACHES):
+    """Remove caches in state directory of test working directory.
+
+    :param names: names of caches to remove, see `CACHES`
+    """
+    for name in names:
+        path = os.path.join(test_dir(), STATE_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            logger.info(f"Removed cache: {path}")
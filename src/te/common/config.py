@@ -1,11 +1,32 @@
 """Configuration module."""
 
 DEFAULT_PHASE_TIMEOUT = 4 * 60 * 60
+DEFAULT_MAX_PARALLEL = 32
 
 
 config = {
     "dry_run": False,
     "print_timestamp": False,
     "phase_timeout": DEFAULT_PHASE_TIMEOUT,
+    "max_parallel": DEFAULT_MAX_PARALLEL,
     "private_key_path": "config/id_rsa",
+    "ssh_multiplexing": True,
+    # seconds for which idle SSH master connection is kept open
+    "ssh_control_persist": 600,
+    # how multi-line remote commands get to the host: "stdin" or "scp"
+    "script_transfer": "stdin",
+    # lines of output of a step kept in memory for failure summary
+    "output_tail_lines": 20,
+    # compression of runner.log and step outputs: None, "gzip" or "zstd"
+    "log_compression": None,
+    # number of logs of previous runs kept, None to append runner.log
+    "log_keep": None,
+    # total bytes of logs of previous runs kept
+    "log_max_bytes": 1024 * 1024 * 1024,
+    # how Ansible commands run: "process" or "worker", see ansible_worker
+    "ansible_executor": "process",
+    # output of playbooks: "full" or "condensed" to a line per task
+    "ansible_output": "full",
+    # Ansible settings from metadata, see te.common.ansible.ansible_profile
+    "ansible": {},
 }
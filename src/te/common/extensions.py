@@ -1,30 +1,154 @@
 """Module extensions functionality."""
 
+import hashlib
 import logging
+import os
 import subprocess
 
+from te.common.paths import cache_dir
+
 logger = logging.getLogger(__name__)
 
 
-def install_extensions(extensions, user=False):
-    """Install extension projects defined in job metadata file."""
-    pip_cmd = ["pip3", "install"]
+def iter_extensions():
+    """Iterate over entry points of installed te extensions."""
+    from importlib.metadata import entry_points  # pylint: disable=C0415
+
+    try:
+        return iter(entry_points(group="te_extensions"))
+    except TypeError:
+        # Python < 3.10
+        return iter(entry_points().get("te_extensions", []))
+
+
+def is_satisfied(spec):
+    """Check if requirement spec is satisfied by an installed distribution.
+
+    Only plain requirements (name with optional version specifier) can be
+    satisfied, URLs and paths are always installed.
+    """
+    # pylint: disable=import-outside-toplevel
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        from packaging.requirements import InvalidRequirement, Requirement
+    except ImportError:
+        return False
+
+    try:
+        requirement = Requirement(spec)
+    except InvalidRequirement:
+        return False
+    if requirement.url:
+        return False
+    try:
+        installed = version(requirement.name)
+    except PackageNotFoundError:
+        return False
+    return requirement.specifier.contains(installed, prereleases=True)
+
+
+def is_pinned(spec):
+    """Check if spec requires exactly one version of a released distribution.
+
+    Only such specs always install the same thing, so they can be installed
+    from the wheel cache without looking for new versions.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        from packaging.requirements import InvalidRequirement, Requirement
+    except ImportError:
+        return False
+
+    try:
+        requirement = Requirement(spec)
+    except InvalidRequirement:
+        return False
+    specifiers = list(requirement.specifier)
+    return (
+        not requirement.url
+        and len(specifiers) == 1
+        and specifiers[0].operator in ("==", "===")
+        and "*" not in specifiers[0].version
+    )
+
+
+def is_local(spec):
+    """Check if spec is a local path which content can change any time."""
+    return spec.startswith((".", "/", "~", "file:")) or os.path.exists(spec)
+
+
+def _spec_marker(wheel_dir, spec):
+    """Get path of file marking spec as built in wheel cache."""
+    digest = hashlib.sha256(spec.encode("utf-8")).hexdigest()
+    return os.path.join(wheel_dir, ".specs", digest)
+
+
+def is_cached(wheel_dir, spec):
+    """Check if wheels of spec and its dependencies are in wheel cache."""
+    return is_pinned(spec) and os.path.exists(_spec_marker(wheel_dir, spec))
+
+
+def cache_wheels(wheel_dir, specs):
+    """Build wheels of specs and their dependencies into wheel cache.
+
+    All specs are built by one pip call. Only pinned specs (see `is_pinned`)
+    are cached, others are installed from the index to get new versions.
+    """
+    specs = [spec for spec in specs if is_pinned(spec)]
+    if not specs:
+        return
+    cmd = ["pip3", "wheel", "--wheel-dir", wheel_dir] + specs
+    if subprocess.run(cmd, check=False).returncode:
+        logger.info("Unable to cache wheels of extensions")
+        return
+    os.makedirs(os.path.join(wheel_dir, ".specs"), exist_ok=True)
+    for spec in specs:
+        with open(_spec_marker(wheel_dir, spec), "w", encoding="utf-8") as marker:
+            marker.write(spec)
+
+
+def pip_install(wheel_dir, specs, user=False):
+    """Install specs by one pip call, offline if all of them are cached."""
+    pip_cmd = ["pip3", "install", "--find-links", wheel_dir]
     if user:
         # add --user option to have a permission to install packages outside of
         # virtual environment
         pip_cmd.append("--user")
+    if all(is_cached(wheel_dir, spec) for spec in specs):
+        pip_cmd.append("--no-index")
+    return subprocess.run(pip_cmd + specs, check=False).returncode
+
+
+def install_extensions(extensions):
+    """Install extension projects defined in job metadata file.
 
+    Already installed extensions are skipped, others are built into a wheel
+    cache shared by all jobs and installed from it by a single pip call.
+    If it fails, extensions which aren't installed after it are installed
+    one by one and those which fail are retried in local user environment.
+    """
+    specs = []
     for extension in extensions:
-        result = subprocess.run(pip_cmd + [extension["package"]], check=False)
-        if result.returncode:
-            if user:
-                return result.returncode
-            # retry installation using local user environment
-            return install_extensions(extensions, user=True)
+        spec = extension["package"]
+        if is_satisfied(spec):
+            logger.info(f"EXTENSION ALREADY INSTALLED: {spec}")
+        else:
+            specs.append(spec)
 
-    import pkg_resources  # pylint: disable=C0415
+    if specs:
+        wheel_dir = cache_dir("wheels")
+        cache_wheels(wheel_dir, [s for s in specs if not is_cached(wheel_dir, s)])
+        if pip_install(wheel_dir, specs):
+            specs = [s for s in specs if not is_satisfied(s)]
+            failed = [s for s in specs if pip_install(wheel_dir, [s])]
+            for spec in failed:
+                # retry installation using local user environment
+                rc = pip_install(wheel_dir, [spec], user=True)
+                if rc:
+                    return rc
 
-    for ext_module in pkg_resources.iter_entry_points("te_extensions"):
+    for ext_module in iter_extensions():
         logger.info(f"LOAD EXTENSION: {ext_module.name}")
         ext_module.load()
 
@@ -1,31 +1,130 @@
 """Module for Ansible Inventory helper calls."""
 
+import fnmatch
 import os
+import threading
 
 from te.common.paths import test_dir
-from te.common.yml import read_yaml
+from te.common.trace import span
 
 INVENTORY = "config/test.inventory.yaml"
 
 
+class Inventory:
+    """Parsed inventory file indexed by host and group names.
+
+    The file is parsed on first use and again only when it changes, e.g.
+    when a playbook rewrites it.
+    """
+
+    def __init__(self, path):
+        """Inventory initialization."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._hosts = {}
+        self._groups = {}
+
+    def _refresh(self):
+        """Load the file if it changed since last load."""
+        from te.common.yml import read_yaml  # pylint: disable=C0415
+
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp != self._stamp:
+                with span("load inventory", "inventory", path=self.path):
+                    self._index(read_yaml(self.path))
+                self._stamp = stamp
+
+    def _index(self, inventory):
+        """Build indexes of hosts and groups from parsed inventory."""
+        hosts = {}
+        groups = {}
+
+        def visit(name, group):
+            group = group or {}
+            members = []
+            for hostname, host_vars in (group.get("hosts") or {}).items():
+                # variables defined first (e.g. in 'all' group) take precedence
+                merged = hosts.setdefault(hostname, {})
+                for key, value in (host_vars or {}).items():
+                    merged.setdefault(key, value)
+                members.append(hostname)
+            for child_name, child in (group.get("children") or {}).items():
+                members.extend(visit(child_name, child))
+            members = list(dict.fromkeys(members))
+            groups[name] = members
+            return members
+
+        if not isinstance(inventory, dict):
+            inventory = {}
+        # top-level groups other than 'all' are its children
+        top = dict(inventory.get("all") or {})
+        others = {name: group for name, group in inventory.items() if name != "all"}
+        if others:
+            top["children"] = {**others, **(top.get("children") or {})}
+        visit("all", top)
+        self._hosts = hosts
+        self._groups = groups
+
+    def host_vars(self, hostname):
+        """Get variables of host, empty dict for unknown host."""
+        self._refresh()
+        return self._hosts.get(hostname, {})
+
+    def group_hosts(self, group):
+        """Get names of hosts in group including its children, None if unknown."""
+        self._refresh()
+        return self._groups.get(group)
+
+    def hostnames(self):
+        """Get names of all hosts."""
+        self._refresh()
+        return list(self._hosts)
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(path=None):
+    """Get shared Inventory object for path, test inventory by default."""
+    path = path or os.path.join(test_dir(), INVENTORY)
+    with _inventories_lock:
+        if path not in _inventories:
+            _inventories[path] = Inventory(path)
+        return _inventories[path]
+
+
 def to_external_hostname(hostname):
     """Get connectable hostname or IP address from job hostname."""
-    inv_path = os.path.join(test_dir(), INVENTORY)
-    inventory = read_yaml(inv_path)
-    ansible_host = None
-
-    # First try if host is defined in 'all' group
-    hosts = inventory["all"].get("hosts", {})
-    host = hosts.get(hostname, {})
-    ansible_host = host.get("ansible_host")
-    if ansible_host:
-        return ansible_host
-
-    # If not, try to find it in other groups
-    for group in inventory["all"]["children"].items():
-        hosts = group[1].get("hosts", {})
-        host = hosts.get(hostname, {})
-        ansible_host = host.get("ansible_host")
-        if ansible_host:
-            break
-    return ansible_host
+    return get_inventory().host_vars(hostname).get("ansible_host")
+
+
+def resolve_hosts(pattern):
+    """Resolve host pattern against the inventory.
+
+    Pattern is a host name, a group name, shell-style wildcard matching host
+    names, or a list of those. Unknown host name resolves to itself.
+
+    :raise RuntimeError: pattern matches no host
+    :return: list of host names without duplicates
+    """
+    patterns = [pattern] if isinstance(pattern, str) else pattern
+    with span("resolve hosts", "inventory", pattern=patterns) as args:
+        inventory = get_inventory()
+
+        hosts = []
+        for item in patterns:
+            group_hosts = inventory.group_hosts(item)
+            if group_hosts is not None:
+                hosts.extend(group_hosts)
+            elif any(char in item for char in "*?["):
+                hosts.extend(fnmatch.filter(inventory.hostnames(), item))
+            else:
+                hosts.append(item)
+        args["hosts"] = len(hosts)
+    if not hosts:
+        raise RuntimeError(f"No hosts match pattern {pattern}")
+    return list(dict.fromkeys(hosts))
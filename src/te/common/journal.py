@@ -0,0 +1,98 @@
+"""Module for journal of finished steps allowing to resume a run."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from te.common.config import config
+from te.common.paths import state_dir
+
+logger = logging.getLogger(__name__)
+
+
+def step_digest(step):
+    """Get hash of step definition."""
+    text = json.dumps(step, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def default_journal_path():
+    """Get path of the journal in test working directory."""
+    return os.path.join(state_dir("journal"), "steps.jsonl")
+
+
+class Journal:
+    """Journal of finished steps persisted in test working directory.
+
+    Each finished step is appended as one JSON line, so the journal survives
+    interrupted runs. A resumed run skips steps which already succeeded with
+    unchanged definition. A new run starts with an empty journal. Nothing is
+    written in dry run.
+    """
+
+    def __init__(self, path=None, resume=False):
+        """Journal initialization.
+
+        :param path: path of the journal file
+        :param resume: keep the existing journal and skip steps succeeded in it
+        """
+        self.path = path or default_journal_path()
+        self._lock = threading.Lock()
+        self._succeeded = set()
+
+        if resume:
+            self._load()
+        elif not config["dry_run"]:
+            with open(self.path, "w", encoding="utf-8"):
+                pass
+
+    def _load(self):
+        """Load results of steps from the journal file."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as journal_file:
+                lines = journal_file.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # line of interrupted write
+                continue
+            entry = (record["phase"], record["step"], record["digest"])
+            if record["rc"] == 0:
+                self._succeeded.add(entry)
+            else:
+                self._succeeded.discard(entry)
+
+    def succeeded(self, phase, step_id, step):
+        """Check if step succeeded in the resumed run."""
+        return (phase, step_id, step_digest(step)) in self._succeeded
+
+    def record(self, phase, step_id, step, rc, start, duration):
+        """Append result of finished step to the journal.
+
+        :param phase: name of the phase of the step
+        :param step_id: identifier of the step within the phase
+        :param step: step definition from metadata
+        :param rc: return code of the step
+        :param start: epoch time of the step start
+        :param duration: seconds the step took
+        """
+        if config["dry_run"]:
+            return
+        record = {
+            "phase": phase,
+            "step": step_id,
+            "digest": step_digest(step),
+            "rc": rc,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(start)),
+            "duration": round(duration, 3),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as journal_file:
+                journal_file.write(json.dumps(record) + "\n")
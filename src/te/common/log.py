@@ -1,16 +1,58 @@
 """Utility module for logging."""
 
+import contextlib
+import contextvars
 import logging
+import queue
 import sys
+import threading
+import time
 from datetime import datetime
 
 from xtermcolor import colorize
 
 from te.common.config import config
+from te.common.logfiles import log_path, open_log
+from te.common.profiling import counted
+
+# maximal seconds between a record is logged and written to output
+FLUSH_INTERVAL = 0.1
+
+# Label of the step producing the output, set when steps run concurrently so
+# that interleaved lines stay attributable.
+output_prefix = contextvars.ContextVar("output_prefix", default="")
+
+
+@contextlib.contextmanager
+def prefixed(label):
+    """Prefix output logged within the block by label.
+
+    Label is nested in the prefix of the outer block, if any.
+    """
+    parent = output_prefix.get()
+    token = output_prefix.set(f"{parent}/{label}" if parent else label)
+    try:
+        yield
+    finally:
+        output_prefix.reset(token)
+
+
+class PrefixFilter(logging.Filter):
+    """Log filter adding `prefix` attribute with label of the running step."""
+
+    def filter(self, record):
+        """Set record prefix based on the current context."""
+        prefix = output_prefix.get()
+        record.prefix = f"[{prefix}] " if prefix else ""
+        return True
 
 
 class ColorHandler(logging.Handler):
-    """Log handler for colorizing log output."""
+    """Log handler for colorizing log output.
+
+    Buffered handler leaves flushing of outputs to `flush` calls, which
+    saves a system call per record.
+    """
 
     level_output = {
         logging.INFO: (sys.stdout, 36),  # cyan
@@ -19,18 +61,188 @@ class ColorHandler(logging.Handler):
         logging.WARNING: (sys.stdout, 33),  # yellow
     }
 
+    def __init__(self, buffered=False):
+        """Initialize handler."""
+        super().__init__()
+        self.buffered = buffered
+
+    @counted("ColorHandler.handle")
     def handle(self, record):
         """Colorize the record and print it to matching output."""
+        if not self.filter(record):
+            return
         output, color = self.level_output.get(record.levelno)
         color = getattr(record, "color", color)
 
-        c_text = self._format_output(record.msg, ansi_color=color)
-        print(c_text, file=output, flush=True)
+        text = f"{getattr(record, 'prefix', '')}{record.msg}"
+        c_text = self._format_output(text, record.created, ansi_color=color)
+        if self.buffered and output is sys.stderr:
+            # keep order of lines printed to stdout before
+            sys.stdout.flush()
+        output.write(c_text + "\n")
+        if not self.buffered:
+            output.flush()
+
+    def flush(self):
+        """Flush outputs of the handler."""
+        for output, _ in self.level_output.values():
+            output.flush()
 
-    def _format_output(self, text, ansi_color=None):
+    def _format_output(self, text, created, ansi_color=None):
         if ansi_color:
             text = colorize(text, ansi=ansi_color)
         if config["print_timestamp"]:
-            time = datetime.now().isoformat(timespec="seconds")
-            text = f"{time} {text}"
+            timestamp = datetime.fromtimestamp(created).isoformat(timespec="seconds")
+            text = f"{timestamp} {text}"
         return text
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """File handler leaving flushing of the file to `flush` calls.
+
+    The file is compressed on the fly if requested, its path gets suffix of
+    the compression. A held handler keeps records in memory and doesn't
+    open the file until `write_held` is called, e.g. after logs of previous
+    runs are rotated.
+    """
+
+    def __init__(self, filename, compression=None, hold=False):
+        """Initialize handler appending to the file."""
+        self.compression = compression
+        self.path = filename
+        self._held = [] if hold else None
+        super().__init__(log_path(filename, compression), delay=True)
+
+    def _open(self):
+        return open_log(self.path, self.compression, "at")
+
+    def write_held(self):
+        """Write held records and the following ones to the file."""
+        with self.lock:
+            records, self._held = self._held or [], None
+            for record in records:
+                self.emit(record)
+
+    def close(self):
+        """Write held records and close the file."""
+        self.write_held()
+        super().close()
+
+    def emit(self, record):
+        """Write formatted record to the file."""
+        if self._held is not None:
+            self._held.append(record)
+            return
+        if self.stream is None:
+            self.stream = self._open()
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+
+class QueueHandler(logging.Handler):
+    """Log handler passing records to `LogWriter` running in background.
+
+    Filters of this handler run in the logging thread, so they can use its
+    context, e.g. `PrefixFilter`.
+    """
+
+    def __init__(self, writer):
+        """Initialize handler."""
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        """Pass record to the writer as is, it's handled in this process."""
+        self.writer.put(record)
+
+
+class LogWriter:
+    """Background thread writing log records to handlers in batches.
+
+    Records are handled in order of logging. Handlers are flushed at most
+    `flush_interval` seconds after a record is written, so outputs are
+    written in large blocks. Records logged while the writer is not running
+    are written directly.
+    """
+
+    _stop = object()
+
+    def __init__(self, handlers, flush_interval=FLUSH_INTERVAL):
+        """Writer initialization.
+
+        :param handlers: handlers writing the records, preferably buffered
+        """
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start writing records in background."""
+        with self._lock:
+            self._thread = threading.Thread(
+                target=self._run, name="te-log-writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Write all queued records and stop the writer."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self.queue.put_nowait(self._stop)
+        thread.join()
+
+    def put(self, record):
+        """Queue record to be written."""
+        with self._lock:
+            if self._thread is not None:
+                self.queue.put_nowait(record)
+                return
+        self._handle(record)
+        self._flush()
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:  # pylint: disable=broad-except
+                    # the writer has to keep running for other handlers
+                    handler.handleError(record)
+
+    def _flush(self):
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except OSError:
+                # e.g. closed output pipe, reported when writing records
+                pass
+
+    def _run(self):
+        # time until which written records have to be flushed, None when
+        # there is nothing to flush
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+            if record is self._stop:
+                self._flush()
+                return
+            self._handle(record)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            elif time.monotonic() >= deadline:
+                self._flush()
+                deadline = None
@@ -0,0 +1,186 @@
+"""Module for rotation and compression of log files."""
+
+import fnmatch
+import gzip
+import io
+import logging
+import os
+import re
+import shutil
+
+logger = logging.getLogger(__name__)
+# suffixes of compressed log files
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def log_path(path, compression=None):
+    """Get path of log file written with compression."""
+    return path + COMPRESSIONS[compression] if compression else path
+
+
+def _zstandard():
+    """Get zstandard module, it's an optional dependency."""
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise RuntimeError(
+            "zstd compression of logs needs zstandard package: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+def check_compression(compression):
+    """Check that compression is supported.
+
+    :raises RuntimeError: when the compression is unknown or not available
+    """
+    if compression and compression not in COMPRESSIONS:
+        raise RuntimeError(f"Unknown log compression: {compression}")
+    if compression == "zstd":
+        _zstandard()
+
+
+def open_log(path, compression=None, mode="wb"):
+    """Open log file for streaming writes, compressed if requested.
+
+    :param path: path of the log without suffix of the compression
+    :param mode: "wb" or "ab" for bytes, "wt" or "at" for text
+    """
+    path = log_path(path, compression)
+    binary_mode = mode[0] + "b"
+    if compression == "gzip":
+        stream = gzip.open(path, binary_mode)
+    elif compression == "zstd":
+        # pylint: disable=consider-using-with
+        raw = open(path, binary_mode)
+        stream = _zstandard().ZstdCompressor().stream_writer(raw, closefd=True)
+    else:
+        stream = open(path, binary_mode)  # pylint: disable=consider-using-with
+    if mode.endswith("t"):
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return stream
+
+
+def open_log_reader(path):
+    """Open possibly compressed log for reading bytes, based on its suffix."""
+    if path.endswith(COMPRESSIONS["gzip"]):
+        return gzip.open(path, "rb")
+    # pylint: disable=consider-using-with
+    raw = open(path, "rb")
+    if path.endswith(COMPRESSIONS["zstd"]):
+        # read_across_frames for logs appended by more runs
+        return (
+            _zstandard()
+            .ZstdDecompressor()
+            .stream_reader(raw, read_across_frames=True, closefd=True)
+        )
+    return raw
+
+
+def run_logs(path):
+    """Get existing logs of runs, the current run first.
+
+    :return: list of (run number, path), 0 is the current run
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory or "."):
+        return []
+    suffixes = "|".join(re.escape(suffix) for suffix in COMPRESSIONS.values())
+    pattern = re.compile(rf"{re.escape(os.path.basename(path))}(\.\d+)?({suffixes})?$")
+    runs = []
+    for entry in os.listdir(directory or "."):
+        match = pattern.match(entry)
+        if match:
+            number = int(match.group(1)[1:]) if match.group(1) else 0
+            runs.append((number, os.path.join(directory, entry)))
+    return sorted(runs)
+
+
+def strip_suffix(path):
+    """Get path of log without suffix of compression."""
+    for suffix in COMPRESSIONS.values():
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+def find_step_logs(directory, phase="*", step="*"):
+    """Find output files of steps in directory of a run.
+
+    :param phase: shell-style pattern of phase names
+    :param step: shell-style pattern of step names
+    :return: sorted list of (phase, step, path), step includes host name
+        for commands run on multiple hosts
+    """
+    found = []
+    for root, _, names in os.walk(directory):
+        phase_name = os.path.relpath(root, directory)
+        if not fnmatch.fnmatchcase(phase_name, phase):
+            continue
+        for name in names:
+            step_name = strip_suffix(name)
+            if not step_name.endswith(".log"):
+                continue
+            step_name = step_name[: -len(".log")]
+            # host of a command on multiple hosts is an extension of step
+            if fnmatch.fnmatchcase(step_name, step) or fnmatch.fnmatchcase(
+                step_name.split(".", 1)[0], step
+            ):
+                found.append((phase_name, step_name, os.path.join(root, name)))
+    return sorted(found)
+
+
+def copy_log(path, output):
+    """Write decompressed content of log to binary output."""
+    with open_log_reader(path) as log_f:
+        shutil.copyfileobj(log_f, output)
+
+
+def _size(path):
+    """Get size of file or of all files in directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def rotate(path, keep, max_bytes=None):
+    """Rotate log file or directory of logs of previous runs.
+
+    Log of the current run becomes `<path>.1`, former `<path>.1` becomes
+    `<path>.2` and so on, keeping the suffix of compression.
+
+    :param path: path of the log of the current run without compression
+    :param keep: number of logs of previous runs kept
+    :param max_bytes: total size of logs of previous runs kept, the oldest
+        ones are removed over it
+    """
+    runs = run_logs(path)
+    for number, run_path in reversed(runs):
+        # suffix of compression
+        suffix = run_path[len(f"{path}.{number}" if number else path) :]
+        if number + 1 > keep:
+            _remove(run_path)
+        else:
+            os.replace(run_path, f"{path}.{number + 1}{suffix}")
+
+    if max_bytes is None:
+        return
+    runs = run_logs(path)
+    total = sum(_size(run_path) for _, run_path in runs)
+    for _, run_path in reversed(runs):
+        if total <= max_bytes:
+            break
+        total -= _size(run_path)
+        _remove(run_path)
+        logger.debug(f"Removed old log over size limit: {run_path}")
@@ -1,16 +1,22 @@
 """Module for job metadata file operations."""
 
+import hashlib
+import json
 import logging
 import os
 import re
 import sys
-import tempfile
 
-import requests
-from requests.exceptions import RequestException
+from te.common.cache import evict_lru, write_atomic
+from te.common.paths import state_dir
+from te.version import VERSION
 
 logger = logging.getLogger(__name__)
 get_timeout = 300
+# number of parsed metadata files kept in cache
+METADATA_CACHE_SIZE = 8
+# bytes of downloaded metadata files kept in cache
+DOWNLOAD_CACHE_SIZE = 64 * 1024 * 1024
 
 
 def is_url(path):
@@ -18,6 +24,68 @@ def is_url(path):
     return bool(re.match("(http|https)://", path))
 
 
+def download_metadata(url):
+    """Download metadata file into cache in test working directory.
+
+    Already cached file is revalidated by a conditional request (ETag,
+    Last-Modified) and downloaded again only when modified. If the server
+    can't be reached or fails (5xx), the last good copy is used.
+
+    :return: path to the cached file or None if it can't be downloaded
+    """
+    # pylint: disable=import-outside-toplevel
+    import requests
+    from requests.exceptions import RequestException
+
+    cache_dir = state_dir("downloads")
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    body_path = os.path.join(cache_dir, f"{key}.yaml")
+    info_path = os.path.join(cache_dir, f"{key}.json")
+
+    info = {}
+    if os.path.isfile(body_path):
+        try:
+            with open(info_path, "r", encoding="utf-8") as info_file:
+                info = json.load(info_file)
+        except (OSError, ValueError):
+            info = {"url": url}
+
+    headers = {}
+    if info.get("etag"):
+        headers["If-None-Match"] = info["etag"]
+    if info.get("last_modified"):
+        headers["If-Modified-Since"] = info["last_modified"]
+
+    response = None
+    try:
+        response = requests.get(url, headers=headers, timeout=get_timeout)
+        if response.status_code == 304 and info:
+            logger.debug(f"Metadata file not modified: {url}")
+            os.utime(body_path)
+            return body_path
+        response.raise_for_status()
+    except RequestException as e:
+        # the server refusing the request (4xx) is not hidden by cached copy
+        unavailable = isinstance(e, (requests.ConnectionError, requests.Timeout)) or (
+            response is not None and response.status_code >= 500
+        )
+        if info and unavailable:
+            logger.warning(f"Unable to download metadata file, using cached: {e}")
+            return body_path
+        logger.error(f"Download of metadata file failed: {e}")
+        return None
+
+    write_atomic(body_path, response.content)
+    info = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    write_atomic(info_path, json.dumps(info).encode("utf-8"))
+    evict_lru(cache_dir, ".yaml", max_bytes=DOWNLOAD_CACHE_SIZE, keep=body_path)
+    return body_path
+
+
 def get_metadata_path(original_path):
     """Check if `original_path` exists or it's an URL to be downloaded.
 
@@ -30,20 +98,92 @@ def get_metadata_path(original_path):
             logger.error(f"Unable to find metadata file: {metadata_path}")
             sys.exit(1)
     else:
-        try:
-            response = requests.get(original_path, timeout=get_timeout)
-            response.raise_for_status()
-        except RequestException:
+        metadata_path = download_metadata(original_path)
+        if metadata_path is None:
             logger.error(f"Unable to download metadata file: {original_path}")
             sys.exit(1)
 
-        with tempfile.NamedTemporaryFile(mode="w+", delete=False) as temp_f:
-            temp_f.write(response.text)
-            metadata_path = temp_f.name
-
     return metadata_path
 
 
+def validate_metadata(metadata):
+    """Check structure of metadata.
+
+    Exit program if metadata are not valid.
+    """
+    errors = []
+    if not isinstance(metadata, dict):
+        errors.append("metadata is not a mapping")
+        metadata = {}
+    if not isinstance(metadata.get("ansible", {}), dict):
+        errors.append("'ansible' is not a mapping")
+    phases = metadata.get("phases", [])
+    if not isinstance(phases, list):
+        errors.append("'phases' is not a list")
+        phases = []
+    for index, phase in enumerate(phases, 1):
+        if not isinstance(phase, dict):
+            errors.append(f"phase {index} is not a mapping")
+            continue
+        name = phase.get("name", index)
+        steps = phase.get("steps", [])
+        if not isinstance(steps, list):
+            errors.append(f"steps of phase {name} are not a list")
+            continue
+        for pos, step in enumerate(steps, 1):
+            if not isinstance(step, dict):
+                errors.append(f"step {pos} of phase {name} is not a mapping")
+            elif "parallel" in step and not (
+                isinstance(step["parallel"], list)
+                and all(isinstance(s, dict) for s in step["parallel"])
+            ):
+                errors.append(f"parallel block {pos} of phase {name} is invalid")
+
+    for error in errors:
+        logger.error(f"Invalid metadata: {error}")
+    if errors:
+        sys.exit(1)
+
+
+def read_metadata(path):
+    """Read and validate metadata file.
+
+    Parsed metadata are cached as JSON in test working directory by hash of
+    the file content and te version, so repeated runs with the same metadata
+    skip parsing. Metadata which don't survive JSON unchanged (e.g. with
+    dates) aren't cached, unreadable cache entry is parsed again.
+    """
+    with open(path, "rb") as metadata_file:
+        content = metadata_file.read()
+    cache_dir = state_dir("metadata")
+    digest = hashlib.sha256(VERSION.encode("utf-8") + b"\0" + content).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{digest}.json")
+
+    try:
+        with open(cache_path, "rb") as cache_file:
+            metadata = json.loads(cache_file.read())
+        if isinstance(metadata, dict):
+            # mark as recently used
+            os.utime(cache_path)
+            return metadata
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+    from te.common.yml import parse_yaml  # pylint: disable=C0415
+
+    metadata = parse_yaml(content)
+    validate_metadata(metadata)
+
+    try:
+        data = json.dumps(metadata)
+        if json.loads(data) == metadata:
+            write_atomic(cache_path, data.encode("utf-8"))
+            evict_lru(cache_dir, ".json", max_entries=METADATA_CACHE_SIZE)
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug(f"Unable to cache metadata: {e}")
+    return metadata
+
+
 def get_phase(metadata, phase_name):
     """Get phase from metadata by name.
 
@@ -59,16 +199,98 @@ def get_phase(metadata, phase_name):
     return None
 
 
-def get_phases_upto(metadata, upto):
-    """Select all phases from start upto a given phase (including)."""
-    if not get_phase(metadata, upto):
-        return []
+def unique_keys(names):
+    """Make names unique by `-<occurrence>` suffix of repeated ones.
+
+    :return: list of keys, in order of `names`
+    """
+    keys = []
+    for name in names:
+        key, occurrence = str(name), 1
+        while key in keys:
+            occurrence += 1
+            key = f"{name}-{occurrence}"
+        keys.append(key)
+    return keys
+
+
+def phase_keys(phases):
+    """Get unique keys of phases for the journal, the report and step logs.
+
+    Key is the phase name, `phase-<position>` for phase without a name.
+    Repeated keys get `-<occurrence>` suffix.
+
+    :return: list of keys, in order of `phases`
+    """
+    return unique_keys(
+        phase.get("name", f"phase-{index + 1}") for index, phase in enumerate(phases)
+    )
+
+
+def phase_needs(phases, implicit=True, known=()):
+    """Get phases which each of phases needs to run before it.
+
+    Phase needs phases listed by name in its `needs`, all of them if more
+    phases have the same name. Phase without `needs` needs the phase
+    preceding it, unless `implicit` is False.
 
-    match = []
+    :param known: names of phases which may be needed but aren't in
+        `phases` (e.g. not selected to run), such needs are left out
+    :raise RuntimeError: phase needs an unknown phase
+    :return: list of lists of indexes to `phases`, in order of `phases`
+    """
+    indexes = {}
+    for index, phase in enumerate(phases):
+        indexes.setdefault(phase.get("name"), []).append(index)
+    needs = []
+    for index, phase in enumerate(phases):
+        if "needs" in phase:
+            deps = []
+            for name in phase["needs"]:
+                if name not in indexes and name not in known:
+                    key = phase.get("name", f"phase-{index + 1}")
+                    raise RuntimeError(f"Phase {key} needs unknown phase {name}")
+                deps.extend(indexes.get(name, []))
+            needs.append(deps)
+        elif implicit and index > 0:
+            needs.append([index - 1])
+        else:
+            needs.append([])
+    return needs
+
+
+def get_phases_needed(metadata, phase_name, implicit=True):
+    """Select phase together with all phases it transitively needs.
+
+    Exit program if a phase needs an unknown phase.
+
+    :param metadata: metadata object
+    :param phase_name: name of the selected phase
+    :param implicit: follow also implicit needs of phases without `needs`
+    :return: list of phases in order of metadata
+    """
     phases = metadata.get("phases", [])
-    for phase in phases:
-        match.append(phase)
-        if phase.get("name") == upto:
-            break
+    try:
+        needs = phase_needs(phases, implicit)
+    except RuntimeError as e:
+        logger.error(e)
+        sys.exit(1)
+    selected = set()
+    stack = [i for i, phase in enumerate(phases) if phase.get("name") == phase_name]
+    while stack:
+        index = stack.pop()
+        if index in selected:
+            continue
+        selected.add(index)
+        stack.extend(needs[index])
+
+    return [phase for index, phase in enumerate(phases) if index in selected]
+
 
-    return match
+def get_phases_upto(metadata, upto):
+    """Select a given phase with all phases it transitively needs.
+
+    For metadata without `needs` it means all phases from start upto a given
+    phase (including).
+    """
+    return get_phases_needed(metadata, upto)
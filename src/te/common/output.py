@@ -0,0 +1,187 @@
+"""Module for capturing raw output of steps into their own files."""
+
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import queue
+import re
+import threading
+
+from te.common.config import config
+from te.common.logfiles import log_path, open_log
+from te.common.paths import STATE_DIR, test_dir
+
+logger = logging.getLogger(__name__)
+# output of the step running in the current context
+step_output = contextvars.ContextVar("step_output", default=None)
+
+
+def _file_name(name):
+    """Get file name safe version of phase or step name."""
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_") or "_"
+
+
+def logs_dir():
+    """Get path of directory with step outputs of the current run."""
+    return os.path.join(test_dir(), STATE_DIR, "logs")
+
+
+def output_path(phase, step_id):
+    """Get path of output file of step in test working directory."""
+    return os.path.join(logs_dir(), _file_name(phase), f"{_file_name(step_id)}.log")
+
+
+class OutputWriter:
+    """Background thread writing outputs of steps to their files.
+
+    Output comes mostly from the event loop of the process engine, which
+    must not block on opening, compressing and writing of files. Writes are
+    done in order in which they are queued.
+    """
+
+    def __init__(self):
+        """Initialize writer, its thread starts with the first write."""
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, func, *args):
+        """Queue call writing output."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="te-output-writer", daemon=True
+                )
+                self._thread.start()
+        self.queue.put_nowait((func, args))
+
+    def sync(self):
+        """Wait until all queued writes are done."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self.queue.put_nowait((done.set, ()))
+        done.wait()
+
+    def _run(self):
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                # the writer has to keep running for other outputs
+                logger.error(f"Unable to write output of step: {e}")
+
+
+output_writer = OutputWriter()
+
+
+class StepOutput:
+    """Raw output of processes of a step.
+
+    Output bytes are written to the file as they come, without decoding,
+    by `output_writer`. Only the last lines are kept in memory for the
+    failure summary. The file is created on the first write.
+    """
+
+    def __init__(self, path, tail=None, label=""):
+        """Initialize output.
+
+        :param path: path of the output file
+        :param tail: deque of last lines shared with the parent output
+        :param label: prefix of lines of this output in the tail
+        """
+        self.base_path = path
+        self.path = log_path(path, config["log_compression"])
+        self.label = label
+        if tail is None:
+            tail = collections.deque(maxlen=config["output_tail_lines"])
+        self.tail = tail
+        self._file = None
+        self._written = False
+        self._children = []
+
+    def write(self, data):
+        """Queue raw output bytes to be written to the file."""
+        self._written = True
+        output_writer.put(self._write_file, data)
+
+    def _write_file(self, data):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open_log(self.base_path, config["log_compression"])
+        self._file.write(data)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+
+    def add_line(self, text):
+        """Keep decoded output line in the tail."""
+        self.tail.append(f"[{self.label}] {text}" if self.label else text)
+
+    def child(self, label):
+        """Get output written into separate file with lines labeled in tail.
+
+        Used for commands running concurrently within a step, e.g. on
+        multiple hosts, so that their outputs don't mix in one file.
+        """
+        stem, ext = os.path.splitext(self.base_path)
+        child = StepOutput(f"{stem}.{_file_name(label)}{ext}", self.tail, label)
+        self._children.append(child)
+        return child
+
+    def paths(self):
+        """Get paths of all written output files."""
+        paths = [self.path] if self._written else []
+        for child in self._children:
+            paths.extend(child.paths())
+        return paths
+
+    def close(self):
+        """Close output files once all queued output is written to them."""
+        for child in self._children:
+            child.close()
+        if self._written:
+            output_writer.put(self._close_file)
+            output_writer.sync()
+
+
+@contextlib.contextmanager
+def capture_output(output):
+    """Capture output of processes run within the block into output."""
+    token = step_output.set(output)
+    try:
+        yield output
+    finally:
+        step_output.reset(token)
+        output.close()
+
+
+@contextlib.contextmanager
+def child_output(label):
+    """Capture output within the block into a child of the current output."""
+    parent = step_output.get()
+    if parent is None:
+        yield None
+        return
+    with capture_output(parent.child(label)) as output:
+        yield output
+
+
+def log_failure_summary(failures):
+    """Log last lines of output of failed steps.
+
+    :param failures: list of (phase, step_id, rc, StepOutput)
+    """
+    if not failures:
+        return
+    logger.error("FAILURE SUMMARY:")
+    for phase, step_id, rc, output in failures:
+        logger.error(f"Step {step_id} of phase {phase} failed with {rc}")
+        for path in output.paths():
+            logger.error(f"Output: {path}")
+        for line in output.tail:
+            logger.error(f"  {line}")
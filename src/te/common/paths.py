@@ -5,6 +5,8 @@ import site
 
 from te.common.exceptions import BrokenInstallation, PlaybookNotFound
 
+STATE_DIR = ".te"
+
 
 def iter_ci_data_dirs():
     """Iterate over te data dirs to get all shared directories."""
@@ -27,6 +29,31 @@ def test_dir():
     return os.getcwd()
 
 
+def state_dir(name):
+    """Get directory for te state and caches in test working directory.
+
+    The directory is created if it doesn't exist.
+
+    :param name: name of the directory in `.te` directory
+    """
+    path = os.path.join(test_dir(), STATE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_dir(name):
+    """Get user cache directory of te shared by all test working directories.
+
+    The directory is created if it doesn't exist.
+
+    :param name: name of the directory in te cache directory
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(cache_home, "te", name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
 def get_playbook_path(playbook):
     """Find absolute path of playbook."""
     if os.path.isabs(playbook):
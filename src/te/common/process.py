@@ -1,21 +1,75 @@
 """Module for subprocess calls."""
 
+import asyncio
+import contextvars
+import functools
 import logging
 import os
+import resource
 import signal
 import subprocess
+import sys
 import threading
+import types
 
 from te.common.config import config
 from te.common.exceptions import TimeoutException
+from te.common.output import step_output
 from te.common.paths import test_dir
+from te.common.profiling import counted
+from te.common.report import current_usage
+from te.common.trace import span, tracer
 
 logger = logging.getLogger(__name__)
+# list collecting output lines of commands run in the current context
+output_capture = contextvars.ContextVar("output_capture", default=None)
 
 
 def command_output(text):
-    """Wrap printing command outputs."""
-    logging.LoggerAdapter(logger, {"color": None}).debug(text)
+    """Wrap printing command outputs.
+
+    Output is logged on debug level without color. Source location of the
+    record isn't looked up as it's the same for all output lines.
+    """
+    capture = output_capture.get()
+    if capture is not None:
+        capture.append(text)
+    output = step_output.get()
+    if output is not None:
+        output.add_line(text)
+    if logger.isEnabledFor(logging.DEBUG):
+        record = logging.LogRecord(
+            logger.name, logging.DEBUG, __file__, 0, text, None, None
+        )
+        record.color = None
+        logger.handle(record)
+
+
+def quiet_output(text):
+    """Keep line of output in the step output without logging it.
+
+    Used as `on_line` of `run_async` when the output is summarized other
+    way, e.g. from events of Ansible.
+    """
+    capture = output_capture.get()
+    if capture is not None:
+        capture.append(text)
+    output = step_output.get()
+    if output is not None:
+        output.write(text.encode("utf-8") + b"\n")
+        output.add_line(text)
+
+
+def replay_output(text):
+    """Write line of output not coming from a process of the current step.
+
+    The line is written to the step output file too, unlike output of
+    processes which is written there as it comes.
+    """
+    output = step_output.get()
+    if output is not None:
+        output.write(text.encode("utf-8") + b"\n")
+    command_output(text)
 
 
 def common_popen_args():
@@ -27,12 +81,150 @@ def common_popen_args():
     }
 
 
-def run(cmd, run_args, timeout=None):
-    """Run subprocess command.
+class OutputProtocol(asyncio.Protocol):
+    """Protocol logging output of a process line by line.
+
+    Output is received in large chunks, only complete lines are logged and
+    the rest is buffered until next chunk or end of the output. Chunks are
+    also written as they are to the step output, if any.
+    """
+
+    def __init__(self, closed, output=None, on_line=command_output):
+        """Protocol initialization.
+
+        :param closed: future to be resolved once the output is closed
+        :param output: StepOutput of the step running the process
+        :param on_line: callable getting each line of the output
+        """
+        self.buffer = bytearray()
+        self.closed = closed
+        self.output = output
+        self.on_line = on_line
+        self.received = 0
+
+    def data_received(self, data):
+        """Log all complete lines received so far."""
+        self.received += len(data)
+        if self.output is not None:
+            self.output.write(data)
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            return
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[: end + 1]
+        for line in lines:
+            self.on_line(line.decode("utf-8", "replace"))
+
+    def connection_lost(self, exc):
+        """Log incomplete last line and announce end of the output."""
+        if self.buffer:
+            self.on_line(self.buffer.decode("utf-8", "replace"))
+            self.buffer.clear()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+
+class ProcessEngine:
+    """Event loop running in a background thread supervising subprocesses.
+
+    All subprocesses started via `run` share one loop, so any number of them
+    can run concurrently without a thread per subprocess.
+    """
+
+    def __init__(self):
+        """Engine initialization, the loop is started on first use."""
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """Get running event loop of the engine."""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="te-process-engine", daemon=True
+                )
+                thread.start()
+                tracer.borrow_tracks(thread.ident)
+                self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule coroutine in the engine loop from other thread.
+
+        Coroutine runs in a copy of the context of the calling thread.
+
+        :return: concurrent.futures.Future with the coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+engine = ProcessEngine()
+
+
+def own_rusage(rusage, inherited_rss_kb=0):
+    """Get resource usage of process without peak RSS it inherited by fork.
+
+    Peak RSS of a forked process starts at the peak of its parent, also
+    after exec. Peak RSS of the process itself is known only when it's
+    higher than what it inherited, `ru_maxrss` is None otherwise.
+
+    :param inherited_rss_kb: peak RSS of the parent once it forked
+    """
+    maxrss = rusage.ru_maxrss
+    if maxrss is not None and maxrss <= inherited_rss_kb:
+        maxrss = None
+    return types.SimpleNamespace(
+        ru_utime=rusage.ru_utime, ru_stime=rusage.ru_stime, ru_maxrss=maxrss
+    )
+
+
+def _reap(pid):
+    """Wait for process to exit and get its exit code and resource usage."""
+    _, status, rusage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), rusage
+
+
+def _wait_exit(loop, pid):
+    """Get future resolved with exit code and usage of process once it exits."""
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # pidfd is not available (non-Linux or old kernel)
+        return loop.run_in_executor(None, _reap, pid)
+
+    exited = loop.create_future()
+
+    def on_exit():
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+        exited.set_result(_reap(pid))
+
+    loop.add_reader(pidfd, on_exit)
+    return exited
+
+
+def _kill_group(pgid):
+    """Kill process group, ignoring already finished group."""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def run_async(cmd, run_args, timeout=None, stdin_data=None, on_line=None):
+    """Run subprocess command in the event loop.
+
+    Output of the command is logged line by line as it comes.
 
     :param cmd: command name
     :param run_args: dict of Popen kwargs
     :param timeout: seconds for the process to timeout
+    :param stdin_data: bytes to be written to stdin of the command
+    :param on_line: callable getting lines of the output instead of logging
+        them, the output isn't written to step output then
 
     :return: exit code of the command
     """
@@ -44,28 +236,137 @@ def run(cmd, run_args, timeout=None):
     if timeout is not None and timeout <= 0:
         raise TimeoutException(0)
 
-    pinfo = {}
-
+    run_args = dict(run_args)
     # reset group id so that killing the newly spawn process and its child
     # won't kill also `te`
-    run_args["preexec_fn"] = os.setpgrp
-
-    def target():
-        # TODO: remove the pylint exception
-        process = subprocess.Popen(cmd, **run_args)  # pylint: disable=R1732
-        pinfo["process"] = process
-        for line in iter(process.stdout.readline, b""):
-            command_output(line.decode("utf-8").rstrip("\n"))
-        process.wait()
-
-    thread = threading.Thread(target=target)
-    thread.start()
-    thread.join(timeout)
-    if thread.is_alive():
-        pid = pinfo["process"].pid
-        pgid = os.getpgid(pid)
-        logger.info(f"timeout happened, killing {pgid}/{pid}")
-        os.killpg(pgid, signal.SIGKILL)
-        thread.join()
+    if sys.version_info >= (3, 11):
+        run_args["process_group"] = 0
+    else:
+        run_args["preexec_fn"] = os.setpgrp
+    if stdin_data is not None:
+        run_args["stdin"] = subprocess.PIPE
+
+    cmd_str = cmd if isinstance(cmd, str) else " ".join(cmd)
+    program = os.path.basename(cmd_str.split(maxsplit=1)[0]) if cmd_str else ""
+    with span(program, "ssh" if program in ("ssh", "scp") else "process") as args:
+        args["cmd"] = cmd_str
+        args["rc"] = await _supervise(cmd, run_args, timeout, stdin_data, on_line)
+    return args["rc"]
+
+
+async def read_output(loop, pipe, on_line=None):
+    """Start reading output of a process from pipe in the event loop.
+
+    :param pipe: file object of the read end of the output pipe
+    :param on_line: callable getting lines of the output, see `run_async`
+    :return: (OutputProtocol, future resolved once the output is closed)
+    """
+    closed = loop.create_future()
+    if on_line is None:
+        output = OutputProtocol(closed, step_output.get())
+    else:
+        output = OutputProtocol(closed, on_line=on_line)
+    await loop.connect_read_pipe(lambda: output, pipe)
+    return output, closed
+
+
+async def wait_process(pgid, waiters, output, timeout, inherited_rss_kb=0):
+    """Wait for process to exit and its output to close.
+
+    Process group of the process is killed on timeout or cancellation.
+    Resource usage of the process is added to the current usage.
+
+    :param pgid: process group id of the process
+    :param waiters: futures of the exit and of the closed output, the exit
+        future is the first one and resolves with (exit code, rusage)
+    :param output: OutputProtocol reading the output or None
+    :param inherited_rss_kb: peak RSS of the parent of the process once it
+        forked, see `own_rusage`
+    :return: exit code of the process
+    """
+    finished = asyncio.gather(*waiters)
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(finished), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"timeout happened, killing {pgid}/{pgid}")
+        _kill_group(pgid)
+        timed_out = True
+    except asyncio.CancelledError:
+        _kill_group(pgid)
+        await finished
+        raise
+
+    returncode, rusage = (await finished)[0]
+    usage = current_usage.get()
+    if usage is not None:
+        usage.add_process(
+            own_rusage(rusage, inherited_rss_kb),
+            output.received if output is not None else 0,
+        )
+    if timed_out:
         raise TimeoutException(timeout)
-    return pinfo["process"].returncode
+    return returncode
+
+
+def _kill_spawned(spawn):
+    """Kill process spawned for cancelled command."""
+    if not spawn.cancelled() and spawn.exception() is None:
+        _kill_group(spawn.result().pid)
+
+
+async def _supervise(cmd, run_args, timeout, stdin_data, on_line):
+    """Start process and wait for its exit, see `run_async`."""
+    loop = asyncio.get_running_loop()
+    with span("spawn", "process"):
+        # fork and exec of a large process take milliseconds, the loop
+        # handles output of other processes meanwhile
+        spawn = loop.run_in_executor(
+            None, functools.partial(subprocess.Popen, cmd, **run_args)
+        )
+        try:
+            process = await asyncio.shield(spawn)
+        except asyncio.CancelledError:
+            spawn.add_done_callback(_kill_spawned)
+            raise
+    # te's peak once it forked, the process starts with it
+    inherited_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    exited = _wait_exit(loop, process.pid)
+    waiters = [exited]
+    if stdin_data is not None:
+        transport, _ = await loop.connect_write_pipe(asyncio.Protocol, process.stdin)
+        transport.write(stdin_data)
+        # closes stdin once all data is written
+        transport.write_eof()
+    output = None
+    if process.stdout is not None:
+        output, closed = await read_output(loop, process.stdout, on_line)
+        waiters.append(closed)
+
+    try:
+        # process is a group leader, so its pid is also the group id
+        return await wait_process(
+            process.pid, waiters, output, timeout, inherited_rss_kb
+        )
+    finally:
+        # process was reaped by the engine, let Popen know it
+        if exited.done() and not exited.cancelled() and not exited.exception():
+            process.returncode = exited.result()[0]
+
+
+@counted("process.run")
+def run(cmd, run_args, timeout=None, stdin_data=None):
+    """Run subprocess command.
+
+    The command is supervised by the shared process engine, the calling
+    thread only waits for the result.
+
+    :param cmd: command name
+    :param run_args: dict of Popen kwargs
+    :param timeout: seconds for the process to timeout
+    :param stdin_data: bytes to be written to stdin of the command
+
+    :return: exit code of the command
+    """
+    return engine.submit(run_async(cmd, run_args, timeout, stdin_data)).result()
@@ -0,0 +1,149 @@
+"""Module for profiling of te's own Python code.
+
+Two kinds of profiling are available:
+
+- a profiler of the whole run (`Profiler`), either deterministic cProfile of
+  all threads written as pstats file, or sampling of stacks of all threads
+  written in collapsed format for flame graph tools
+- cheap counters of calls and time spent in hot functions (`counted`)
+"""
+
+import collections
+import functools
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+# seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# suffixes of profile output files in collapsed stacks format
+COLLAPSED_SUFFIXES = (".collapsed", ".folded")
+
+_counters_enabled = False
+_counters_lock = threading.Lock()
+# name: [calls, seconds]
+counters = collections.defaultdict(lambda: [0, 0.0])
+
+
+def counted(name):
+    """Count calls and time of decorated function when counters are enabled."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _counters_enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with _counters_lock:
+                    counter = counters[name]
+                    counter[0] += 1
+                    counter[1] += elapsed
+
+        return wrapper
+
+    return decorator
+
+
+def enable_counters():
+    """Start counting calls of functions decorated by `counted`."""
+    global _counters_enabled  # pylint: disable=global-statement
+    _counters_enabled = True
+
+
+def log_counters():
+    """Log collected counters, the most time consuming first."""
+    with _counters_lock:
+        items = sorted(counters.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (calls, seconds) in items:
+        logger.debug(f"PROFILE: {name}: {calls} calls, {seconds:.3f}s")
+
+
+class Profiler:
+    """Profiler of all threads of the run.
+
+    Output format is chosen by suffix of the output path, collapsed stacks
+    (`.collapsed` or `.folded`) are sampled, anything else is a pstats file
+    of cProfile.
+    """
+
+    def __init__(self, path):
+        """Profiler initialization."""
+        self.path = path
+        self.sampling = path.endswith(COLLAPSED_SUFFIXES)
+        self._profiles = []
+        self._stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start profiling of the current thread and of threads started later."""
+        if self.sampling:
+            self._sampler = threading.Thread(
+                target=self._sample, name="te-profiler", daemon=True
+            )
+            self._sampler.start()
+            return
+        if sys.version_info >= (3, 12):
+            # cProfile is built on process-wide sys.monitoring, one profiler
+            # covers all threads and another one can't be enabled
+            self._profile_thread()
+            return
+        threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def _profile_thread(self, *_args):
+        """Profile the calling thread by its own cProfile profiler."""
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        profile.enable()
+
+    def _sample(self):
+        """Collect stacks of all other threads until stopped."""
+        own = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stop profiling and write the profile."""
+        if self.sampling:
+            self._stopped.set()
+            self._sampler.join()
+            with open(self.path, "w", encoding="utf-8") as profile_f:
+                for stack, count in self._stacks.items():
+                    profile_f.write(f"{stack} {count}\n")
+        else:
+            import pstats  # pylint: disable=import-outside-toplevel
+
+            threading.setprofile(None)
+            profiles = []
+            # the first is profile of the current thread, which has to be
+            # disabled first, disabling any other one turns off profiling
+            # of the current thread
+            for profile in self._profiles:
+                profile.create_stats()
+                if profile.stats:
+                    profiles.append(profile)
+            pstats.Stats(*profiles).dump_stats(self.path)
+        logger.debug(f"Profile written to {self.path}")
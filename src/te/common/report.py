@@ -0,0 +1,164 @@
+"""Module for resource usage of phases and steps and the run report."""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from xml.etree import ElementTree
+
+from te.common.cache import write_atomic
+from te.common.paths import STATE_DIR, test_dir
+
+logger = logging.getLogger(__name__)
+# usage of the phase or the step running in the current context
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+def default_report_path():
+    """Get path of the run report in test working directory."""
+    return os.path.join(test_dir(), STATE_DIR, "report.json")
+
+
+class Usage:
+    """Resources used by processes of a phase or a step.
+
+    Usage of processes is added also to the parent usage, i.e. usage of
+    a step is included in usage of its phase.
+    """
+
+    def __init__(self, parent=None):
+        """Usage initialization, wall time is measured from now."""
+        self.parent = parent
+        self.start = time.time()
+        self._started = time.monotonic()
+        self.wall = 0.0
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        # None until a process shows its own peak, see te.common.process.own_rusage
+        self.max_rss_kb = None
+        self.output_bytes = 0
+        self.processes = 0
+        # timings of Ansible tasks of a step, see te.common.ansible_events
+        self.tasks = None
+
+    def add_process(self, rusage, output_bytes=0):
+        """Add usage of finished process.
+
+        :param rusage: resource usage of the process as returned by wait4,
+            `ru_maxrss` is None when peak RSS of the process isn't known
+        :param output_bytes: bytes of the process output
+        """
+        usage = self
+        while usage is not None:
+            usage.processes += 1
+            usage.cpu_user += rusage.ru_utime
+            usage.cpu_system += rusage.ru_stime
+            # ru_maxrss is in kilobytes on Linux
+            if rusage.ru_maxrss is not None:
+                usage.max_rss_kb = max(usage.max_rss_kb or 0, rusage.ru_maxrss)
+            usage.output_bytes += output_bytes
+            usage = usage.parent
+
+    def stop(self):
+        """Measure wall time up to now."""
+        self.wall = time.monotonic() - self._started
+
+    def as_dict(self):
+        """Get usage as a dict for the run report."""
+        usage = {
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.start)),
+            "wall": round(self.wall, 3),
+            "cpu_user": round(self.cpu_user, 3),
+            "cpu_system": round(self.cpu_system, 3),
+            "max_rss_kb": self.max_rss_kb,
+            "output_bytes": self.output_bytes,
+            "processes": self.processes,
+        }
+        if self.tasks is not None:
+            usage["tasks"] = self.tasks
+        return usage
+
+
+class RunReport:
+    """Results and resource usage of phases and steps of a run."""
+
+    def __init__(self):
+        """Report initialization, the run starts now."""
+        self.usage = Usage()
+        self._lock = threading.Lock()
+        self._phases = []
+        self._steps = []
+
+    def add_phase(self, name, rc, usage):
+        """Add finished phase."""
+        with self._lock:
+            self._phases.append({"name": name, "rc": rc, **usage.as_dict()})
+
+    def add_step(self, phase, step_id, rc, usage, skipped=False):
+        """Add finished step.
+
+        :param phase: name of the phase of the step
+        :param step_id: identifier of the step within the phase
+        :param skipped: the step wasn't run, e.g. in resumed run
+        """
+        record = {"name": str(step_id), "rc": rc, "skipped": skipped}
+        record.update(usage.as_dict())
+        with self._lock:
+            self._steps.append((phase, record))
+
+    def as_dict(self, rc):
+        """Get report with steps nested in their phases in order of finish.
+
+        :param rc: return code of the run
+        """
+        phases = []
+        with self._lock:
+            for phase in self._phases:
+                steps = [step for name, step in self._steps if name == phase["name"]]
+                phases.append({**phase, "steps": steps})
+        self.usage.stop()
+        return {"rc": rc, **self.usage.as_dict(), "phases": phases}
+
+    def write_json(self, path, rc):
+        """Write the report as JSON."""
+        data = json.dumps(self.as_dict(rc), indent=2) + "\n"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        write_atomic(path, data.encode("utf-8"))
+        logger.debug(f"Run report written to {path}")
+
+    def write_junit(self, path, rc):
+        """Write the report as JUnit XML, phases are test suites."""
+        report = self.as_dict(rc)
+        suites = ElementTree.Element("testsuites", time=str(report["wall"]))
+        for phase in report["phases"]:
+            steps = phase["steps"]
+            suite = ElementTree.SubElement(
+                suites,
+                "testsuite",
+                name=phase["name"],
+                tests=str(len(steps)),
+                failures=str(sum(1 for step in steps if step["rc"] != 0)),
+                skipped=str(sum(1 for step in steps if step["skipped"])),
+                time=str(phase["wall"]),
+                timestamp=phase["start"],
+            )
+            for step in steps:
+                case = ElementTree.SubElement(
+                    suite,
+                    "testcase",
+                    classname=phase["name"],
+                    name=step["name"],
+                    time=str(step["wall"]),
+                )
+                if step["skipped"]:
+                    ElementTree.SubElement(case, "skipped")
+                elif step["rc"] != 0:
+                    ElementTree.SubElement(
+                        case, "failure", message=f"return code {step['rc']}"
+                    )
+        ElementTree.ElementTree(suites).write(
+            path, encoding="utf-8", xml_declaration=True
+        )
+        logger.debug(f"JUnit report written to {path}")
@@ -1,70 +1,520 @@
 """Module for executing phases and steps."""
 
+import contextvars
+import functools
 import logging
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from te.common.cache import ResultCache
 from te.common.config import config
 from te.common.exceptions import TimeoutException
 from te.common.extensions import install_extensions
+from te.common.log import prefixed
+from te.common.metadata import phase_keys, phase_needs, unique_keys
+from te.common.output import (
+    StepOutput,
+    capture_output,
+    log_failure_summary,
+    output_path,
+)
+from te.common.process import output_capture, replay_output
+from te.common.report import Usage, current_usage
 from te.common.step import step_types
+from te.common.trace import span
 
 logger = logging.getLogger(__name__)
+result_cache = ResultCache()
 
 
-def run_step(step, metadata_path, timeout):
+class DagScheduler:
+    """Scheduler running nodes of a dependency graph in a bounded worker pool.
+
+    A node starts as soon as all nodes it needs succeed. When a node fails,
+    only nodes which (transitively) depend on it are cancelled, independent
+    nodes keep running. Failure of a non-blocking node doesn't cancel
+    anything.
+    """
+
+    def __init__(self, max_workers):
+        """Scheduler initialization."""
+        self.max_workers = max_workers
+        self._nodes = {}
+        self.failed = []
+        self.stopped = []
+
+    def add(self, key, func, needs=(), label="", blocking=True):
+        """Add node to the graph.
+
+        :param key: unique identifier of the node
+        :param func: callable without arguments returning a return code
+        :param needs: keys of nodes which need to succeed before this one
+        :param label: prefix of the node output, nested in prefix of caller
+        :param blocking: if failure of the node cancels dependent nodes
+        """
+        self._nodes[key] = {
+            "func": func,
+            "needs": list(needs),
+            "label": label,
+            "blocking": blocking,
+        }
+
+    def _check(self):
+        """Check that graph references only known nodes and has no cycle."""
+        for key, node in self._nodes.items():
+            for dep in node["needs"]:
+                if dep not in self._nodes:
+                    raise RuntimeError(f"{key} needs unknown {dep}")
+
+        done = object()
+        visiting = {}
+        for root in self._nodes:
+            if root in visiting:
+                continue
+            visiting[root] = True
+            stack = [(root, iter(self._nodes[root]["needs"]))]
+            while stack:
+                key, deps = stack[-1]
+                dep = next(deps, done)
+                if dep is done:
+                    visiting[key] = False
+                    stack.pop()
+                elif visiting.get(dep):
+                    raise RuntimeError(f"Dependency cycle: {key} needs {dep}")
+                elif dep not in visiting:
+                    visiting[dep] = True
+                    stack.append((dep, iter(self._nodes[dep]["needs"])))
+
+    def _run_node(self, node):
+        if not node["label"]:
+            return node["func"]()
+        with prefixed(node["label"]):
+            return node["func"]()
+
+    def run(self):
+        """Run all nodes of the graph.
+
+        Keys of failed nodes are stored in `failed` in the order of failures,
+        keys of failed blocking nodes also in `stopped`.
+        The first exception raised by a node is re-raised after all other
+        nodes finish.
+
+        :return: dict of return codes by key, None for cancelled nodes
+        """
+        self._check()
+        results = {}
+        pending = list(self._nodes)
+        error = None
+
+        def broken(dep):
+            return dep in results and (
+                results[dep] is None
+                or (results[dep] != 0 and self._nodes[dep]["blocking"])
+            )
+
+        def satisfied(dep):
+            return dep in results and not broken(dep)
+
+        workers = max(1, min(self.max_workers or len(pending), len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            while pending or running:
+                changed = True
+                while changed:
+                    changed = False
+                    for key in list(pending):
+                        needs = self._nodes[key]["needs"]
+                        if any(broken(dep) for dep in needs):
+                            logger.debug(f"CANCELLED: {key}")
+                            results[key] = None
+                            pending.remove(key)
+                            changed = True
+                        elif all(satisfied(dep) for dep in needs):
+                            # every node runs in its own copy of the context
+                            future = executor.submit(
+                                contextvars.copy_context().run,
+                                self._run_node,
+                                self._nodes[key],
+                            )
+                            running[future] = key
+                            pending.remove(key)
+
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        results[key] = 1
+                    else:
+                        results[key] = future.result()
+                    if results[key] != 0:
+                        self.failed.append(key)
+                        if self._nodes[key]["blocking"]:
+                            self.stopped.append(key)
+
+        if error is not None:
+            raise error
+        return results
+
+
+def resolve_step(step):
+    """Get step type object for step from metadata configuration."""
+    step_runner = step_types.resolve(step)
+
+    if step_runner:
+        return step_runner
+    raise RuntimeError(f"Unsupported step type {str(step)}")
+
+
+def run_step(step, metadata_path, timeout, step_runner=None):
     """Run one specific step from metadata configuration.
 
     Step can have one of 'playbook', 'pytests', 'restraint' or 'command'
     attribute depending on the test type.
     :param metadata_path: provided metadata path
     :param timeout: seconds for step to timeout
+    :param step_runner: already resolved step type object for the step
     """
-    step_runner = step_types.resolve(step)
+    if step_runner is None:
+        step_runner = resolve_step(step)
+    return step_runner.run(timeout, metadata_path=metadata_path)
+
+
+def run_step_rc(step, metadata_path, timeout, step_runner=None):
+    """Run step and translate step timeout into return code 2."""
+    try:
+        return run_step(step, metadata_path, timeout, step_runner)
+    except TimeoutException as ex:
+        logger.error(ex.msg)
+        logger.error("PREMATURE STEP END - timeout")
+        return 2
+
+
+def run_cached_step(step, metadata_path, timeout, step_runner):
+    """Run step with `cache` option, replay its output on a cache hit.
+
+    Result cache is addressed by digest of all inputs of the step, only
+    output of successful runs is stored.
+    """
+    key = None
+    if not config["dry_run"]:
+        key = step_runner.cache_key(metadata_path=metadata_path)
+    if key is None:
+        return run_step_rc(step, metadata_path, timeout, step_runner)
+
+    output = result_cache.get(key)
+    if output is not None:
+        logger.info(f"CACHED STEP: {key[:12]} - replaying output")
+        for line in output:
+            replay_output(line)
+        return 0
+
+    output = []
+    token = output_capture.set(output)
+    try:
+        rc = run_step_rc(step, metadata_path, timeout, step_runner)
+    finally:
+        output_capture.reset(token)
+    if rc == 0:
+        result_cache.put(key, output)
+    return rc
 
-    if step_runner:
-        return step_runner.run(timeout, metadata_path=metadata_path)
-    raise RuntimeError(f"Unsupported step type {str(step)}")
 
+def stop_on_error(step):
+    """Check if failure of step should stop the execution."""
+    return step.get("stop-on-error", "True") != "False"
 
-def run_phases(phases, metadata, metadata_path, timeout=config["phase_timeout"]):
-    """Run discovered phases in sequence."""
-    for phase in phases:
-        name = phase.get("name", "<no name>")
 
-        if name == "init":
-            logger.info("INSTALLING EXTENSIONS")
+def batchable(step, step_runner):
+    """Get batch key of step which can run in a batch, None otherwise.
+
+    Steps with own timeout, cached steps and steps not stopping execution on
+    error are run alone, as well as steps with `batch: false`.
+    """
+    if step_runner is None or not step.get("batch", True):
+        return None
+    if "timeout" in step or step.get("cache") or not stop_on_error(step):
+        return None
+    return step_runner.batch_key()
+
+
+def join_batches(runners):
+    """Join consecutive batchable steps into batches.
+
+    :param runners: list of (step, step type object) in the order of steps
+    """
+    batch = []
+    key = None
+    for step, step_runner in runners + [({}, None)]:
+        step_key = batchable(step, step_runner)
+        if batch and (step_key is None or step_key != key):
+            if len(batch) > 1:
+                type(batch[0]).join_batch(batch)
+            batch = []
+        if step_key is not None:
+            batch.append(step_runner)
+            key = step_key
+
+
+def run_limited(limit, func):
+    """Run func while holding the limiting semaphore."""
+    with limit:
+        return func()
+
+
+def add_steps(scheduler, steps, run_func, skipped=None):
+    """Add steps of a phase into the scheduler.
+
+    A step needs steps named in its `needs` list. Step without `needs` needs
+    the preceding item of the phase, i.e. the previous step or all steps of
+    the previous `parallel` block. Steps of a `parallel` block don't need
+    each other.
+
+    Step identifier is the step name or its position (e.g. `2` or `3.1` in
+    a `parallel` block), repeated names get `-<occurrence>` suffix, so that
+    logs, report and journal entries of steps don't collide.
+
+    :param scheduler: DagScheduler to add the steps to
+    :param steps: list of phase steps as defined in metadata
+    :param run_func: callable to run a step, gets step identifier, step, its
+        `parallel` block (or None) and its resolved step type object
+    :param skipped: callable getting step identifier and step, True if the
+        step won't run (e.g. it succeeded in resumed run)
+
+    All steps are resolved before any of them runs, so that unsupported
+    step fails the phase before its execution begins. Consecutive steps of
+    plain sequential phases can be joined into batches, see `join_batches`.
+    """
+    items = []
+    names = {}
+    runners = {}
+    for index, item in enumerate(steps, 1):
+        if "parallel" in item:
+            members = [
+                (f"{index}.{pos}", step) for pos, step in enumerate(item["parallel"], 1)
+            ]
+        else:
+            members = [(f"{index}", item)]
+        items.append((item, members))
+        for key, step in members:
+            runners[key] = resolve_step(step)
+            if "name" in step:
+                names.setdefault(step["name"], []).append(key)
+    all_members = [member for _, members in items for member in members]
+    step_ids = dict(
+        zip(
+            [key for key, _ in all_members],
+            unique_keys(step.get("name", key) for key, step in all_members),
+        )
+    )
+
+    # keep output of plain sequential phases without prefixes
+    linear = not any("parallel" in item or "needs" in item for item in steps)
+    if linear:
+        batch_runners = []
+        for _, [(key, step)] in items:
+            # skipped step would still run as a task of the batch
+            if skipped is not None and skipped(step_ids[key], step):
+                batch_runners.append((step, None))
+            else:
+                batch_runners.append((step, runners[key]))
+        join_batches(batch_runners)
+    previous = []
+    for item, members in items:
+        block = item if "parallel" in item else None
+        limit = None
+        if block is not None and "max_parallel" in block:
+            limit = threading.BoundedSemaphore(block["max_parallel"])
+        for key, step in members:
+            if "needs" in step:
+                unknown = [name for name in step["needs"] if name not in names]
+                if unknown:
+                    raise RuntimeError(f"Step {key} needs unknown steps {unknown}")
+                needs = [key for name in step["needs"] for key in names[name]]
+            else:
+                needs = previous
+            func = functools.partial(run_func, step_ids[key], step, block, runners[key])
+            if limit is not None:
+                func = functools.partial(run_limited, limit, func)
+            scheduler.add(
+                key,
+                func,
+                needs,
+                label="" if linear else step_ids[key],
+                blocking=stop_on_error(step),
+            )
+        previous = [key for key, _ in members]
+
+
+def run_phase(
+    phase,
+    metadata,
+    metadata_path,
+    timeout,
+    journal=None,
+    report=None,
+    failures=None,
+    key=None,
+):
+    """Run steps of a phase.
+
+    Steps which already succeeded according to the journal are skipped,
+    finished steps are recorded to it. Usage of the phase and of its steps
+    is added to the report. Output of each step is written to its own file,
+    failed steps with their output are added to `failures` list.
+
+    :param key: unique key of the phase in the journal, the report and step
+        logs (see `phase_keys`), the phase name by default
+    :return: 0 on success, return code of the step which stopped the
+        execution or 1 if any other step failed
+    """
+    if key is None:
+        key = phase.get("name", "<no name>")
+    usage = Usage(parent=current_usage.get())
+    token = current_usage.set(usage)
+    try:
+        with span(key, "phase") as trace_args:
+            rc = _run_phase(
+                phase, key, metadata, metadata_path, timeout, journal, report, failures
+            )
+            trace_args["rc"] = rc
+    finally:
+        current_usage.reset(token)
+        usage.stop()
+    if report is not None:
+        report.add_phase(key, rc, usage)
+    return rc
+
+
+def _run_phase(
+    phase, name, metadata, metadata_path, timeout, journal, report, failures
+):
+    """Run steps of a phase, see `run_phase`."""
+    if phase.get("name") == "init":
+        logger.info("INSTALLING EXTENSIONS")
+        with span("install extensions", "extensions"):
             rc = install_extensions(metadata.get("extensions", []))
-            if rc:
-                return rc
-
-        phase_timeout = phase.get("timeout", timeout)
-        logger.info(f"PHASE START: {name}")
-        logger.info(f"Phase timeout: {phase_timeout}s")
-
-        failed = False
-        for step in phase.get("steps", []):
-            logger.info("")
-            step_start = int(time.time())
-            # metadata can override step timeout - so it can run longer
-            # then a phase timeout but in such case it should time-out
-            # if there is some next step after it.
-            step_timeout = step.get("timeout", phase_timeout)
-            try:
-                rc = run_step(step, metadata_path, step_timeout)
-            except TimeoutException as ex:
-                logger.error(ex.msg)
-                logger.error("PREMATURE STEP END - timeout")
-                rc = 2
-            if rc != 0:
-                failed = True
-                if step.get("stop-on-error", "True") != "False":
-                    logger.error("STOPPING EXECUTION")
-                    return rc
-            step_end = int(time.time())
-            phase_timeout -= step_end - step_start
-        logger.info(f"PHASE END: {name}\n")
-        if failed:
-            logger.error("PHASE: Some step in phase failed")
-            logger.error("STOPPING EXECUTION")
-            return 1
+        if rc:
+            return rc
+
+    phase_timeout = phase.get("timeout", timeout)
+    logger.info(f"PHASE START: {name}")
+    logger.info(f"Phase timeout: {phase_timeout}s")
+    phase_start = time.monotonic()
+
+    def run_phase_step(step_id, step, block, step_runner):
+        logger.info("")
+        if journal is not None and journal.succeeded(name, step_id, step):
+            logger.info(f"SKIPPING STEP: {step_id} - succeeded in resumed run")
+            if report is not None:
+                report.add_step(name, step_id, 0, Usage(), skipped=True)
+            return 0
+        # metadata can override step timeout - so it can run longer
+        # then a phase timeout but in such case it should time-out
+        # if there is some next step after it.
+        remaining = phase_timeout - int(time.monotonic() - phase_start)
+        if block is not None:
+            remaining = block.get("timeout", remaining)
+        step_timeout = step.get("timeout", remaining)
+        usage = Usage(parent=current_usage.get())
+        token = current_usage.set(usage)
+        output = StepOutput(output_path(name, step_id))
+        try:
+            with capture_output(output), span(str(step_id), "step") as trace_args:
+                if step.get("cache"):
+                    rc = run_cached_step(step, metadata_path, step_timeout, step_runner)
+                else:
+                    rc = run_step_rc(step, metadata_path, step_timeout, step_runner)
+                trace_args["rc"] = rc
+        finally:
+            current_usage.reset(token)
+            usage.stop()
+        logger.debug(
+            f"STEP USAGE: {step_id} - wall {usage.wall:.3f}s, "
+            f"cpu {usage.cpu_user + usage.cpu_system:.3f}s, "
+            f"max rss {usage.max_rss_kb or '-'} kB, output {usage.output_bytes} B"
+        )
+        if journal is not None:
+            journal.record(name, step_id, step, rc, usage.start, usage.wall)
+        if report is not None:
+            report.add_step(name, step_id, rc, usage)
+        if rc != 0 and failures is not None:
+            failures.append((name, step_id, rc, output))
+        return rc
+
+    scheduler = DagScheduler(phase.get("max_parallel", config["max_parallel"]))
+    skipped = None
+    if journal is not None:
+        skipped = functools.partial(journal.succeeded, name)
+    add_steps(scheduler, phase.get("steps", []), run_phase_step, skipped)
+    results = scheduler.run()
+
+    if scheduler.stopped:
+        logger.error("STOPPING EXECUTION")
+        return results[scheduler.stopped[0]]
+    logger.info(f"PHASE END: {name}\n")
+    if scheduler.failed:
+        logger.error("PHASE: Some step in phase failed")
+        logger.error("STOPPING EXECUTION")
+        return 1
+    return 0
+
+
+def run_phases(
+    phases,
+    metadata,
+    metadata_path,
+    timeout=config["phase_timeout"],
+    journal=None,
+    report=None,
+):
+    """Run discovered phases.
+
+    Phases and their steps form a dependency graph (see `phase_needs` and
+    `add_steps`). Without any `needs` or `parallel` blocks in metadata it
+    means running them in sequence. Independent phases and steps run
+    concurrently, at most `max_parallel` (of the phase for steps) at once.
+
+    :param journal: Journal of finished steps, see `run_phase`
+    :param report: RunReport collecting results and usage of phases and steps
+    """
+    failures = []
+    defined = metadata.get("phases", phases)
+    needs = phase_needs(phases, known=[phase.get("name") for phase in defined])
+    linear = not any("needs" in phase for phase in phases)
+    # keys by position in metadata, so they don't change with selected phases
+    keys = dict(zip(map(id, defined), phase_keys(defined)))
+    default_keys = phase_keys(phases)
+
+    scheduler = DagScheduler(config["max_parallel"])
+    for index, phase in enumerate(phases):
+        key = keys.get(id(phase), default_keys[index])
+        scheduler.add(
+            index,
+            functools.partial(
+                run_phase,
+                phase,
+                metadata,
+                metadata_path,
+                timeout,
+                journal,
+                report,
+                failures,
+                key,
+            ),
+            needs[index],
+            label="" if linear else key,
+        )
+    token = current_usage.set(report.usage if report is not None else None)
+    try:
+        results = scheduler.run()
+    finally:
+        current_usage.reset(token)
+
+    log_failure_summary(failures)
+    if scheduler.failed:
+        return results[scheduler.failed[0]]
     return 0
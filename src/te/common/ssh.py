@@ -0,0 +1,104 @@
+"""Module for SSH connections to remote hosts."""
+
+import atexit
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from te.common.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Pool of persistent SSH master connections shared by the whole run.
+
+    The first ssh or scp call to a host becomes a master connection
+    (ControlMaster) which persists in background and all following calls to
+    the same host reuse it instead of a new handshake. Ansible shares the
+    control directory (see `te.common.ansible`), so it reuses the same
+    connections. All master connections are closed at exit.
+    """
+
+    def __init__(self):
+        """Pool initialization, control directory is created on first use."""
+        self._control_dir = None
+        self._lock = threading.Lock()
+
+    @property
+    def control_dir(self):
+        """Get directory of control sockets of the run."""
+        with self._lock:
+            if self._control_dir is None:
+                # socket path length is limited, keep it short
+                self._control_dir = tempfile.mkdtemp(prefix="te-ssh-", dir="/tmp")
+                atexit.register(self.close)
+            return self._control_dir
+
+    @property
+    def control_path(self):
+        """Get path template of control sockets."""
+        return os.path.join(self.control_dir, "%C")
+
+    def options(self):
+        """Get ssh options to multiplex connections."""
+        if not config["ssh_multiplexing"]:
+            return []
+        control_path = self.control_path
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={control_path}",
+            "-o",
+            f"ControlPersist={config['ssh_control_persist']}",
+        ]
+
+    def close(self):
+        """Close all master connections and remove their control sockets."""
+        with self._lock:
+            control_dir, self._control_dir = self._control_dir, None
+        if control_dir is None:
+            return
+
+        processes = []
+        # sockets of connections opened by te as well as by Ansible
+        for socket_name in sorted(os.listdir(control_dir)):
+            logger.debug(f"Closing SSH connection: {socket_name}")
+            control_path = os.path.join(control_dir, socket_name)
+            # host is not used when control path doesn't contain tokens
+            cmd = ["ssh", "-o", f"ControlPath={control_path}", "-O", "exit", "te"]
+            try:
+                process = subprocess.Popen(  # pylint: disable=R1732
+                    cmd,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            except OSError as e:
+                logger.debug(f"Unable to close SSH connection: {e}")
+                continue
+            processes.append(process)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        shutil.rmtree(control_dir, ignore_errors=True)
+
+
+pool = ConnectionPool()
+
+
+def ssh_args(key_path):
+    """Get common options of ssh and scp commands."""
+    return [
+        "-i",
+        f"{key_path}",
+        "-o",
+        "StrictHostKeyChecking=no",
+    ] + pool.options()
@@ -1,13 +1,51 @@
 """Module with base classes for steps and their registration."""
 
+import importlib
+import threading
+
 
 class StepType:
-    """Base class for steps."""
+    """Base class for steps.
+
+    Step type is identified either by one of its `keys` being in step
+    options, which is a fast lookup, or by its `match` method. Step types
+    without keys are tried in order of their `priority` (lower first) and
+    of registration.
+    """
+
+    keys = ()
+    priority = 0
 
     def run(self, timeout, **kwargs):
         """Run the step."""
         raise NotImplementedError
 
+    def cache_key(self, **kwargs):
+        """Get digest of all inputs of the step for result cache.
+
+        :return: None if result of the step can't be cached
+        """
+        return None
+
+    def batch_key(self):
+        """Get key of steps which can run together in one batch.
+
+        Consecutive steps of a phase with the same key are passed to
+        `join_batch` of their type.
+
+        :return: None if the step can't run in a batch
+        """
+        return None
+
+    @classmethod
+    def join_batch(cls, step_runners):
+        """Make step type objects of consecutive steps run as one batch.
+
+        Steps of a batch are still run one by one, first of them starts the
+        batch and each of them reports its own result.
+        """
+        raise NotImplementedError
+
     @staticmethod
     def match(options):
         """Figure out of this StepType matches step in job metadata."""
@@ -19,15 +57,54 @@ class StepTypes:
 
     def __init__(self):
         """Registry initialization."""
-        self._step_types = set()
+        self._by_key = {}
+        self._fallback = []
+        self._lazy = {}
+        self._lock = threading.Lock()
 
     def register(self, step_type):
-        """Register new step type."""
-        self._step_types.add(step_type)
+        """Register new step type.
+
+        Step type registered later for the same key replaces the former one.
+        """
+        if step_type.keys:
+            for key in step_type.keys:
+                self._by_key[key] = step_type
+        elif step_type not in self._fallback:
+            self._fallback.append(step_type)
+            # stable sort keeps registration order within a priority
+            self._fallback.sort(key=lambda registered: registered.priority)
+
+    def register_lazy(self, key, target):
+        """Register step type which is imported only when needed.
+
+        :param key: key in step options which identifies the step type
+        :param target: step type class as "module:ClassName"
+        """
+        self._lazy[key] = target
+
+    def _load_lazy(self, options):
+        """Import and register lazy step types matching keys of options."""
+        with self._lock:
+            for key in [key for key in options if key in self._lazy]:
+                module_name, class_name = self._lazy[key].split(":")
+                module = importlib.import_module(module_name)
+                self.register(getattr(module, class_name))
+                del self._lazy[key]
 
     def resolve(self, options):
-        """Get matching StepType."""
-        for step_type in self._step_types:
+        """Get matching StepType.
+
+        Keys of options are looked up in order of options, step types
+        without keys are tried only if none of keys identifies a step type.
+        """
+        if self._lazy:
+            self._load_lazy(options)
+        for key in options:
+            step_type = self._by_key.get(key)
+            if step_type is not None and step_type.match(options):
+                return step_type(options)
+        for step_type in self._fallback:
             if step_type.match(options):
                 return step_type(options)
         return None
@@ -0,0 +1,164 @@
+"""Module for tracing of runs in Chrome trace event format.
+
+Trace can be loaded into Perfetto (https://ui.perfetto.dev) or
+chrome://tracing to see spans of phases, steps and subprocesses on
+a timeline.
+"""
+
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+# track (trace thread id) of spans in the current context
+_track = contextvars.ContextVar("trace_track", default=None)
+# track of spans of borrowing thread in the current context, see
+# `Tracer._acquire_lane`
+_lane = contextvars.ContextVar("trace_lane", default=None)
+
+
+class Tracer:
+    """Collector of trace events, disabled until `enable` is called."""
+
+    def __init__(self):
+        """Tracer initialization."""
+        self.enabled = False
+        self._events = []
+        self._tracks = set()
+        self._borrowing = set()
+        # tracks of concurrent spans of borrowing thread by borrowed track
+        self._lanes = {}
+        self._busy = set()
+        self._lane_ids = itertools.count(1)
+        self._names = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def enable(self):
+        """Start collecting trace events."""
+        self.enabled = True
+
+    def borrow_tracks(self, thread_id):
+        """Show spans of thread in tracks of contexts it runs in.
+
+        Used for the thread of the process engine, so that processes are
+        shown in the track of the step which started them.
+        """
+        self._borrowing.add(thread_id)
+
+    def _now(self):
+        """Get microseconds since the tracer creation."""
+        return (time.perf_counter_ns() - self._origin) / 1000
+
+    def _name_track(self, track, name):
+        """Add event naming the track, the lock must be held."""
+        self._events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": track,
+                "args": {"name": name},
+            }
+        )
+
+    def _acquire_lane(self, track):
+        """Get free track for span of borrowing thread in borrowed track.
+
+        Processes of a step run concurrently in the process engine, their
+        spans overlap without nesting. The first of them is shown in the
+        track of the step, the others in additional tracks named after it.
+        """
+        with self._lock:
+            lanes = self._lanes.setdefault(track, [track])
+            free = [lane for lane in lanes if lane not in self._busy]
+            if free:
+                lane = free[0]
+            else:
+                lane = next(self._lane_ids)
+                lanes.append(lane)
+                name = self._names.get(track, str(track))
+                self._name_track(lane, f"{name} #{len(lanes)}")
+            self._busy.add(lane)
+        return lane
+
+    def _release(self, lane, token):
+        with self._lock:
+            self._busy.discard(lane)
+        _lane.reset(token)
+
+    def _current_track(self):
+        """Get track of the current context, name new tracks by thread.
+
+        :return: tuple (track, callable to call once the span ends or None)
+        """
+        track = _track.get()
+        thread_id = threading.get_ident()
+        if track is not None and track == thread_id:
+            return track, None
+        if track is not None and thread_id in self._borrowing:
+            lane = _lane.get()
+            # span nested in span of the same context
+            if lane is not None:
+                return lane, None
+            lane = self._acquire_lane(track)
+            token = _lane.set(lane)
+            return lane, lambda: self._release(lane, token)
+        track = thread_id
+        with self._lock:
+            if track not in self._tracks:
+                self._tracks.add(track)
+                self._names[track] = threading.current_thread().name
+                self._name_track(track, self._names[track])
+        token = _track.set(track)
+        return track, lambda: _track.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name, cat, **args):
+        """Record duration of the block as a span.
+
+        :param name: name of the span shown in the timeline
+        :param cat: category of the span, e.g. "phase" or "process"
+        :param args: additional values shown with the span, the dict is
+            yielded so the block can add results to it
+        """
+        if not self.enabled:
+            yield args
+            return
+        track, end = self._current_track()
+        start = self._now()
+        try:
+            yield args
+        finally:
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start,
+                "dur": self._now() - start,
+                "pid": os.getpid(),
+                "tid": track,
+                "args": args,
+            }
+            with self._lock:
+                self._events.append(event)
+            if end is not None:
+                end()
+
+    def write(self, path):
+        """Write collected events as trace JSON file."""
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms"},
+                trace_file,
+                default=str,
+            )
+
+
+tracer = Tracer()
+span = tracer.span
@@ -5,11 +5,27 @@ import sys
 
 import yaml
 
+from te.common.profiling import counted
 
+try:
+    # libyaml based implementation is much faster when available
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+@counted("parse_yaml")
+def parse_yaml(stream):
+    """Parse yaml document from string, bytes or file."""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+@counted("read_yaml")
 def read_yaml(path):
     """Read yaml file on provided path."""
     with open(path, "r", encoding="utf-8") as file_data:
-        data = yaml.safe_load(file_data)
+        data = parse_yaml(file_data)
     return data
 
 
@@ -34,7 +50,7 @@ def save_yaml(path, data):
     If path is not specified use stdout.
     """
     with fd_open(path) as yaml_file:
-        yaml_file.write(yaml.dump(data, default_flow_style=False))
+        yaml_file.write(yaml.dump(data, Dumper=SafeDumper, default_flow_style=False))
 
 
 def save_data(path, data):
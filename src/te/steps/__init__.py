@@ -1,17 +1,30 @@
 """Build-in steps."""
 
+import importlib
+
 from te.common.step import step_types
-from te.steps.command import CommandStep
-from te.steps.module import ModuleStep
-from te.steps.playbook import PlaybookStep
-from te.steps.pytests import PytestsStep
-from te.steps.restraint import RestraintStep
+
+# Build-in step types by the key identifying them in step options. They are
+# imported only when metadata contain such step.
+STEPS = {
+    "command": "te.steps.command:CommandStep",
+    "module": "te.steps.module:ModuleStep",
+    "playbook": "te.steps.playbook:PlaybookStep",
+    "pytests": "te.steps.pytests:PytestsStep",
+    "restraint": "te.steps.restraint:RestraintStep",
+}
 
 
 def register_steps():
     """Register common steps."""
-    step_types.register(CommandStep)
-    step_types.register(ModuleStep)
-    step_types.register(PlaybookStep)
-    step_types.register(PytestsStep)
-    step_types.register(RestraintStep)
+    for key, target in STEPS.items():
+        step_types.register_lazy(key, target)
+
+
+def __getattr__(name):
+    """Import step type classes on first access."""
+    for target in STEPS.values():
+        module_name, class_name = target.split(":")
+        if class_name == name:
+            return getattr(importlib.import_module(module_name), class_name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
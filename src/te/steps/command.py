@@ -1,34 +1,74 @@
 """Command step module."""
 
+import asyncio
 import logging
+import math
 import os
 import tempfile
 import uuid
 
 from te.common.config import config
-from te.common.inventory import to_external_hostname
+from te.common.exceptions import TimeoutException
+from te.common.inventory import resolve_hosts, to_external_hostname
+from te.common.log import prefixed
+from te.common.output import child_output
 from te.common.paths import test_dir
-from te.common.process import common_popen_args, run
+from te.common.process import common_popen_args, engine, run, run_async
+from te.common.ssh import ssh_args
 from te.common.step import StepType
+from te.common.trace import span
 
 logger = logging.getLogger(__name__)
 
+# remote shell command storing script from stdin, running and removing it
+STREAMED_SCRIPT = (
+    'f=$(mktemp) && cat > "$f" && bash "$f"; rc=$?; rm -f "$f"; exit "$rc"'
+)
+
 
 class CommandStep(StepType):
     """Step for executing shell command on a remote or local machine."""
 
+    keys = ("command",)
+
     def __init__(self, options):
         """Step initialization."""
         self.host = options.get("host", "localhost")
         self.cmd_text = options["command"].strip()
         self.cwd = options.get("cwd")
         self.user = options.get("user", "root")
+        self.script_transfer = options.get("script_transfer", config["script_transfer"])
+        self.max_parallel = options.get("max_parallel")
+        self.rc_policy = options.get("rc_policy", "all")
 
     def run(self, timeout, **kwargs):
-        """Execute command step."""
+        """Execute command step.
+
+        Host can be also a list, group or wildcard pattern of inventory hosts
+        in which case the command runs on all of them concurrently.
+        """
         if self.host == "localhost":
             return local_command(self.cmd_text, self.cwd, timeout)
-        return remote_command(self.cmd_text, self.host, self.cwd, self.user, timeout)
+        hosts = resolve_hosts(self.host)
+        if hosts != [self.host]:
+            return fanout_command(
+                self.cmd_text,
+                hosts,
+                self.cwd,
+                self.user,
+                timeout,
+                script_transfer=self.script_transfer,
+                max_parallel=self.max_parallel,
+                rc_policy=self.rc_policy,
+            )
+        return remote_command(
+            self.cmd_text,
+            self.host,
+            self.cwd,
+            self.user,
+            timeout,
+            script_transfer=self.script_transfer,
+        )
 
     @staticmethod
     def match(options):
@@ -40,16 +80,15 @@ def upload_script(script_code, host, user, key_path):
     """Upload shell script to remove host."""
     filename = f"{uuid.uuid4().hex}.sh"
 
-    with tempfile.NamedTemporaryFile(mode="w+") as temp_f:
+    with span("upload script", "ssh", host=host), tempfile.NamedTemporaryFile(
+        mode="w+"
+    ) as temp_f:
         temp_f.write(script_code)
         temp_f.flush()
 
         cmd = [
             "scp",
-            "-i",
-            f"{key_path}",
-            "-o",
-            "StrictHostKeyChecking=no",
+            *ssh_args(key_path),
             temp_f.name,
             f"{user}@{host}:~/{filename}",
         ]
@@ -74,19 +113,16 @@ def local_command(cmd_text, cwd, timeout):
     return returncode
 
 
-def remote_command(cmd_text, host, cwd, user, timeout):
-    """Run remote (SSH) command.
+def remote_command_args(cmd_text, host, cwd, user, script_transfer="stdin"):
+    """Prepare SSH command running `cmd_text` on a remote host.
 
-    :param cmd_text: a command string (including parameters)
-    :param host: remote host
-    :param cwd: working directory
-    :param user: remote user
-    :param timeout: seconds for step to timeout
+    Multi-line command is run as a script. By default the script is streamed
+    to stdin of the SSH session which stores it into a temporary file, runs
+    it and removes it. With `script_transfer` set to "scp" the script is
+    uploaded first by a separate scp call.
 
-    :return: remote command exit code
+    :return: tuple of the SSH command list and data for its stdin (or None)
     """
-    logger.info("REMOTE COMMAND STEP START")
-
     logger.debug(f"Host: {host}")
     logger.debug(f"User: {user}")
     if cwd:
@@ -101,20 +137,25 @@ def remote_command(cmd_text, host, cwd, user, timeout):
 
     cmd = [
         "ssh",
-        "-i",
-        f"{key_path}",
-        "-o",
-        "StrictHostKeyChecking=no",
+        *ssh_args(key_path),
         f"{user}@{real_host}",
     ]
 
+    stdin_data = None
     if len(cmd_text.splitlines()) > 1:
         if cwd:
             cmd_text = f"cd {cwd}\n" + cmd_text
         cmd_text = "set -x\n" + cmd_text
-        logger.debug("Command: uploading script")
-        script_path = upload_script(cmd_text, real_host, user, key_path)
-        cmd.append(f"bash ~/{script_path}")
+        if script_transfer == "scp":
+            logger.debug("Command: uploading script")
+            script_path = upload_script(cmd_text, real_host, user, key_path)
+            script_path = f"~/{script_path}"
+            cmd.append(f'bash {script_path}; rc=$?; rm -f {script_path}; exit "$rc"')
+        else:
+            # script is read whole before it's executed so that commands
+            # in it can't consume its rest from stdin
+            stdin_data = cmd_text.encode("utf-8")
+            cmd.append(STREAMED_SCRIPT)
         logger.debug("Command: executing")
 
     else:
@@ -123,8 +164,124 @@ def remote_command(cmd_text, host, cwd, user, timeout):
             cmd_text = f"cd {cwd} && {cmd_text}"
         cmd.append(cmd_text)
 
-    returncode = run(cmd, common_popen_args(), timeout)
+    return cmd, stdin_data
+
+
+def remote_command(cmd_text, host, cwd, user, timeout, script_transfer="stdin"):
+    """Run remote (SSH) command.
+
+    :param cmd_text: a command string (including parameters)
+    :param host: remote host
+    :param cwd: working directory
+    :param user: remote user
+    :param timeout: seconds for step to timeout
+    :param script_transfer: "stdin" or "scp", see `remote_command_args`
+
+    :return: remote command exit code
+    """
+    logger.info("REMOTE COMMAND STEP START")
+
+    cmd, stdin_data = remote_command_args(cmd_text, host, cwd, user, script_transfer)
+    returncode = run(cmd, common_popen_args(), timeout, stdin_data=stdin_data)
+
+    logger.info(f"RETURN CODE: {returncode}")
+    logger.info("REMOTE COMMAND STEP END")
+    return returncode
+
+
+def aggregate_returncode(returncodes, policy="all"):
+    """Get return code of a command run on multiple hosts.
+
+    :param returncodes: list of return codes of all hosts
+    :param policy: how many hosts need to succeed: "all", "any", a number
+        or a percentage of hosts (e.g. "80%")
+
+    :return: 0 if enough hosts succeeded, otherwise the first failed return
+        code
+    """
+    failed = [rc for rc in returncodes if rc != 0]
+    try:
+        if policy == "all":
+            required = len(returncodes)
+        elif policy == "any":
+            required = min(1, len(returncodes))
+        elif isinstance(policy, str) and policy.endswith("%"):
+            required = math.ceil(len(returncodes) * float(policy[:-1]) / 100)
+        else:
+            required = int(policy)
+    except ValueError as e:
+        raise RuntimeError(f"Invalid return code policy: {policy}") from e
+
+    if len(returncodes) - len(failed) >= required:
+        return 0
+    return failed[0] if failed else 1
+
+
+async def _run_on_host(host, cmd, stdin_data, timeout, limit):
+    """Run prepared SSH command, its output prefixed by host name."""
+    async with limit:
+        with prefixed(host), child_output(host):
+            try:
+                returncode = await run_async(
+                    cmd, common_popen_args(), timeout, stdin_data=stdin_data
+                )
+            except TimeoutException as ex:
+                logger.error(ex.msg)
+                returncode = 2
+            logger.info(f"RETURN CODE: {returncode}")
+            return returncode
+
+
+async def _run_on_hosts(commands, timeout, max_parallel):
+    """Run prepared SSH commands concurrently."""
+    limit = asyncio.Semaphore(max_parallel)
+    return await asyncio.gather(
+        *[
+            _run_on_host(host, cmd, stdin_data, timeout, limit)
+            for host, (cmd, stdin_data) in commands.items()
+        ]
+    )
+
+
+def fanout_command(
+    cmd_text,
+    hosts,
+    cwd,
+    user,
+    timeout,
+    script_transfer="stdin",
+    max_parallel=None,
+    rc_policy="all",
+):
+    """Run remote (SSH) command on multiple hosts concurrently.
+
+    :param hosts: list of remote hosts, at least one
+    :param max_parallel: maximum of hosts to run the command at once
+    :param rc_policy: policy of the result, see `aggregate_returncode`
+
+    Other parameters are the same as of `remote_command`.
+
+    :return: aggregated exit code
+    """
+    if not hosts:
+        raise RuntimeError("No hosts to run remote command on")
+    logger.info("REMOTE COMMAND STEP START")
+    logger.debug(f"Hosts: {', '.join(hosts)}")
+
+    commands = {}
+    for host in hosts:
+        with prefixed(host):
+            commands[host] = remote_command_args(
+                cmd_text, host, cwd, user, script_transfer
+            )
+    returncodes = engine.submit(
+        _run_on_hosts(commands, timeout, max_parallel or config["max_parallel"])
+    ).result()
+    returncode = aggregate_returncode(returncodes, rc_policy)
 
+    failed = [host for host, rc in zip(hosts, returncodes) if rc != 0]
+    if failed:
+        logger.info(f"Failed hosts: {', '.join(failed)}")
     logger.info(f"RETURN CODE: {returncode}")
     logger.info("REMOTE COMMAND STEP END")
     return returncode
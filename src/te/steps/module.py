@@ -1,22 +1,177 @@
 """Module for 'module' step."""
 
+import json
 import logging
 import os
+import queue
+import threading
+from tempfile import NamedTemporaryFile
 
-from te.common.ansible import add_extra_vars_option, ansible_env
+from te.common.ansible import (
+    add_extra_vars_option,
+    ansible_env,
+    events_callback_env,
+    parse_event,
+    task_rc,
+)
+from te.common.ansible_worker import run_ansible, run_ansible_async
+from te.common.cache import inputs_digest, read_input
 from te.common.config import config
 from te.common.inventory import INVENTORY
 from te.common.paths import test_dir
-from te.common.process import common_popen_args, run
+from te.common.process import common_popen_args, engine, replay_output
 from te.common.step import StepType
 
 ANSIBLE = "ansible"
+ANSIBLE_PLAYBOOK = "ansible-playbook"
 logger = logging.getLogger(__name__)
 
 
+class ModuleBatch:
+    """Consecutive module steps run as tasks of one ansible-playbook process.
+
+    The first step of the batch which runs starts the playbook with a task
+    for itself and for each following step. Every step then waits for events
+    of its own task printed by te_events callback, logs output of the task
+    and returns the return code ansible command would have for it. The play
+    ends on the first failure like the steps would end the phase.
+    """
+
+    def __init__(self, steps):
+        """Batch initialization.
+
+        :param steps: ModuleStep objects with the same `batch_key`
+        """
+        self.steps = steps
+        self._queues = [queue.SimpleQueue() for _ in steps]
+        self._lock = threading.Lock()
+        self._future = None
+        # state of events handling, updated only in the process engine
+        self._task = None
+        self._tail = 0
+        self._statuses = []
+        self._duration = 0.0
+
+    def playbook(self, first):
+        """Get playbook running steps from index `first` as its tasks."""
+        return [
+            {
+                "name": f"te batch of {len(self.steps) - first} module steps",
+                "hosts": self.steps[first].host_pattern,
+                "gather_facts": False,
+                "become": True,
+                "any_errors_fatal": True,
+                "tasks": [
+                    {
+                        "name": f"{step.module} {step.arguments}".strip(),
+                        step.module: step.arguments or None,
+                    }
+                    for step in self.steps[first:]
+                ],
+            }
+        ]
+
+    def _put(self, message):
+        """Pass message to step of the running task or of the last one."""
+        index = self._tail if self._task is None else self._task
+        self._queues[min(index, len(self._queues) - 1)].put(message)
+
+    def _end_task(self, last=False):
+        if self._task is None:
+            return
+        rc = task_rc(self._statuses)
+        self._queues[self._task].put(("end", rc, self._duration))
+        # output after failed or last task belongs to it, otherwise to the
+        # next task
+        self._tail = self._task if rc or last else self._task + 1
+        self._task = None
+
+    def _on_line(self, line):
+        """Handle line of the playbook output in the process engine."""
+        event = parse_event(line)
+        if event is None:
+            self._put(("line", line))
+        elif event["event"] == "task_start":
+            self._end_task()
+            self._task = self._tail
+            self._statuses = []
+            self._duration = 0.0
+        elif event["event"] == "result":
+            self._statuses.append(event.get("status"))
+            self._duration = max(self._duration, event.get("duration") or 0.0)
+            for text in event.get("output", "").splitlines():
+                self._put(("line", text))
+        elif event["event"] == "stats":
+            self._end_task(last=True)
+
+    def _on_exit(self, future, playbook_path):
+        """Pass exit of the playbook process to all waiting steps."""
+        os.remove(playbook_path)
+        if future.exception() is not None:
+            message = ("error", future.exception())
+        else:
+            message = ("exit", future.result())
+        for step_queue in self._queues:
+            step_queue.put(message)
+
+    def _start(self, first, timeout, metadata_path):
+        """Start playbook process running steps from index `first`."""
+        with NamedTemporaryFile(mode="w", suffix=".yaml", delete=False) as temp_f:
+            # JSON is also YAML
+            json.dump(self.playbook(first), temp_f)
+            playbook_path = temp_f.name
+        cmd = [ANSIBLE_PLAYBOOK]
+        cmd.extend(self.steps[first].ansible_options(metadata_path))
+        cmd.append(playbook_path)
+
+        run_args = common_popen_args()
+        run_args["env"] = ansible_env()
+        run_args["env"].update(events_callback_env(run_args["env"], run_args["cwd"]))
+        logger.info(f"MODULE BATCH START: {len(self.steps) - first} steps")
+        logger.info(f"CMD: {' '.join(cmd)}")
+
+        self._tail = first
+        self._future = engine.submit(
+            run_ansible_async(cmd, run_args, timeout, on_line=self._on_line)
+        )
+        self._future.add_done_callback(
+            lambda future: self._on_exit(future, playbook_path)
+        )
+
+    def run_step(self, step, timeout, metadata_path):
+        """Run step of the batch, starting the batch if it isn't running.
+
+        :param timeout: seconds for the whole batch to timeout, used by the
+            step which starts the batch
+        :return: return code of the task of the step
+        """
+        index = self.steps.index(step)
+        with self._lock:
+            if self._future is None:
+                self._start(index, timeout, metadata_path)
+        last = index == len(self.steps) - 1
+        rc = None
+        while True:
+            message = self._queues[index].get()
+            if message[0] == "line":
+                replay_output(message[1])
+            elif message[0] == "end":
+                _, rc, duration = message
+                logger.debug(f"TASK TIME: {duration:.3f}s")
+                # process exits after failed or last task, wait for it
+                if rc == 0 and not last:
+                    return rc
+            elif message[0] == "exit":
+                return rc or message[1]
+            else:
+                raise message[1]
+
+
 class ModuleStep(StepType):
     """Step for executing individual Ansible module."""
 
+    keys = ("module",)
+
     def __init__(self, options):
         """Initialize playbook step."""
         self.module = options["module"]
@@ -25,51 +180,98 @@ class ModuleStep(StepType):
         self.extra_vars = options.get("extra_vars", {})
         self.extra_args = options.get("extra_args", [])
         self.inventory = options.get("inventory", INVENTORY)
+        # ModuleBatch running the step, see `join_batch`
+        self.batch = None
 
-    def run(self, timeout, **kwargs):
-        """Run single ansible module via ansible command.
+    def ansible_options(self, metadata_path):
+        """Get options of Ansible commands running the module.
 
-        :param module: path to playbook, can be absolute or relative
-        :param argument: dict with ansible extra vars (-e option)
-        :param host_pattern: host pattern argument for ansible command
-        :param extra_vars: dict with ansible extra vars (-e option)
-        :param extra_args: list of additional ansible-playbook options
-        :param inventory: a specific inventory for the playbook (optional)
         :param metadata_path: path to metadata file
-        :param timeout: seconds for step to timeout
-
-        :return: ansible-playbook exit code
         """
-        logger.info(f"MODULE START: {self.module}: {self.arguments}")
         ansible_extra_vars = {
             "twd": test_dir(),
-            "metadata": kwargs["metadata_path"],
+            "metadata": metadata_path,
         }
         ansible_extra_vars.update(self.extra_vars)
         key_path = os.path.join(test_dir(), config["private_key_path"])
 
         inventory_path = os.path.join(test_dir(), self.inventory)
 
-        cmd = [
-            ANSIBLE,
-            self.host_pattern,
-            "-b",
+        options = [
             '--ssh-extra-args="-o StrictHostKeyChecking=no"',
             '--ssh-extra-args="-o UserKnownHostsFile=/dev/null"',
             f"--private-key={key_path}",
             f"--inventory={inventory_path}",
         ]
-        add_extra_vars_option(cmd, ansible_extra_vars, 4)
+        add_extra_vars_option(options, ansible_extra_vars, 1)
+        return options
+
+    def build_command(self, metadata_path):
+        """Get ansible command running the module.
+
+        :param metadata_path: path to metadata file
+        """
+        cmd = [ANSIBLE, self.host_pattern, "-b"]
+        cmd.extend(self.ansible_options(metadata_path))
         cmd.extend(self.extra_args)
         cmd.extend(["-m", self.module])
         if self.arguments:
             cmd.extend(["-a", f"{self.arguments}"])
-        run_args = common_popen_args()
-        run_args["env"] = ansible_env()
-        cmd_str = " ".join(cmd)
-        logger.info(f"CMD: {cmd_str}")
+        return cmd
+
+    def batch_key(self):
+        """Get key of module steps which can run in one playbook.
+
+        Steps with `extra_args` are run alone as the args are meant for
+        ansible command. Batches can be disabled by `batch_modules: false`
+        in `ansible` mapping of metadata.
+        """
+        if not config["ansible"].get("batch_modules", True) or self.extra_args:
+            return None
+        return (
+            self.inventory,
+            self.host_pattern,
+            json.dumps(self.extra_vars, sort_keys=True),
+        )
+
+    @classmethod
+    def join_batch(cls, step_runners):
+        """Make module steps run as tasks of one playbook."""
+        batch = ModuleBatch(step_runners)
+        for step_runner in step_runners:
+            step_runner.batch = batch
+
+    def cache_key(self, **kwargs):
+        """Get digest of command and inventory content."""
+        cmd = self.build_command(kwargs["metadata_path"])
+        inventory_path = os.path.join(test_dir(), self.inventory)
+        return inputs_digest(json.dumps(cmd), read_input(inventory_path))
+
+    def run(self, timeout, **kwargs):
+        """Run single ansible module via ansible command.
+
+        :param module: path to playbook, can be absolute or relative
+        :param argument: dict with ansible extra vars (-e option)
+        :param host_pattern: host pattern argument for ansible command
+        :param extra_vars: dict with ansible extra vars (-e option)
+        :param extra_args: list of additional ansible-playbook options
+        :param inventory: a specific inventory for the playbook (optional)
+        :param metadata_path: path to metadata file
+        :param timeout: seconds for step to timeout
+
+        :return: ansible-playbook exit code
+        """
+        logger.info(f"MODULE START: {self.module}: {self.arguments}")
+        if self.batch is not None:
+            returncode = self.batch.run_step(self, timeout, kwargs["metadata_path"])
+        else:
+            cmd = self.build_command(kwargs["metadata_path"])
+            run_args = common_popen_args()
+            run_args["env"] = ansible_env()
+            cmd_str = " ".join(cmd)
+            logger.info(f"CMD: {cmd_str}")
 
-        returncode = run(cmd, run_args, timeout)
+            returncode = run_ansible(cmd, run_args, timeout)
 
         logger.info(f"RETURN CODE: {returncode}")
         logger.info(f"MODULE END: {self.module}")
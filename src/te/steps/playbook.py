@@ -1,14 +1,19 @@
 """Playbook step module."""
 
+import json
 import logging
 import os
 from tempfile import NamedTemporaryFile
 
-from te.common.ansible import add_extra_vars_option, ansible_env
+from te.common.ansible import add_extra_vars_option, ansible_env, events_stream_env
+from te.common.ansible_events import PlaybookTimings
+from te.common.ansible_worker import run_ansible
+from te.common.cache import inputs_digest, read_input
 from te.common.config import config
 from te.common.inventory import INVENTORY
 from te.common.paths import get_ci_data_dir, get_playbook_path, test_dir
-from te.common.process import common_popen_args, run
+from te.common.process import common_popen_args, quiet_output
+from te.common.report import current_usage
 from te.common.step import StepType
 
 logger = logging.getLogger(__name__)
@@ -17,6 +22,8 @@ logger = logging.getLogger(__name__)
 class PlaybookStep(StepType):
     """Step for executing Ansible playbook."""
 
+    keys = ("playbook",)
+
     def __init__(self, options):
         """Initialize playbook step."""
         self.playbook = options["playbook"]
@@ -28,6 +35,59 @@ class PlaybookStep(StepType):
         if isinstance(self.extra_args, str):
             self.extra_args = [self.extra_args]
 
+    @property
+    def dynamic(self):
+        """Playbook is not path but actually a playbook text."""
+        return len(self.playbook.splitlines()) > 1
+
+    def inventory_path(self):
+        """Get path of inventory used by the playbook."""
+        return os.path.join(test_dir(), self.inventory or INVENTORY)
+
+    def build_command(self, playbook_path, metadata_path):
+        """Get ansible-playbook command running the playbook.
+
+        :param playbook_path: path to playbook file
+        :param metadata_path: path to metadata file
+        """
+        ansible_extra_vars = {
+            "twd": test_dir(),
+            "metadata": metadata_path,
+            "ci_data_dir": get_ci_data_dir(),
+        }
+        ansible_extra_vars.update(self.extra_vars)
+
+        key_path = os.path.join(test_dir(), config["private_key_path"])
+
+        cmd = [
+            "ansible-playbook",
+            "--timeout=60",
+            '--ssh-extra-args="-o StrictHostKeyChecking=no"',
+            '--ssh-extra-args="-o UserKnownHostsFile=/dev/null"',
+            f"--private-key={key_path}",
+            f"--inventory={self.inventory_path()}",
+        ]
+        add_extra_vars_option(cmd, ansible_extra_vars, 4)
+
+        if self.extra_args:
+            cmd.extend(self.extra_args)
+
+        cmd.append(playbook_path)
+        return cmd
+
+    def cache_key(self, **kwargs):
+        """Get digest of playbook content, command and inventory content."""
+        if self.dynamic:
+            content = self.playbook
+            cmd = self.build_command("", kwargs["metadata_path"])
+        else:
+            playbook_path = get_playbook_path(self.playbook)
+            content = read_input(playbook_path)
+            cmd = self.build_command(playbook_path, kwargs["metadata_path"])
+        return inputs_digest(
+            json.dumps(cmd), content, read_input(self.inventory_path())
+        )
+
     def run(self, timeout, **kwargs):
         """Prepare and run ansible playbook.
 
@@ -40,19 +100,12 @@ class PlaybookStep(StepType):
 
         :return: ansible-playbook exit code
         """
-        dynamic_playbook = len(self.playbook.splitlines()) > 1
         name = self.playbook
-        if dynamic_playbook:
+        if self.dynamic:
             name = "Dynamic playbook"
         logger.info(f"PLAYBOOK START: {name}")
-        ansible_extra_vars = {
-            "twd": test_dir(),
-            "metadata": kwargs["metadata_path"],
-            "ci_data_dir": get_ci_data_dir(),
-        }
-        ansible_extra_vars.update(self.extra_vars)
 
-        if dynamic_playbook:
+        if self.dynamic:
             #  Playbook is not path but actually a playbook text which can be
             #  saved and used directly.
             with NamedTemporaryFile(mode="w+", delete=False) as temp_f:
@@ -62,33 +115,28 @@ class PlaybookStep(StepType):
         else:
             playbook_path = get_playbook_path(self.playbook)
 
-        key_path = os.path.join(test_dir(), config["private_key_path"])
-        if not self.inventory:
-            inventory = INVENTORY
-        inventory_path = os.path.join(test_dir(), inventory)
-
-        cmd = [
-            "ansible-playbook",
-            "--timeout=60",
-            '--ssh-extra-args="-o StrictHostKeyChecking=no"',
-            '--ssh-extra-args="-o UserKnownHostsFile=/dev/null"',
-            f"--private-key={key_path}",
-            f"--inventory={inventory_path}",
-        ]
-        add_extra_vars_option(cmd, ansible_extra_vars, 4)
-
-        if self.extra_args:
-            cmd.extend(self.extra_args)
-
-        cmd.append(playbook_path)
+        cmd = self.build_command(playbook_path, kwargs["metadata_path"])
 
         run_args = common_popen_args()
         run_args["env"] = ansible_env()
+        run_args["env"].update(events_stream_env(run_args["env"], run_args["cwd"]))
         logger.info(f"CMD: {' '.join(cmd)}")
 
-        returncode = run(cmd, run_args, timeout)
-        if dynamic_playbook:
+        condensed = config["ansible_output"] == "condensed"
+        timings = PlaybookTimings(condensed)
+        returncode = run_ansible(
+            cmd,
+            run_args,
+            timeout,
+            on_line=quiet_output if condensed else None,
+            on_event=timings.handle,
+        )
+        if self.dynamic:
             os.remove(playbook_path)
+        timings.log_summary()
+        usage = current_usage.get()
+        if usage is not None:
+            usage.tasks = timings.as_list()
 
         logger.info(f"RETURN CODE: {returncode}")
         logger.info(f"PLAYBOOK END: {name}")
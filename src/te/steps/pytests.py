@@ -11,6 +11,8 @@ logger = logging.getLogger(__name__)
 class PytestsStep(StepType):
     """Step for executing pytest tests."""
 
+    keys = ("pytests",)
+
     def __init__(self, options):
         """Initialize pytest step."""
         self.suite = options["pytests"]
@@ -13,6 +13,8 @@ logger = logging.getLogger(__name__)
 class RestraintStep(StepType):
     """Step for executing beakerlib tests via restraint."""
 
+    keys = ("restraint",)
+
     def __init__(self, options):
         """Initialize Restraint step."""
         self.restraint_file = options["restraint"]
@@ -0,0 +1,96 @@
+"""Benchmark of logging of command output.
+
+Compares writing command output lines directly by log handlers with the
+background writer used by te CLI.
+
+Run as `python tests/bench/bench_logging.py` from the project directory.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+LINES = 200000
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+def log_lines(mode):
+    """Log command output lines and print seconds it took to stderr.
+
+    Prints seconds until the logging thread is done and until all the lines
+    are written.
+    """
+    # pylint: disable=import-outside-toplevel
+    import logging
+
+    from te.common.log import (
+        BufferedFileHandler,
+        ColorHandler,
+        LogWriter,
+        PrefixFilter,
+        QueueHandler,
+    )
+    from te.common.process import command_output
+
+    root = logging.getLogger("")
+    root.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s %(prefix)s%(message)s")
+    writer = None
+    if mode == "direct":
+        file_handler = logging.FileHandler("runner.log")
+        file_handler.setFormatter(formatter)
+        for handler in (file_handler, ColorHandler()):
+            handler.addFilter(PrefixFilter())
+            root.addHandler(handler)
+    else:
+        file_handler = BufferedFileHandler("runner.log")
+        file_handler.setFormatter(formatter)
+        writer = LogWriter([file_handler, ColorHandler(buffered=True)])
+        writer.start()
+        handler = QueueHandler(writer)
+        handler.addFilter(PrefixFilter())
+        root.addHandler(handler)
+
+    start = time.perf_counter()
+    for number in range(LINES):
+        command_output(f"TASK [line {number}] ********************************")
+    logged = time.perf_counter() - start
+    if writer is not None:
+        writer.stop()
+    print(logged, time.perf_counter() - start, file=sys.stderr)
+
+
+def measure(mode):
+    """Get seconds it took to log and to write all lines in a fresh process."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.join(os.path.abspath(PROJECT_DIR), "src")
+    with tempfile.TemporaryDirectory() as twd:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), mode],
+            cwd=twd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+    logged, written = result.stderr.decode().splitlines()[-1].split()
+    return float(logged), float(written)
+
+
+def main():
+    """Print throughput of both logging paths."""
+    for mode in ("direct", "queue"):
+        logged, written = measure(mode)
+        print(
+            f"{mode}: logged in {logged:.2f} s, written in {written:.2f} s, "
+            f"{LINES / written:.0f} lines/s"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        log_lines(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,43 @@
+"""Benchmark of te CLI start up time.
+
+Run as `python tests/bench/bench_startup.py` from the project directory.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 20
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+def measure(args, cwd):
+    """Get the best wall time of te CLI call in seconds."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.join(os.path.abspath(PROJECT_DIR), "src")
+    cmd = [sys.executable, "-c", "from te import cli; cli.run()"] + args
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, check=False)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Print start up times of common CLI calls."""
+    with tempfile.TemporaryDirectory() as twd:
+        with open(os.path.join(twd, "metadata.yaml"), "w", encoding="utf-8") as f:
+            f.write("phases:\n  - name: test\n    steps:\n      - command: 'true'\n")
+        for name, args in [
+            ("help", ["--help"]),
+            ("dry run", ["metadata.yaml", "--dry-run"]),
+        ]:
+            print(f"{name}: {measure(args, twd) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
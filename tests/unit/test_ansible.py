@@ -0,0 +1,215 @@
+import json
+import os
+import sys
+
+import pytest
+
+from te.common import ansible
+from te.common.ansible import (
+    add_extra_vars_option,
+    ansible_env,
+    events_callback_env,
+    events_stream_env,
+    extra_vars_file,
+)
+from te.common.ansible_events import PlaybookTimings
+from te.common.ansible_worker import close_workers, run_ansible
+from te.common.config import config
+from te.common.inventory import INVENTORY
+from te.common.process import common_popen_args, output_capture, quiet_output
+
+
+def test_ansible_env(tmp_path, monkeypatch):
+    """Ansible profile is added, os env and metadata settings win."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ANSIBLE_PIPELINING", "False")
+    monkeypatch.setitem(
+        config, "ansible", {"forks": 20, "env": {"ANSIBLE_TIMEOUT": 30}}
+    )
+    env = ansible_env()
+    assert env["ANSIBLE_GATHERING"] == "smart"
+    assert env["ANSIBLE_CACHE_PLUGIN_CONNECTION"] == str(tmp_path / ".te/facts")
+    assert env["ANSIBLE_PIPELINING"] == "False"
+    assert env["ANSIBLE_FORKS"] == "20"
+    assert env["ANSIBLE_TIMEOUT"] == "30"
+    assert env["ANSIBLE_SSH_CONTROL_PATH"] == "%(directory)s/%%C"
+
+    assert "ANSIBLE_CACHE_PLUGIN_TIMEOUT" not in env
+
+    monkeypatch.setitem(config, "ansible", {"profile": False})
+    assert "ANSIBLE_GATHERING" not in ansible_env()
+
+
+@pytest.mark.parametrize("content", ["", "servers:\n  hosts:\n    server1:\n"])
+def test_forks_inventory(tmp_path, monkeypatch, content):
+    """Empty inventory or one without 'all' group doesn't break Ansible steps."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("ANSIBLE_FORKS", raising=False)
+    (tmp_path / "config").mkdir()
+    (tmp_path / INVENTORY).write_text(content)
+    monkeypatch.setitem(config, "ansible", {})
+    assert ansible_env()["ANSIBLE_FORKS"] == str(ansible.MIN_FORKS)
+
+    monkeypatch.setattr(ansible, "default_forks", None)
+    monkeypatch.setenv("ANSIBLE_FORKS", "7")
+    assert ansible_env()["ANSIBLE_FORKS"] == "7"
+    monkeypatch.setitem(config, "ansible", {"forks": 9})
+    assert ansible_env()["ANSIBLE_FORKS"] == "7"
+
+
+def test_facts_of_run(tmp_path, monkeypatch):
+    """Facts cached by a previous run are removed once per run."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ansible, "_facts_cleared", set())
+    (tmp_path / ".te/facts").mkdir(parents=True)
+    (tmp_path / ".te/facts/host1").write_text("{}")
+    monkeypatch.setitem(config, "ansible", {"fact_cache_timeout": 600})
+    assert ansible_env()["ANSIBLE_CACHE_PLUGIN_TIMEOUT"] == "600"
+    assert not (tmp_path / ".te/facts/host1").exists()
+
+    (tmp_path / ".te/facts/host1").write_text("{}")
+    ansible_env()
+    assert (tmp_path / ".te/facts/host1").exists()
+
+
+def fake_ansible_config(monkeypatch, path):
+    """Make ansible-config dump callback settings of ansible.cfg."""
+    program = path / "ansible-config"
+    program.write_text(
+        """#!/bin/sh
+echo "CALLBACKS_ENABLED($PWD/ansible.cfg) = ['timer']"
+echo "DEFAULT_CALLBACK_PLUGIN_PATH($PWD/ansible.cfg) = ['$PWD/callbacks']"
+echo "DEFAULT_FORKS(default) = 5"
+"""
+    )
+    program.chmod(0o755)
+    monkeypatch.setattr(ansible, "ANSIBLE_CONFIG_PROGRAM", str(program))
+    ansible._dump_config.cache_clear()
+
+
+def test_events_callback_env(tmp_path, monkeypatch):
+    """Callback plugin paths of Ansible configuration are kept."""
+    fake_ansible_config(monkeypatch, tmp_path)
+    paths = events_callback_env({}, str(tmp_path))["ANSIBLE_CALLBACK_PLUGINS"]
+    paths = paths.split(os.pathsep)
+    assert paths[0].endswith("ansible_plugins/callback")
+    assert paths[1:] == [str(tmp_path / "callbacks")]
+
+
+def test_events_stream_env(tmp_path, monkeypatch):
+    """Callbacks enabled in Ansible configuration stay enabled."""
+    fake_ansible_config(monkeypatch, tmp_path)
+    env = events_stream_env({}, str(tmp_path))
+    assert env["ANSIBLE_CALLBACKS_ENABLED"] == "timer,te_events"
+    assert env["ANSIBLE_CALLBACK_PLUGINS"].endswith(str(tmp_path / "callbacks"))
+
+
+EVENTS = """{"event":"task_start","name":"install","time":1.0}
+{"event":"result","host":"h1","status":"ok","duration":0.5}
+{"event":"result","host":"h2","status":"failed","duration":1.5,"output":"h2 | FAILED"}
+{"event":"stats","time":3.0}
+"""
+
+
+def fake_ansible(path):
+    """Create fake Ansible package printing how it was run."""
+    for package in ("cli", "executor", "plugins", "plugins/connection"):
+        (path / "ansible" / package).mkdir(parents=True)
+        (path / "ansible" / package / "__init__.py").write_text("")
+    (path / "ansible/__init__.py").write_text("")
+    for module in ("executor/playbook_executor.py", "plugins/connection/ssh.py"):
+        (path / "ansible" / module).write_text("")
+    for module, name, rc in (("playbook", "PlaybookCLI", 3), ("adhoc", "AdHocCLI", 0)):
+        (path / f"ansible/cli/{module}.py").write_text(
+            f"""import os, sys
+class {name}:
+    @classmethod
+    def cli_executor(cls, args):
+        print(" ".join(args), os.getppid())
+        if os.environ.get("TE_EVENTS_FD"):
+            with os.fdopen(int(os.environ["TE_EVENTS_FD"]), "w") as events:
+                events.write(EVENTS)
+        sys.exit({rc})
+"""
+            + f"EVENTS = {EVENTS!r}\n"
+        )
+
+
+def fake_program(path):
+    """Create fake ansible-playbook command running fake Ansible."""
+    program = path / "ansible-playbook"
+    program.write_text(
+        f"""#!{sys.executable}
+import sys
+from ansible.cli.playbook import PlaybookCLI
+PlaybookCLI.cli_executor(sys.argv)
+"""
+    )
+    program.chmod(0o755)
+
+
+def test_ansible_worker(tmp_path, monkeypatch):
+    """Commands run in children of one resident worker."""
+    monkeypatch.chdir(tmp_path)
+    fake_ansible(tmp_path)
+    fake_program(tmp_path)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setitem(config, "ansible_executor", "worker")
+    run_args = common_popen_args()
+    run_args["env"] = dict(os.environ, PYTHONPATH=str(tmp_path))
+
+    output = []
+    token = output_capture.set(output)
+    try:
+        assert run_ansible(["ansible-playbook", "a.yaml"], run_args) == 3
+        events = []
+        cmd = ["ansible-playbook", "b.yaml"]
+        assert run_ansible(cmd, run_args, on_event=events.append) == 3
+        assert len(events) == 4
+    finally:
+        output_capture.reset(token)
+        close_workers()
+    assert [line.rsplit(" ", 1)[0] for line in output] == [
+        "ansible-playbook a.yaml",
+        "ansible-playbook b.yaml",
+    ]
+    workers = {line.rsplit(" ", 1)[1] for line in output}
+    assert len(workers) == 1
+    assert workers != {str(os.getpid())}
+
+
+def test_extra_vars_file(tmp_path, monkeypatch):
+    """Extra vars are passed in a file shared by commands with same vars."""
+    monkeypatch.chdir(tmp_path)
+    cmd = ["ansible-playbook", "site.yaml"]
+    add_extra_vars_option(cmd, {"b": 2, "a": 1}, 1)
+    assert cmd[1] == "-e"
+    path = cmd[2][1:]
+    assert cmd[2].startswith(f"@{tmp_path}/.te/vars/")
+    assert json.loads(open(path, encoding="utf-8").read()) == {"a": 1, "b": 2}
+
+    assert extra_vars_file({"a": 1, "b": 2}) == path
+    assert extra_vars_file({"a": 2}) != path
+
+
+def test_playbook_events(tmp_path, monkeypatch):
+    """Timings of tasks and condensed output are built from events."""
+    monkeypatch.chdir(tmp_path)
+    fake_ansible(tmp_path)
+    fake_program(tmp_path)
+    run_args = common_popen_args()
+    run_args["env"] = dict(os.environ, PYTHONPATH=str(tmp_path))
+    timings = PlaybookTimings(condensed=True)
+
+    output = []
+    token = output_capture.set(output)
+    try:
+        cmd = [str(tmp_path / "ansible-playbook"), "site.yaml"]
+        rc = run_ansible(cmd, run_args, on_line=quiet_output, on_event=timings.handle)
+    finally:
+        output_capture.reset(token)
+    assert rc == 3
+    assert "h2 | FAILED" in output
+    assert "TASK [install] 2.00s ok=1 failed=1" in output
+    assert timings.slowest_hosts() == [(1.5, "h2"), (0.5, "h1")]
+    assert timings.as_list()[0]["hosts"]["h2"] == {"status": "failed", "duration": 1.5}
@@ -0,0 +1,75 @@
+import os
+
+from te.common import runner
+from te.common.cache import ResultCache, clear_caches
+from te.common.process import command_output
+from te.steps.playbook import PlaybookStep
+
+
+class EchoStep:
+    """Step type printing its output, cached by its text."""
+
+    def __init__(self, text):
+        self.text = text
+        self.runs = 0
+
+    def cache_key(self, **kwargs):
+        return f"echo-{self.text}"
+
+    def run(self, timeout, **kwargs):
+        self.runs += 1
+        command_output(self.text)
+        return 0
+
+
+def test_cached_step_replay(tmp_path, monkeypatch):
+    """Output of cached step is replayed instead of running it again."""
+    monkeypatch.chdir(tmp_path)
+    step_runner = EchoStep("hello")
+    replayed = []
+    monkeypatch.setattr(runner, "replay_output", replayed.append)
+
+    for _ in range(2):
+        rc = runner.run_cached_step({"cache": True}, "m.yaml", 60, step_runner)
+        assert rc == 0
+    assert step_runner.runs == 1
+    assert replayed == ["hello"]
+
+    clear_caches(["results"])
+    runner.run_cached_step({"cache": True}, "m.yaml", 60, step_runner)
+    assert step_runner.runs == 2
+
+
+def test_result_cache_eviction(tmp_path, monkeypatch):
+    """Least recently used results are evicted over the size limit."""
+    monkeypatch.chdir(tmp_path)
+    cache = ResultCache(max_bytes=100)
+    cache.put("old", ["x" * 40])
+    os.utime(tmp_path / ".te/results/old.result", (0, 0))
+    cache.put("new", ["y" * 40])
+    assert cache.get("old") is None
+    assert cache.get("new") == ["y" * 40]
+
+
+def test_playbook_cache_key(tmp_path, monkeypatch):
+    """Cache key of playbook step changes with its inputs."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("te.steps.playbook.get_ci_data_dir", lambda: "/ci")
+    playbook = tmp_path / "play.yaml"
+    playbook.write_text("- hosts: all\n")
+    step = PlaybookStep({"playbook": str(playbook)})
+
+    key = step.cache_key(metadata_path="m.yaml")
+    assert key == step.cache_key(metadata_path="m.yaml")
+
+    (tmp_path / "config").mkdir()
+    (tmp_path / "config/test.inventory.yaml").write_text("all: {}\n")
+    assert step.cache_key(metadata_path="m.yaml") != key
+    key = step.cache_key(metadata_path="m.yaml")
+
+    playbook.write_text("- hosts: server\n")
+    assert step.cache_key(metadata_path="m.yaml") != key
+    key = step.cache_key(metadata_path="m.yaml")
+
+    step = PlaybookStep({"playbook": str(playbook), "extra_vars": {"a": 1}})
+    assert step.cache_key(metadata_path="m.yaml") != key
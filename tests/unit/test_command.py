@@ -0,0 +1,29 @@
+import logging
+
+import pytest
+
+from te.common.process import common_popen_args, run
+from te.steps.command import STREAMED_SCRIPT, aggregate_returncode
+
+
+def test_streamed_script(caplog, tmp_path):
+    """Script passed over stdin is run and removed."""
+    caplog.set_level(logging.DEBUG, logger="te.common.process")
+    script = f"echo $0 > {tmp_path}/path\necho streamed\nexit 4\n"
+    rc = run(["sh", "-c", STREAMED_SCRIPT], common_popen_args(), 10, script.encode())
+    assert rc == 4
+    assert caplog.messages == ["streamed"]
+    script_path = (tmp_path / "path").read_text().strip()
+    assert not (tmp_path / script_path).exists()
+
+
+def test_aggregate_returncode():
+    """Return code of multi-host command follows the policy."""
+    assert aggregate_returncode([0, 0, 0]) == 0
+    assert aggregate_returncode([0, 3, 2]) == 3
+    assert aggregate_returncode([0, 3, 2], "any") == 0
+    assert aggregate_returncode([3, 3], "any") == 3
+    assert aggregate_returncode([0, 0, 1, 1], 2) == 0
+    assert aggregate_returncode([0, 0, 1, 1], "75%") == 1
+    with pytest.raises(RuntimeError):
+        aggregate_returncode([0], "most")
@@ -0,0 +1,82 @@
+import subprocess
+
+from te.common import extensions
+
+
+class Result:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+
+def fake_pip(monkeypatch, failing=()):
+    """Record pip calls, fail installation of `failing` specs without --user.
+
+    Other specs of a failed call are installed.
+    """
+    calls = []
+    installed = set()
+
+    def run(cmd, check):
+        calls.append(cmd)
+        if cmd[1] != "install":
+            return Result(0)
+        specs = [arg for arg in cmd[2:] if arg.startswith("te-")]
+        if "--user" not in cmd:
+            installed.update(set(specs) - set(failing))
+            if set(failing) & set(specs):
+                return Result(1)
+        installed.update(specs)
+        return Result(0)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(
+        extensions, "is_satisfied", lambda spec: spec in installed or "pytest" in spec
+    )
+    monkeypatch.setattr(extensions, "iter_extensions", lambda: iter([]))
+    return calls
+
+
+def test_install_cached(tmp_path, monkeypatch):
+    """Installed extensions are skipped, others installed from wheel cache."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    calls = fake_pip(monkeypatch)
+    specs = [
+        {"package": "pytest>=1.0"},
+        {"package": "te-foo==1.0"},
+        {"package": "te-bar==2.0"},
+    ]
+
+    assert extensions.install_extensions(specs) == 0
+    assert [cmd[:2] for cmd in calls] == [["pip3", "wheel"], ["pip3", "install"]]
+    assert calls[0][-2:] == ["te-foo==1.0", "te-bar==2.0"]
+    assert "--no-index" in calls[1]
+
+    calls.clear()
+    monkeypatch.setattr(extensions, "is_satisfied", lambda spec: "pytest" in spec)
+    assert extensions.install_extensions(specs) == 0
+    assert len(calls) == 1
+    assert "--no-index" in calls[0]
+
+
+def test_install_unpinned(tmp_path, monkeypatch):
+    """Unpinned extensions are not cached, new versions are installed."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    calls = fake_pip(monkeypatch)
+    specs = [{"package": "te-foo==1.0"}, {"package": "te-bar>=2.0"}]
+
+    assert extensions.install_extensions(specs) == 0
+    assert calls[0][-1] == "te-foo==1.0"
+    assert "--no-index" not in calls[1]
+    assert calls[1][-2:] == ["te-foo==1.0", "te-bar>=2.0"]
+
+
+def test_install_retry_failed(tmp_path, monkeypatch):
+    """Only failed extensions are retried in user environment."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    calls = fake_pip(monkeypatch, failing=["te-foo"])
+    specs = [{"package": "te-foo"}, {"package": "te-bar"}]
+
+    assert extensions.install_extensions(specs) == 0
+    installs = [cmd for cmd in calls if cmd[1] == "install"]
+    assert [cmd[-1] for cmd in installs] == ["te-bar", "te-foo", "te-foo"]
+    assert "--user" in installs[-1]
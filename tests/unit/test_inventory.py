@@ -0,0 +1,84 @@
+import copy
+
+import pytest
+
+from te.common.inventory import INVENTORY, resolve_hosts, to_external_hostname
+from te.common.yml import save_yaml
+
+INVENTORY_DATA = {
+    "all": {
+        "hosts": {"controller": {"ansible_host": "10.0.0.1"}},
+        "children": {
+            "servers": {
+                "hosts": {"server1": {"ansible_host": "10.0.1.1"}},
+                "children": {
+                    "replicas": {
+                        "hosts": {
+                            "replica1": {"ansible_host": "10.0.2.1"},
+                            "replica2": {"ansible_host": "10.0.2.2"},
+                        }
+                    }
+                },
+            },
+            "clients": {"hosts": {"client1": {"ansible_host": "10.0.3.1"}}},
+        },
+    }
+}
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    """Working directory with test inventory."""
+    (tmp_path / "config").mkdir()
+    save_yaml(str(tmp_path / INVENTORY), INVENTORY_DATA)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / INVENTORY
+
+
+def test_resolve_hosts(inventory):
+    """Hosts are resolved from names, groups and patterns."""
+    assert resolve_hosts("client1") == ["client1"]
+    assert resolve_hosts("servers") == ["server1", "replica1", "replica2"]
+    assert resolve_hosts(["replica*", "client1", "replica1"]) == [
+        "replica1",
+        "replica2",
+        "client1",
+    ]
+    assert len(resolve_hosts("all")) == 5
+
+
+def test_inventory_without_all(inventory):
+    """Top-level groups of inventory without 'all' are its children."""
+    inventory.write_text(
+        "servers:\n  hosts:\n    server1:\n      ansible_host: 10.0.1.1\n"
+    )
+    assert resolve_hosts("all") == ["server1"]
+    assert resolve_hosts("servers") == ["server1"]
+    assert to_external_hostname("server1") == "10.0.1.1"
+
+
+def test_resolve_no_hosts(inventory):
+    """Pattern matching no host is an error, not an empty run."""
+    with pytest.raises(RuntimeError):
+        resolve_hosts("web*")
+    with pytest.raises(RuntimeError):
+        resolve_hosts([])
+
+
+def test_to_external_hostname(inventory):
+    """Hostname is found in all group or in children groups."""
+    assert to_external_hostname("controller") == "10.0.0.1"
+    assert to_external_hostname("client1") == "10.0.3.1"
+
+
+def test_nested_and_reload(inventory):
+    """Hosts of nested groups are found and changes are reloaded."""
+    assert to_external_hostname("replica2") == "10.0.2.2"
+
+    data = copy.deepcopy(INVENTORY_DATA)
+    data["all"]["children"]["clients"]["hosts"]["client2"] = {
+        "ansible_host": "10.0.3.2"
+    }
+    save_yaml(str(inventory), data)
+    assert to_external_hostname("client2") == "10.0.3.2"
+    assert resolve_hosts("clients") == ["client1", "client2"]
@@ -0,0 +1,72 @@
+import logging
+import threading
+
+from te.common.log import (
+    BufferedFileHandler,
+    LogWriter,
+    PrefixFilter,
+    QueueHandler,
+    prefixed,
+)
+
+
+class ListHandler(logging.Handler):
+    """Handler collecting messages and counting flushes."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.flushes = 0
+
+    def emit(self, record):
+        self.messages.append(f"{record.prefix}{record.getMessage()}")
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_log_writer():
+    """Records are written in order, with prefix of the logging context."""
+    handler = ListHandler()
+    writer = LogWriter([handler], flush_interval=10)
+    writer.start()
+    test_logger = logging.getLogger("te.test.writer")
+    test_logger.propagate = False
+    test_logger.setLevel(logging.DEBUG)
+    queue_handler = QueueHandler(writer)
+    queue_handler.addFilter(PrefixFilter())
+    test_logger.addHandler(queue_handler)
+
+    def log_step():
+        with prefixed("step"):
+            test_logger.info("in step")
+
+    try:
+        for number in range(1000):
+            test_logger.debug(f"line {number}")
+        thread = threading.Thread(target=log_step)
+        thread.start()
+        thread.join()
+        writer.stop()
+        # flushed only at stop thanks to long flush interval
+        assert handler.flushes == 1
+        assert handler.messages[:1000] == [f"line {n}" for n in range(1000)]
+        assert handler.messages[1000] == "[step] in step"
+
+        test_logger.info("after stop")
+        assert handler.messages[-1] == "after stop"
+    finally:
+        test_logger.removeHandler(queue_handler)
+
+
+def test_held_file_handler(tmp_path):
+    """Held handler writes records to the file only when asked to."""
+    path = tmp_path / "runner.log"
+    handler = BufferedFileHandler(str(path), hold=True)
+    handler.handle(logging.makeLogRecord({"msg": "first"}))
+    assert not path.exists()
+
+    handler.write_held()
+    handler.handle(logging.makeLogRecord({"msg": "second"}))
+    handler.close()
+    assert path.read_text() == "first\nsecond\n"
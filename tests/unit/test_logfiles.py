@@ -0,0 +1,53 @@
+import gzip
+import io
+import logging
+
+from te.common.log import BufferedFileHandler
+from te.common.logfiles import copy_log, find_step_logs, rotate, run_logs
+
+
+def test_rotate(tmp_path):
+    """Logs of previous runs are numbered, the oldest ones removed."""
+    log = str(tmp_path / "runner.log")
+    for run in range(4):
+        opener = gzip.open if run % 2 else open
+        with opener(log + (".gz" if run % 2 else ""), "wb") as f:
+            f.write(f"run {run}\n".encode())
+        rotate(log, keep=2)
+
+    assert [path for _, path in run_logs(log)] == [f"{log}.1.gz", f"{log}.2"]
+    assert gzip.open(f"{log}.1.gz").read() == b"run 3\n"
+
+
+def test_rotate_max_bytes(tmp_path):
+    """The oldest logs are removed over the size limit."""
+    logs = tmp_path / "logs"
+    for run in range(3):
+        (logs / "phase").mkdir(parents=True)
+        (logs / "phase/step.log").write_bytes(b"x" * 100)
+        rotate(str(logs), keep=5, max_bytes=250)
+    assert [number for number, _ in run_logs(str(logs))] == [1, 2]
+
+
+def test_compressed_logs(tmp_path):
+    """Compressed logs are written by streams and read decompressed."""
+    handler = BufferedFileHandler(str(tmp_path / "runner.log"), "gzip")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    record = logging.LogRecord("te", logging.INFO, __file__, 0, "hello", None, None)
+    handler.emit(record)
+    handler.close()
+    output = io.BytesIO()
+    copy_log(str(tmp_path / "runner.log.gz"), output)
+    assert output.getvalue() == b"hello\n"
+
+
+def test_find_step_logs(tmp_path):
+    """Step outputs are filtered by phase and step patterns."""
+    for name in ("prep/server.log", "prep/client.log.gz", "test/all.h1.log"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+
+    found = find_step_logs(str(tmp_path), phase="prep")
+    assert [step for _, step, _ in found] == ["client", "server"]
+    found = find_step_logs(str(tmp_path), step="all")
+    assert [(phase, step) for phase, step, _ in found] == [("test", "all.h1")]
@@ -0,0 +1,134 @@
+import pytest
+import requests
+
+from te.common import metadata, yml
+from te.common.metadata import (
+    get_metadata_path,
+    get_phases_needed,
+    get_phases_upto,
+    read_metadata,
+)
+from te.common.yml import save_yaml
+
+METADATA = {
+    "phases": [
+        {"name": "init"},
+        {"name": "prep"},
+        {"name": "lint", "needs": ["init"]},
+        {"name": "test", "needs": ["prep"]},
+    ]
+}
+
+
+def names(phases):
+    return [phase["name"] for phase in phases]
+
+
+def test_upto_linear():
+    """Phases without needs are selected as a prefix."""
+    assert names(get_phases_upto(METADATA, "prep")) == ["init", "prep"]
+
+
+def test_upto_needs():
+    """Only phases the selected phase depends on are selected."""
+    assert names(get_phases_upto(METADATA, "lint")) == ["init", "lint"]
+    assert names(get_phases_upto(METADATA, "test")) == ["init", "prep", "test"]
+
+
+def test_phase_explicit_needs():
+    """Implicit dependencies are not followed for a single phase."""
+    assert names(get_phases_needed(METADATA, "prep", implicit=False)) == ["prep"]
+    assert names(get_phases_needed(METADATA, "test", implicit=False)) == [
+        "prep",
+        "test",
+    ]
+    assert get_phases_needed(METADATA, "missing") == []
+
+
+def test_read_metadata_cache(tmp_path, monkeypatch):
+    """Parsed metadata are cached by content and reused."""
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "metadata.yaml"
+    save_yaml(str(path), METADATA)
+
+    assert read_metadata(str(path)) == METADATA
+    cached = list((tmp_path / ".te" / "metadata").glob("*.json"))
+    assert len(cached) == 1
+
+    parse_yaml = yml.parse_yaml
+    monkeypatch.setattr(yml, "parse_yaml", None)
+    assert read_metadata(str(path)) == METADATA
+
+    # broken entry is a cache miss
+    cached[0].write_bytes(b"\x80\x04garbage")
+    monkeypatch.setattr(yml, "parse_yaml", parse_yaml)
+    assert read_metadata(str(path)) == METADATA
+
+    # another te version doesn't use the entry
+    monkeypatch.setattr(metadata, "VERSION", "0.0.0")
+    monkeypatch.setattr(yml, "parse_yaml", None)
+    with pytest.raises(TypeError):
+        read_metadata(str(path))
+
+
+def test_read_metadata_invalid(tmp_path, monkeypatch):
+    """Invalid metadata stop the program."""
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "metadata.yaml"
+    path.write_text("phases:\n  - name: init\n    steps: echo\n")
+    with pytest.raises(SystemExit):
+        read_metadata(str(path))
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+
+def test_download_metadata_cache(tmp_path, monkeypatch):
+    """Downloaded metadata are revalidated and used offline."""
+    monkeypatch.chdir(tmp_path)
+    url = "https://example.com/metadata.yaml"
+    requests_headers = []
+    responses = [
+        FakeResponse(200, b"phases: []\n", {"ETag": '"v1"'}),
+        FakeResponse(304),
+        requests.ConnectionError("offline"),
+        FakeResponse(503),
+        FakeResponse(404),
+    ]
+
+    def fake_get(get_url, headers, timeout):
+        requests_headers.append(headers)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    path = get_metadata_path(url)
+    assert open(path, "rb").read() == b"phases: []\n"
+    assert get_metadata_path(url) == path
+    assert requests_headers[1] == {"If-None-Match": '"v1"'}
+    assert get_metadata_path(url) == path
+    assert get_metadata_path(url) == path
+    # cached copy doesn't hide errors of the request
+    with pytest.raises(SystemExit):
+        get_metadata_path(url)
+
+
+def test_download_metadata_over_limit(tmp_path, monkeypatch):
+    """File over the cache size limit is still used."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(metadata, "DOWNLOAD_CACHE_SIZE", 4)
+    monkeypatch.setattr(
+        requests, "get", lambda *args, **kwargs: FakeResponse(200, b"phases: []\n")
+    )
+    path = get_metadata_path("https://example.com/metadata.yaml")
+    assert open(path, "rb").read() == b"phases: []\n"
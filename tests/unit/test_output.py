@@ -0,0 +1,64 @@
+import logging
+import threading
+
+from te.common import output as output_module
+from te.common.config import config
+from te.common.output import (
+    StepOutput,
+    capture_output,
+    child_output,
+    log_failure_summary,
+)
+from te.common.process import common_popen_args, run
+
+
+def test_step_output(tmp_path, monkeypatch):
+    """Raw output is written to file, only its tail is kept in memory."""
+    monkeypatch.setitem(config, "output_tail_lines", 3)
+    output = StepOutput(str(tmp_path / "logs/step.log"))
+    args = common_popen_args()
+    args["shell"] = True
+    with capture_output(output):
+        run("seq 1 1000; printf 'bad \\377 byte'", args)
+        with child_output("host1"):
+            run("echo from host", args)
+
+    raw = (tmp_path / "logs/step.log").read_bytes()
+    assert raw.startswith(b"1\n2\n")
+    assert raw.endswith(b"1000\nbad \xff byte")
+    assert (tmp_path / "logs/step.host1.log").read_bytes() == b"from host\n"
+    assert list(output.tail) == ["1000", "bad � byte", "[host1] from host"]
+    assert output.paths() == [
+        str(tmp_path / "logs/step.log"),
+        str(tmp_path / "logs/step.host1.log"),
+    ]
+
+
+def test_step_output_writer(tmp_path, monkeypatch):
+    """Output files are opened and written by the writer thread."""
+    threads = []
+    open_log = output_module.open_log
+
+    def recording_open_log(*args):
+        threads.append(threading.current_thread().name)
+        return open_log(*args)
+
+    monkeypatch.setattr(output_module, "open_log", recording_open_log)
+    output = StepOutput(str(tmp_path / "step.log"))
+    output.write(b"first\n")
+    output.write(b"second\n")
+    output.close()
+
+    assert threads == ["te-output-writer"]
+    assert (tmp_path / "step.log").read_bytes() == b"first\nsecond\n"
+
+
+def test_failure_summary(tmp_path, caplog):
+    """Summary lists failed steps with their output files and tails."""
+    output = StepOutput(str(tmp_path / "step.log"))
+    output.add_line("error: something broke")
+    log_failure_summary([("test", "build", 2, output)])
+    assert caplog.record_tuples[-2:] == [
+        ("te.common.output", logging.ERROR, "Step build of phase test failed with 2"),
+        ("te.common.output", logging.ERROR, "  error: something broke"),
+    ]
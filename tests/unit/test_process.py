@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import resource
+import sys
+import time
+
+import pytest
+
+from te.common.exceptions import TimeoutException
+from te.common.process import common_popen_args, engine, run, run_async
+from te.common.report import Usage, current_usage
+
+
+def test_run_output(caplog):
+    """Output is logged line by line, including incomplete last line."""
+    caplog.set_level(logging.DEBUG, logger="te.common.process")
+    args = common_popen_args()
+    args["shell"] = True
+    assert run("printf 'one\\ntwo\\nthree'; exit 3", args) == 3
+    assert caplog.messages == ["one", "two", "three"]
+
+
+def test_run_timeout():
+    """Process group is killed on timeout."""
+    start = time.monotonic()
+    with pytest.raises(TimeoutException):
+        run(["sleep", "10"], common_popen_args(), 0.2)
+    assert time.monotonic() - start < 5
+
+
+def test_run_concurrent():
+    """Many processes are supervised by single engine loop."""
+
+    async def run_many():
+        return await asyncio.gather(
+            *[run_async(["sleep", "0.3"], common_popen_args()) for _ in range(50)]
+        )
+
+    start = time.monotonic()
+    assert engine.submit(run_many()).result() == [0] * 50
+    assert time.monotonic() - start < 5
+
+
+def test_run_usage():
+    """Usage of processes is added to the current usage and its parents."""
+    phase = Usage()
+    step = Usage(parent=phase)
+    token = current_usage.set(step)
+    try:
+        args = common_popen_args()
+        args["shell"] = True
+        run("printf 'hello\\n'", args)
+        run("true", args)
+    finally:
+        current_usage.reset(token)
+    for usage in (step, phase):
+        assert usage.processes == 2
+        assert usage.output_bytes == 6
+        # peak RSS of small processes is the one inherited from te
+        assert usage.max_rss_kb is None
+
+
+def test_run_usage_rss():
+    """Peak RSS of process over the one it inherited is measured."""
+    step = Usage()
+    token = current_usage.set(step)
+    try:
+        size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 * 2
+        run([sys.executable, "-c", f"data = b'x' * {size}"], common_popen_args())
+    finally:
+        current_usage.reset(token)
+    assert step.max_rss_kb > size // 1024
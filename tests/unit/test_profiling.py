@@ -0,0 +1,77 @@
+import os
+import pstats
+import subprocess
+import sys
+import threading
+import time
+
+import te
+from te.common import profiling
+from te.common.profiling import Profiler, counted
+
+
+@counted("test.work")
+def work():
+    return 42
+
+
+def test_counters(monkeypatch):
+    """Calls are counted only when counters are enabled."""
+    monkeypatch.setattr(profiling, "counters", profiling.counters.copy())
+    assert work() == 42
+    assert "test.work" not in profiling.counters
+
+    monkeypatch.setattr(profiling, "_counters_enabled", True)
+    work()
+    work()
+    assert profiling.counters["test.work"][0] == 2
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def run_profiled(path):
+    profiler = Profiler(str(path))
+    profiler.start()
+    thread = threading.Thread(target=busy, args=(0.1,))
+    thread.start()
+    thread.join()
+    profiler.stop()
+
+
+def test_profiler_pstats(tmp_path):
+    """Profile of cProfile includes threads started during profiling."""
+    run_profiled(tmp_path / "te.pstats")
+    stats = pstats.Stats(str(tmp_path / "te.pstats")).stats
+    assert any(function == "busy" for _, _, function in stats)
+
+
+def test_profiler_collapsed(tmp_path):
+    """Sampled stacks are written in collapsed format."""
+    run_profiled(tmp_path / "te.folded")
+    lines = (tmp_path / "te.folded").read_text().splitlines()
+    assert any(";busy (" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profile_phase(tmp_path):
+    """Phase run under --profile finishes and its commands are profiled."""
+    (tmp_path / "metadata.yaml").write_text(
+        "phases:\n  - name: test\n    steps:\n      - command: echo test\n"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(te.__file__))
+    subprocess.run(
+        [sys.executable, "-c", "from te import cli; cli.run()"]
+        + ["metadata.yaml", "--profile", "te.pstats"],
+        cwd=tmp_path,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        check=True,
+        timeout=60,
+    )
+    stats = pstats.Stats(str(tmp_path / "te.pstats")).stats
+    assert any(function == "_supervise" for _, _, function in stats)
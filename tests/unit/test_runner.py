@@ -0,0 +1,277 @@
+import json
+import threading
+import time
+from xml.etree import ElementTree
+
+import pytest
+
+from te.common import runner
+from te.common.journal import Journal
+from te.common.report import RunReport
+from te.steps import module, register_steps
+
+
+def fake_steps(monkeypatch, rcs=None):
+    """Replace step execution with a recording stub."""
+    rcs = rcs or {}
+    state = {"running": 0, "max": 0, "order": []}
+    lock = threading.Lock()
+
+    def run_step(step, metadata_path, timeout, step_runner=None):
+        with lock:
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+            state["order"].append(step["name"])
+        time.sleep(0.05)
+        with lock:
+            state["running"] -= 1
+        return rcs.get(step["name"], 0)
+
+    monkeypatch.setattr(runner, "run_step", run_step)
+    monkeypatch.setattr(runner, "resolve_step", lambda step: None)
+    return state
+
+
+def test_parallel_block(monkeypatch):
+    """Steps of a parallel block run concurrently."""
+    state = fake_steps(monkeypatch)
+    phases = [
+        {
+            "name": "prep",
+            "steps": [
+                {"name": "first"},
+                {"parallel": [{"name": f"host{i}"} for i in range(4)]},
+                {"name": "last"},
+            ],
+        }
+    ]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 0
+    assert state["max"] == 4
+    assert state["order"][0] == "first"
+    assert state["order"][-1] == "last"
+
+
+def test_parallel_max_parallel(monkeypatch):
+    """Phase `max_parallel` limits concurrency of parallel blocks."""
+    state = fake_steps(monkeypatch)
+    phases = [
+        {
+            "name": "prep",
+            "max_parallel": 2,
+            "steps": [{"parallel": [{"name": f"host{i}"} for i in range(4)]}],
+        }
+    ]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 0
+    assert state["max"] == 2
+
+
+def test_parallel_stop_on_error(monkeypatch):
+    """Failing step in a parallel block stops the execution."""
+    state = fake_steps(monkeypatch, rcs={"host0": 3})
+    phases = [
+        {
+            "name": "prep",
+            "steps": [
+                {"parallel": [{"name": "host0"}, {"name": "host1"}]},
+                {"name": "last"},
+            ],
+        }
+    ]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 3
+    assert "last" not in state["order"]
+
+
+def test_step_needs(monkeypatch):
+    """Failure cancels only steps depending on the failed step."""
+    state = fake_steps(monkeypatch, rcs={"build": 1})
+    phases = [
+        {
+            "name": "prep",
+            "steps": [
+                {"name": "build", "needs": []},
+                {"name": "install", "needs": ["build"]},
+                {"name": "lint", "needs": []},
+            ],
+        }
+    ]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 1
+    assert sorted(state["order"]) == ["build", "lint"]
+
+
+def test_phase_needs(monkeypatch):
+    """Independent phases run concurrently, dependent ones after them."""
+    state = fake_steps(monkeypatch)
+    phases = [
+        {"name": "server", "steps": [{"name": "server"}]},
+        {"name": "client", "needs": [], "steps": [{"name": "client"}]},
+        {"name": "test", "needs": ["server", "client"], "steps": [{"name": "test"}]},
+    ]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 0
+    assert state["max"] == 2
+    assert state["order"][-1] == "test"
+
+
+def test_unnamed_phases(monkeypatch, tmp_path):
+    """Unnamed and repeated phases run in order with their own results."""
+    monkeypatch.chdir(tmp_path)
+    state = fake_steps(monkeypatch)
+    phases = [
+        {"steps": [{"name": "first"}]},
+        {"steps": [{"name": "second"}]},
+        {"name": "test", "steps": [{"name": "third"}]},
+        {"name": "test", "steps": [{"name": "fourth"}]},
+        {"name": "report", "needs": ["test"], "steps": [{"name": "last"}]},
+    ]
+    report = RunReport()
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60, report=report) == 0
+    assert state["max"] == 1
+    assert state["order"] == ["first", "second", "third", "fourth", "last"]
+    data = report.as_dict(0)
+    assert [phase["name"] for phase in data["phases"]] == [
+        "phase-1",
+        "phase-2",
+        "test",
+        "test-2",
+        "report",
+    ]
+    assert [len(phase["steps"]) for phase in data["phases"]] == [1, 1, 1, 1, 1]
+
+
+def test_repeated_step_names(monkeypatch, tmp_path):
+    """Steps with the same name have their own logs and results."""
+    monkeypatch.chdir(tmp_path)
+    state = fake_steps(monkeypatch, rcs={"check": 0})
+    phases = [
+        {
+            "name": "test",
+            "steps": [{"name": "check"}, {"name": "check"}, {"name": "check-2"}],
+        }
+    ]
+    report = RunReport()
+    path = str(tmp_path / "journal.jsonl")
+    rc = runner.run_phases(phases, {}, "metadata.yaml", 60, Journal(path), report)
+    assert rc == 0
+    assert len(state["order"]) == 3
+    steps = report.as_dict(0)["phases"][0]["steps"]
+    assert [step["name"] for step in steps] == ["check", "check-2", "check-2-2"]
+    journal = [json.loads(line) for line in open(path, encoding="utf-8")]
+    assert [entry["step"] for entry in journal] == ["check", "check-2", "check-2-2"]
+
+
+def test_dependency_cycle():
+    """Cycles in dependencies are refused."""
+    scheduler = runner.DagScheduler(2)
+    scheduler.add("a", lambda: 0, ["b"])
+    scheduler.add("b", lambda: 0, ["a"])
+    with pytest.raises(RuntimeError):
+        scheduler.run()
+
+
+def test_resume(monkeypatch, tmp_path):
+    """Resumed run skips steps which already succeeded."""
+    path = str(tmp_path / "journal.jsonl")
+    phases = [
+        {"name": "prep", "steps": [{"name": "install"}, {"name": "configure"}]},
+        {"name": "test", "steps": [{"name": "test"}]},
+    ]
+    state = fake_steps(monkeypatch, rcs={"configure": 1})
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60, Journal(path)) == 1
+    assert state["order"] == ["install", "configure"]
+
+    state = fake_steps(monkeypatch)
+    journal = Journal(path, resume=True)
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60, journal) == 0
+    assert state["order"] == ["configure", "test"]
+
+    # changed definition of a step runs it again
+    phases[0]["steps"][0]["timeout"] = 10
+    state = fake_steps(monkeypatch)
+    journal = Journal(path, resume=True)
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60, journal) == 0
+    assert state["order"] == ["install"]
+
+
+def test_run_report(monkeypatch, tmp_path):
+    """Report contains all finished phases and steps."""
+    fake_steps(monkeypatch, rcs={"bad": 3})
+    phases = [
+        {"name": "prep", "steps": [{"name": "good"}]},
+        {"name": "test", "steps": [{"name": "bad"}]},
+    ]
+    report = RunReport()
+    rc = runner.run_phases(phases, {}, "metadata.yaml", 60, report=report)
+    assert rc == 3
+
+    report.write_json(tmp_path / "report.json", rc)
+    data = json.loads((tmp_path / "report.json").read_text())
+    assert data["rc"] == 3
+    assert [phase["name"] for phase in data["phases"]] == ["prep", "test"]
+    assert data["phases"][1]["steps"][0]["rc"] == 3
+    assert data["phases"][0]["steps"][0]["wall"] >= 0.05
+
+    report.write_junit(tmp_path / "report.xml", rc)
+    suites = ElementTree.parse(tmp_path / "report.xml").getroot()
+    assert [suite.get("failures") for suite in suites] == ["0", "1"]
+
+
+def test_module_batch(monkeypatch, tmp_path):
+    """Consecutive module steps run in one playbook, each with own result."""
+    monkeypatch.chdir(tmp_path)
+    playbook = tmp_path / "ansible-playbook"
+    playbook.write_text(
+        """#!/bin/sh
+echo started >> calls
+echo '{"event":"task_start","name":"ping"}'
+echo '{"event":"result","host":"h1","status":"ok","output":"h1 | SUCCESS"}'
+echo '{"event":"task_start","name":"shell false"}'
+echo '[WARNING]: from ansible'
+echo '{"event":"result","host":"h1","status":"failed","output":"h1 | FAILED"}'
+echo '{"event":"stats"}'
+exit 2
+"""
+    )
+    playbook.chmod(0o755)
+    monkeypatch.setattr(module, "ANSIBLE_PLAYBOOK", str(playbook))
+    register_steps()
+    steps = [
+        {"module": "ping"},
+        {"module": "shell", "arguments": "false"},
+        {"module": "ping"},
+    ]
+    phases = [{"name": "prep", "steps": steps}]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60) == 2
+
+    assert (tmp_path / "calls").read_text() == "started\n"
+    logs = tmp_path / ".te/logs/prep"
+    assert (logs / "1.log").read_text() == "h1 | SUCCESS\n"
+    assert (logs / "2.log").read_text() == "[WARNING]: from ansible\nh1 | FAILED\n"
+    assert not (logs / "3.log").exists()
+
+
+def test_module_batch_resume(monkeypatch, tmp_path):
+    """Steps skipped in resumed run are left out of the batch."""
+    monkeypatch.chdir(tmp_path)
+    playbook = tmp_path / "ansible-playbook"
+    playbook.write_text(
+        """#!/bin/sh
+for last; do :; done
+cp "$last" playbook.json
+echo '{"event":"task_start","name":"ping"}'
+echo '{"event":"result","host":"h1","status":"ok","output":"h1 | SUCCESS"}'
+echo '{"event":"task_start","name":"ping"}'
+echo '{"event":"result","host":"h1","status":"ok","output":"h1 | SUCCESS"}'
+echo '{"event":"stats"}'
+"""
+    )
+    playbook.chmod(0o755)
+    monkeypatch.setattr(module, "ANSIBLE_PLAYBOOK", str(playbook))
+    register_steps()
+    steps = [{"module": "ping"}, {"module": "ping"}, {"module": "ping"}]
+    path = str(tmp_path / "journal.jsonl")
+    Journal(path).record("prep", "3", steps[2], 0, time.time(), 0.1)
+    journal = Journal(path, resume=True)
+    phases = [{"name": "prep", "steps": steps}]
+    assert runner.run_phases(phases, {}, "metadata.yaml", 60, journal) == 0
+
+    tasks = json.loads((tmp_path / "playbook.json").read_text())[0]["tasks"]
+    assert len(tasks) == 2
@@ -0,0 +1,19 @@
+import os
+
+from te.common.config import config
+from te.common.ssh import ConnectionPool
+
+
+def test_pool_options(monkeypatch):
+    """Connections share control sockets which are removed on close."""
+    pool = ConnectionPool()
+    options = pool.options()
+    assert "ControlMaster=auto" in options
+    control_dir = os.path.dirname(pool.control_path)
+    assert os.path.isdir(control_dir)
+
+    pool.close()
+    assert not os.path.exists(control_dir)
+
+    monkeypatch.setitem(config, "ssh_multiplexing", False)
+    assert pool.options() == []
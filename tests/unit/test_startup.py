@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import te
+
+# Modules which are slow to import and not needed for every CLI invocation
+HEAVY_MODULES = ["requests", "yaml", "pkg_resources", "te.steps.playbook"]
+
+SCRIPT = """
+import json, sys
+from te import cli
+try:
+    cli.run()
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def imported_modules(args, cwd):
+    """Get modules imported by te CLI called with args."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(te.__file__))
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT] + args,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode().splitlines()[-1])
+
+
+def test_help_imports(tmp_path):
+    """Help doesn't import heavy modules nor creates runner.log."""
+    modules = imported_modules(["--help"], tmp_path)
+    assert not set(HEAVY_MODULES) & set(modules)
+    assert not (tmp_path / "runner.log").exists()
+
+
+def test_local_metadata_imports(tmp_path):
+    """Dry run with local, already parsed metadata imports only needed modules."""
+    (tmp_path / "metadata.yaml").write_text(
+        "phases:\n  - name: test\n    steps:\n      - command: echo test\n"
+    )
+    imported_modules(["metadata.yaml", "--dry-run"], tmp_path)
+    modules = imported_modules(["metadata.yaml", "--dry-run"], tmp_path)
+    assert "te.steps.command" in modules
+    assert not set(HEAVY_MODULES) & set(modules)
+
+
+def test_dry_run_keeps_logs(tmp_path):
+    """Dry run appends to runner.log even when logs are rotated."""
+    (tmp_path / "metadata.yaml").write_text(
+        "phases:\n  - name: test\n    steps:\n      - command: echo test\n"
+    )
+    (tmp_path / "runner.log").write_text("previous run\n")
+    imported_modules(["metadata.yaml", "--dry-run", "--log-keep", "2"], tmp_path)
+    assert not (tmp_path / "runner.log.1").exists()
+    log = (tmp_path / "runner.log").read_text()
+    assert log.startswith("previous run\n") and len(log.splitlines()) > 1
@@ -1,6 +1,51 @@
-from te.common.step import StepTypes, step_types
+from te.common.step import StepType, StepTypes, step_types
+from te.steps import register_steps
 
 
 def test_smoke():
     """Smoke test of Step registration."""
     assert isinstance(step_types, StepTypes)
+
+
+class KeyStep(StepType):
+    keys = ("key",)
+
+    def __init__(self, options):
+        self.options = options
+
+    @staticmethod
+    def match(options):
+        return "key" in options
+
+
+class FallbackStep(KeyStep):
+    keys = ()
+
+    @staticmethod
+    def match(options):
+        return "fallback" in options
+
+
+class EarlyFallbackStep(FallbackStep):
+    priority = -1
+
+
+def test_resolve_by_key():
+    """Step types are resolved by key, then by match in priority order."""
+    registry = StepTypes()
+    registry.register(FallbackStep)
+    registry.register(KeyStep)
+    registry.register(EarlyFallbackStep)
+
+    assert isinstance(registry.resolve({"key": 1, "fallback": 1}), KeyStep)
+    assert type(registry.resolve({"fallback": 1})) is EarlyFallbackStep
+    assert registry.resolve({"unknown": 1}) is None
+
+
+def test_builtin_steps():
+    """Build-in steps are imported on first use."""
+    register_steps()
+    step = step_types.resolve({"command": "true"})
+    assert type(step).__name__ == "CommandStep"
+    step = step_types.resolve({"playbook": "test.yaml"})
+    assert type(step).__name__ == "PlaybookStep"
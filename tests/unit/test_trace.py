@@ -0,0 +1,83 @@
+import asyncio
+import json
+import threading
+
+from te.common.process import common_popen_args, engine, run, run_async
+from te.common.trace import Tracer, tracer
+
+
+def test_trace_spans(tmp_path):
+    """Spans are written as complete events in track of their thread."""
+    trace = Tracer()
+    with trace.span("disabled", "test"):
+        pass
+    trace.enable()
+
+    with trace.span("outer", "test") as args:
+        args["rc"] = 0
+        with trace.span("nested", "test"):
+            pass
+
+    def in_thread():
+        with trace.span("thread", "test"):
+            pass
+
+    thread = threading.Thread(target=in_thread)
+    thread.start()
+    thread.join()
+
+    trace.write(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert set(spans) == {"outer", "nested", "thread"}
+    assert spans["thread"]["tid"] != spans["outer"]["tid"]
+    assert spans["outer"]["args"] == {"rc": 0}
+    assert spans["nested"]["tid"] == spans["outer"]["tid"]
+    assert spans["nested"]["ts"] >= spans["outer"]["ts"]
+    assert spans["nested"]["dur"] <= spans["outer"]["dur"]
+
+
+def test_trace_process(monkeypatch, tmp_path):
+    """Processes run by the engine are shown in track of their caller."""
+    monkeypatch.setattr(tracer, "enabled", True)
+    monkeypatch.setattr(tracer, "_events", [])
+    with tracer.span("step", "step"):
+        run(["true"], common_popen_args())
+
+    tracer.write(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert spans["true"]["args"] == {"cmd": "true", "rc": 0}
+    assert spans["true"]["tid"] == spans["step"]["tid"]
+    assert spans["spawn"]["tid"] == spans["step"]["tid"]
+
+
+def test_trace_concurrent_processes(monkeypatch, tmp_path):
+    """Concurrent processes of a step are shown in their own tracks."""
+    monkeypatch.setattr(tracer, "enabled", True)
+    monkeypatch.setattr(tracer, "_events", [])
+    monkeypatch.setattr(tracer, "_tracks", set())
+    monkeypatch.setattr(tracer, "_lanes", {})
+
+    async def run_both():
+        return await asyncio.gather(
+            *[run_async(["sleep", "0.1"], common_popen_args()) for _ in range(2)]
+        )
+
+    with tracer.span("step", "step"):
+        assert engine.submit(run_both()).result() == [0, 0]
+
+    tracer.write(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    step = next(event for event in events if event["name"] == "step")
+    tracks = {event["tid"] for event in events if event["name"] == "sleep"}
+    assert len(tracks) == 2 and step["tid"] in tracks
+    names = {
+        event["tid"]: event["args"]["name"]
+        for event in events
+        if event["name"] == "thread_name"
+    }
+    lane = (tracks - {step["tid"]}).pop()
+    assert names[lane] == f"{names[step['tid']]} #2"
+    spawns = [event for event in events if event["name"] == "spawn"]
+    assert {event["tid"] for event in spawns} == tracks